@@ -0,0 +1,936 @@
+import socket  # Library for network communication
+import threading  # Library for running the seeder and proxy in the background
+import queue  # Library for the delayed delivery queue of the proxy
+import time  # Library for time measurement
+import os  # Library for creating the benchmark file
+import sys  # Library for reading the benchmark name from the command line
+import io  # Library for silencing the per-transfer prints
+import contextlib  # Library for redirecting stdout
+import tempfile  # Library for a scratch directory
+import random  # Library for generating synthetic peer populations
+import json  # Library for building tracker datagrams
+import asyncio  # Library for running the tracker event loop
+import multiprocessing  # Library for generating tracker load from another process
+import tracemalloc  # Library for measuring tracker memory
+import subprocess  # Library for running the tracker, seeders and leechers as separate processes
+import signal  # Library for stopping those processes the way Ctrl+C would
+import select  # Library for waiting for the frames of a raw leecher
+from pathlib import Path  # Library to work with file system paths
+import TCP_Client
+import TCP_Server
+import UDP_Server
+import Tracker_State
+import File_Catalog
+import Piece_Manifest
+import Piece_Scheduler
+import Piece_Hashing
+import Piece_Writer
+import Transfer_Metrics
+import Media_Stream
+import Peer_Protocol
+import Peer_Session
+import Upload_Shaping
+import Piece_Cache
+
+# Run with: python Benchmark.py window [rtt_ms] [file_size_mb]
+#           python Benchmark.py serving [file_size_mb] [chunk_kb]
+#           python Benchmark.py swarm [rtt_ms] [file_size_mb] [window]
+#           python Benchmark.py tracker [peers] [files]
+#           python Benchmark.py announce [peers] [seconds]
+#           python Benchmark.py journal [peers] [files]
+#           python Benchmark.py memory [peers]
+#           python Benchmark.py catalog [files] [file_size_kb]
+#           python Benchmark.py pieces [small_file_mb] [large_file_mb]
+#           python Benchmark.py e2e [seeders] [leechers] [file_size_mb] [rtt_ms] [loss_percent] [bandwidth_mbps] [stagger_ms]
+#           python Benchmark.py sessions [files] [file_size_kb] [rtt_ms] [parallel]
+#           python Benchmark.py streaming [file_size_mb] [bandwidth_mbps] [rtt_ms] [read_kb]
+#           python Benchmark.py hashing [total_mb]
+#           python Benchmark.py disk [file_size_mb] [disk_mbps] [write_latency_ms]
+#           python Benchmark.py shaping [rate_mbps] [seconds]
+#           python Benchmark.py crowd [leechers] [file_size_mb] [seconds] [cache_mb]
+BENCHMARK_FILE = "benchmark.bin"  # Name of the generated file that is transferred
+WINDOW_SIZES = [1, 4, 16, 64, 128]  # Window sizes compared by the window benchmark
+SERVING_MODES = ["read", "mmap", "sendfile", "cache"]  # Seeder serving paths compared by the serving benchmark
+SHAPING_TOLERANCE = 0.1  # Rates achieved under upload limits must be within this fraction of the expected ones
+SWARM_SIZES = [1, 2, 4]  # Numbers of seeders compared by the swarm benchmark
+TRACKER_MEMORY_SIZES = [100000, 1000000]  # Peer counts compared by the memory benchmark
+SCRIPT_FOLDER = Path(__file__).resolve().parent  # Folder of TCP_Client.py, TCP_Server.py and UDP_Server.py
+E2E_TIMEOUT_SECONDS = 300  # Leechers still running this long after the first one started are stopped and count as failed
+PROXY_MIN_RTO_SECONDS = 0.2  # Smallest retransmission timeout the proxy applies to a lost read
+PIECE_SIZES = [4096, 65536, 262144, 1048576, 4194304, None]  # Piece sizes compared by the pieces benchmark (None = chosen from the file size)
+HASH_PIECE_SIZES = [4096, 65536, 262144, 1048576, 4194304]  # Piece sizes compared by the hashing benchmark
+SESSION_MODES = [("connection per file", False, False), ("pooled session", True, False), ("pooled, parallel", True, True)]  # (label, keep sessions, parallel streams)
+
+
+def create_benchmark_file(folder, size):
+    """Create a file of random bytes to transfer."""
+    file_path = Path(folder) / BENCHMARK_FILE
+    file_path.write_bytes(os.urandom(size))
+    return file_path
+
+
+def start_seeder(folder):
+    """Start a seeder on an ephemeral port that serves every connection it accepts."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(TCP_Server.MAX_NUMBER_OF_CLIENTS_IN_QUEUE)
+    threading.Thread(target=TCP_Server.serve_files, args=(listener, [BENCHMARK_FILE], Path(folder)), daemon=True).start()
+    return listener.getsockname()
+
+
+def start_network_proxy(target_address, rtt_seconds, loss=0.0, bandwidth=None):
+    """
+    Start a TCP proxy that delays every byte by half the round trip time in each direction.
+    With loss, that fraction of the reads is held back for a retransmission timeout as a lost segment would be,
+    and everything behind it waits too; bandwidth caps each direction in bytes per second.
+    Returns the address leechers should connect to instead of target_address.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(TCP_Server.MAX_NUMBER_OF_CLIENTS_IN_QUEUE)
+
+    def pump(source, destination):
+        pending = queue.Queue()  # (delivery time, data) in arrival order
+
+        def deliver():
+            link_free = 0.0  # Time the link has sent everything before the current data
+            while True:
+                due, data = pending.get()
+                if data is None:
+                    try:
+                        destination.shutdown(socket.SHUT_WR)  # Forward the end of stream
+                    except OSError:
+                        pass
+                    return
+                due = max(due, link_free)
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    destination.sendall(data)
+                except OSError:
+                    return
+                if bandwidth:
+                    link_free = due + len(data) / bandwidth
+
+        threading.Thread(target=deliver, daemon=True).start()
+        try:
+            while data := source.recv(65536):
+                due = time.monotonic() + rtt_seconds / 2
+                if loss and random.random() < loss:
+                    due += max(PROXY_MIN_RTO_SECONDS, 2 * rtt_seconds)  # Resent after a retransmission timeout
+                pending.put((due, data))
+        except OSError:
+            pass
+        pending.put((0, None))
+
+    def accept_loop():
+        while True:
+            client, _ = listener.accept()
+            upstream = socket.create_connection(target_address)
+            for end in (client, upstream):
+                end.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=pump, args=(client, upstream), daemon=True).start()
+            threading.Thread(target=pump, args=(upstream, client), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()
+
+
+def timed_download(addresses, save_path):
+    """Download the benchmark file from the seeders at addresses and return the elapsed seconds."""
+    start = time.perf_counter()
+    TCP_Client.swarm_download(addresses, BENCHMARK_FILE, save_path)
+    return time.perf_counter() - start
+
+
+def benchmark_window(rtt_ms=20.0, file_size_mb=2.0):
+    """Measure download throughput for several request window sizes over a delayed loopback link."""
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = create_benchmark_file(folder, int(file_size_mb * 1024 * 1024))
+        proxy_address = start_network_proxy(start_seeder(folder), rtt_ms / 1000)
+        print(f"File size: {file_size_mb} MB, round trip time: {rtt_ms} ms")
+        print(f"{'window':>8} {'seconds':>10} {'MB/s':>10}")
+        for window_size in WINDOW_SIZES:
+            TCP_Client.WINDOW_SIZE = window_size
+            save_path = Path(folder) / f"download_{window_size}.bin"
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed = timed_download([proxy_address], save_path)
+            assert save_path.read_bytes() == file_path.read_bytes(), "Downloaded file differs from the original"
+            print(f"{window_size:>8} {elapsed:>10.3f} {file_size_mb / elapsed:>10.2f}")
+
+
+def benchmark_serving(file_size_mb=32.0, chunk_kb=4.0):
+    """Compare seeder throughput and CPU time per MB for each serving mode."""
+    TCP_Server.CHUNK_SIZE = int(chunk_kb * 1024)  # Leechers follow the chunk size of the manifest
+    TCP_Client.KEEP_SESSIONS = False  # The seeder records its CPU time when the connection of a transfer ends
+    uploads = []  # Upload records of the benchmark seeder, one per transfer
+
+    def serve(listener, folder):
+        while True:
+            connection_socket, _ = listener.accept()
+            connection_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            upload = Upload_Shaping.create_upload()
+            TCP_Server.handle_leecher(connection_socket, [BENCHMARK_FILE], Path(folder), upload)
+            Upload_Shaping.remove_upload(upload)
+            connection_socket.close()
+            uploads.append(upload)
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = create_benchmark_file(folder, int(file_size_mb * 1024 * 1024))
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(TCP_Server.MAX_NUMBER_OF_CLIENTS_IN_QUEUE)
+        threading.Thread(target=serve, args=(listener, folder), daemon=True).start()
+        print(f"File size: {file_size_mb} MB, piece size: {chunk_kb} KiB, window: {TCP_Client.WINDOW_SIZE}")
+        print(f"{'mode':>10} {'seconds':>10} {'MB/s':>10} {'seeder CPU ms/MB':>18}")
+        for mode in SERVING_MODES:
+            Peer_Session.SERVING_MODE = mode
+            save_path = Path(folder) / f"download_{mode}.bin"
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed = timed_download([listener.getsockname()], save_path)
+                while len(uploads) < SERVING_MODES.index(mode) + 1:
+                    time.sleep(0.01)  # Wait for the seeder to record its CPU time
+            assert save_path.read_bytes() == file_path.read_bytes(), "Downloaded file differs from the original"
+            cpu_ms_per_mb = 1000 * uploads[-1]["cpu_seconds"] / file_size_mb
+            print(f"{mode:>10} {elapsed:>10.3f} {file_size_mb / elapsed:>10.2f} {cpu_ms_per_mb:>18.2f}")
+
+
+def benchmark_swarm(rtt_ms=20.0, file_size_mb=4.0, window=16):
+    """
+    Measure download throughput from 1, 2 and 4 seeders behind delayed links.
+    Each link is limited by window / round trip time, so throughput should scale with the seeders.
+    """
+    TCP_Client.WINDOW_SIZE = int(window)
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = create_benchmark_file(folder, int(file_size_mb * 1024 * 1024))
+        proxies = [start_network_proxy(start_seeder(folder), rtt_ms / 1000) for _ in range(max(SWARM_SIZES))]
+        print(f"File size: {file_size_mb} MB, round trip time: {rtt_ms} ms, window: {TCP_Client.WINDOW_SIZE}")
+        print(f"{'seeders':>8} {'seconds':>10} {'MB/s':>10}")
+        for seeders in SWARM_SIZES:
+            save_path = Path(folder) / f"download_{seeders}.bin"
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed = timed_download(proxies[:seeders], save_path)
+            assert save_path.read_bytes() == file_path.read_bytes(), "Downloaded file differs from the original"
+            print(f"{seeders:>8} {elapsed:>10.3f} {file_size_mb / elapsed:>10.2f}")
+
+
+class Datagram_Counter:
+    """Stands in for the tracker socket and counts the datagrams it would send."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def sendto(self, data, address):
+        self.sent += 1
+
+
+def tracker_announces(peers, files):
+    """
+    Yield (announce, address) for half the peers as seeders of three random files and half as leechers of one file.
+    Every announce gets its own strings, as if it had just been decoded from a datagram.
+    """
+    for number in range(peers):
+        address = (f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}", 20000 + number % 1000)
+        if number % 2:
+            yield {"type_of_peer": "CS", "file_id": [f"file_{file}.bin" for file in random.sample(range(files), 3)], "tcp_port": 12500}, address
+        else:
+            yield {"type_of_peer": "L", "file_id": f"file_{random.randrange(files)}.bin"}, address
+
+
+def create_tracker_population(peers, files):
+    """Register the announces of tracker_announces the way the tracker does."""
+    log_seeders, log_leechers, file_index = {}, {}, {}
+    for announce, address in tracker_announces(peers, files):
+        if announce["type_of_peer"] == "CS":
+            UDP_Server.register_seeder(log_seeders, file_index, announce, address)
+        else:
+            UDP_Server.write_log(log_leechers, announce, address)
+    return log_seeders, log_leechers, file_index
+
+
+def create_dict_population(peers, files):
+    """The original peer table: one dict per peer under an "ip_port" string key."""
+    log_seeders, log_leechers, file_index = {}, {}, {}
+    for announce, address in tracker_announces(peers, files):
+        custom_key = f"{address[0]}_{address[1]}"
+        log = log_seeders if announce["type_of_peer"] == "CS" else log_leechers
+        log[custom_key] = {"id": announce["type_of_peer"], "ip": address[0], "port": address[1], "file_id": announce["file_id"],
+                           "tcp_port": announce.get("tcp_port"), "last_seen": time.time()}
+        if log is log_seeders:
+            UDP_Server.index_peer(file_index, custom_key, announce["file_id"])
+    return log_seeders, log_leechers, file_index
+
+
+def scan_matches(log_seeders, log_leechers, matches):
+    """The original matching sweep: every leecher against every seeder."""
+    found = 0
+    for leecher_ip_port, leecher_data in log_leechers.items():
+        for seeder_ip_port, seeder_data in log_seeders.items():
+            search_key = UDP_Server.create_match_key(seeder_ip_port, leecher_ip_port)
+            if leecher_data.file_id in seeder_data.file_id and search_key not in matches:
+                matches[search_key] = {"match_made_time": time.time()}
+                found += 1
+    return found
+
+
+def benchmark_tracker(peers=10000, files=2000):
+    """Compare one matching sweep of the indexed tracker with the leecher x seeder scan."""
+    peers, files = int(peers), int(files)
+    log_seeders, log_leechers, file_index = create_tracker_population(peers, files)
+    print(f"Peers: {peers} ({len(log_seeders)} seeders, {len(log_leechers)} leechers), files: {files}")
+
+    start = time.perf_counter()
+    scanned = scan_matches(log_seeders, log_leechers, {})
+    scan_seconds = time.perf_counter() - start
+
+    counter = Datagram_Counter()
+    start = time.perf_counter()
+    UDP_Server.match_peers(counter, log_seeders, log_leechers, file_index, {})
+    index_seconds = time.perf_counter() - start
+
+    print(f"{'matching':>10} {'seconds':>10} {'matches':>10}")
+    print(f"{'scan':>10} {scan_seconds:>10.3f} {scanned:>10}")
+    print(f"{'index':>10} {index_seconds:>10.3f} {counter.sent // 2:>10}  (at most {UDP_Server.MAX_MATCHED_SEEDERS} per leecher)")
+
+
+def start_tracker():
+    """Run a tracker on an ephemeral UDP port in a background event loop; returns (protocol, address)."""
+    started = {}
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        transport, protocol = loop.run_until_complete(
+            loop.create_datagram_endpoint(UDP_Server.Tracker_Protocol, local_addr=("127.0.0.1", 0)))
+        started["protocol"], started["address"] = protocol, transport.get_extra_info("sockname")
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return started["protocol"], started["address"]
+
+
+def flood_tracker(tracker_address, peers, seconds, results):
+    """Announce peers from their own sockets, then send AVAILABLE datagrams as fast as possible."""
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(peers)]
+    for number, peer_socket in enumerate(sockets):
+        peer_type = "CS" if number % 2 else "L"
+        announce = {"message_type": "DISCOVER_PEER", "type_of_peer": peer_type, "file_id": [f"file_{number % 100}.bin"] if number % 2 else f"file_{number % 100}.bin", "tcp_port": 12500}
+        peer_socket.sendto(json.dumps(announce).encode(), tracker_address)
+        peer_socket.setblocking(False)
+    available = [json.dumps({"message_type": "AVAILABLE", "type_of_peer": "CS" if number % 2 else "L"}).encode() for number in range(peers)]
+    sent = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for number, peer_socket in enumerate(sockets):
+            try:
+                peer_socket.sendto(available[number], tracker_address)
+                sent += 1
+            except BlockingIOError:
+                pass
+    results.put(sent)
+
+
+def benchmark_announce(peers=500, seconds=3.0):
+    """Measure how many announce datagrams per second the tracker handles."""
+    peers = int(peers)
+    with contextlib.redirect_stdout(io.StringIO()):
+        protocol, tracker_address = start_tracker()
+    results = multiprocessing.Queue()
+    flooder = multiprocessing.Process(target=flood_tracker, args=(tracker_address, peers, seconds, results))
+    flooder.start()
+    sent = results.get()
+    flooder.join()
+    time.sleep(0.2)  # Let the tracker drain its receive buffer
+    received = protocol.datagrams_received
+    print(f"Peers: {peers}, seconds: {seconds}")
+    print(f"Datagrams offered:  {sent / seconds:>10.0f} per second")
+    print(f"Datagrams handled:  {received / seconds:>10.0f} per second")
+    print(f"Datagrams sent by tracker: {protocol.datagrams_sent} (ANNOUNCE_OK, MATCH_FOUND and PING)")
+    print(f"Steady state keepalive traffic for {peers} peers: {peers / UDP_Server.ANNOUNCE_INTERVAL_SECONDS:.0f} datagrams per second "
+          f"(one announce per peer every {UDP_Server.ANNOUNCE_INTERVAL_SECONDS} s, no PINGs while peers keep announcing)")
+
+
+def create_announces(peers, files):
+    """Build DISCOVER_PEER datagrams for half seeders of three random files and half leechers of one file."""
+    catalog = [f"file_{number}.bin" for number in range(files)]
+    announces = []
+    for number in range(peers):
+        address = (f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}", 20000 + number % 1000)
+        if number % 2:
+            announce = {"message_type": "DISCOVER_PEER", "type_of_peer": "CS", "file_id": random.sample(catalog, 3), "tcp_port": 12500}
+        else:
+            announce = {"message_type": "DISCOVER_PEER", "type_of_peer": "L", "file_id": random.choice(catalog)}
+        announces.append((json.dumps(announce).encode(), address))
+    return announces
+
+
+def benchmark_journal(peers=100000, files=20000):
+    """
+    Measure the cost of journaling announces and how long a restarted tracker takes to restore its state,
+    after a quarter of the peers left and took their matches with them. The worst case restores a snapshot
+    plus a journal that has just reached its compaction limit, filled by those peers leaving and coming back.
+    """
+    peers, files = int(peers), int(files)
+    announces = create_announces(peers, files)
+
+    async def run(folder):
+        state_path = Path(folder) / "tracker_state"
+        announce_seconds = {}
+        for label, path in [("in memory", None), ("journaled", state_path)]:
+            protocol = UDP_Server.Tracker_Protocol(path)
+            protocol.connection_made(Datagram_Counter())
+            start = time.perf_counter()
+            for message, address in announces:
+                protocol.datagram_received(message, address)
+            if protocol.journal is not None:
+                Tracker_State.flush_journal(protocol.journal)
+            announce_seconds[label] = time.perf_counter() - start
+        snapshot_path, journal_path = Tracker_State.state_paths(state_path)
+        report = [f"Peers: {peers}, files: {files}, matches: {UDP_Server.count_matches(protocol.matches)}"]
+        for _, address in announces[::4]:  # These peers go silent and expire
+            key = UDP_Server.create_custom_key(*address)
+            protocol.remove_peer("S" if key in protocol.log_seeders else "L", key)
+        Tracker_State.flush_journal(protocol.journal)
+        report.append(f"After {len(announces[::4])} peers left: {UDP_Server.count_matches(protocol.matches)} matches")
+        report.append(f"Journal: {protocol.journal['records']} records, {journal_path.stat().st_size / 1e6:.1f} MB")
+        for label, seconds in announce_seconds.items():
+            report.append(f"Announce {label:<10} {seconds:>8.3f} s ({seconds / peers * 1e6:.1f} us per announce)")
+        protocol.journal = None  # Crash: the state on disk is only the journal
+
+        for label in ["journal", "snapshot"]:  # A clean shutdown after the first restart compacts the journal into a snapshot
+            restarted = UDP_Server.Tracker_Protocol(state_path)
+            start = time.perf_counter()
+            restarted.connection_made(Datagram_Counter())
+            startup_seconds = time.perf_counter() - start
+            restored = len(restarted.log_seeders) + len(restarted.log_leechers)
+            report.append(f"Restart from {label:<9} {startup_seconds:>8.3f} s ({restored} peers and {UDP_Server.count_matches(restarted.matches)} matches restored)")
+            restarted.close_state()
+        report.append(f"Snapshot: {snapshot_path.stat().st_size / 1e6:.1f} MB")
+
+        restarted = UDP_Server.Tracker_Protocol(state_path)
+        restarted.connection_made(Datagram_Counter())
+        limit = restarted.journal_limit()
+        while restarted.journal["records"] < limit:  # The peers that left come back and leave again
+            for message, address in announces[::4]:
+                restarted.datagram_received(message, address)
+                if restarted.journal["records"] >= limit:
+                    break
+            for _, address in announces[::4]:
+                key = UDP_Server.create_custom_key(*address)
+                restarted.remove_peer("S" if key in restarted.log_seeders else "L", key)
+                if restarted.journal["records"] >= limit:
+                    break
+        Tracker_State.flush_journal(restarted.journal)
+        restarted.journal = None  # Crash just before the journal would have been compacted
+        worst = UDP_Server.Tracker_Protocol(state_path)
+        start = time.perf_counter()
+        worst.connection_made(Datagram_Counter())
+        startup_seconds = time.perf_counter() - start
+        report.append(f"Restart worst case {startup_seconds:>7.3f} s (snapshot plus a journal of {limit} records, the compaction limit)")
+        start = time.perf_counter()
+        worst.compact_state()
+        report.append(f"Compaction         {time.perf_counter() - start:>7.3f} s (every {limit} journal records)")
+        worst.close_state()
+        return report
+
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as folder:
+        report = asyncio.run(run(folder))
+    print("\n".join(report))
+
+def benchmark_memory(peers=None):
+    """Compare the memory of the tracker's peer tables as dicts with string keys and as slotted records."""
+    print(f"{'peers':>10} {'layout':>8} {'MB':>10} {'bytes/peer':>12}")
+    for peer_count in TRACKER_MEMORY_SIZES if peers is None else [int(peers)]:
+        for layout, create_population in [("dict", create_dict_population), ("slots", create_tracker_population)]:
+            random.seed(peer_count)
+            tracemalloc.start()
+            population = create_population(peer_count, peer_count // 5)
+            used, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{peer_count:>10} {layout:>8} {used / 1e6:>10.1f} {used / peer_count:>12.0f}")
+            del population
+
+
+def benchmark_catalog(files=20000, file_size_kb=16.0):
+    """Compare seeder startup when every file is hashed up front with scanning the tree and hashing later."""
+    files = int(files)
+    with tempfile.TemporaryDirectory() as folder:
+        for number in range(files):
+            file_path = Path(folder) / f"folder_{number % 100}" / f"file_{number}.bin"
+            file_path.parent.mkdir(exist_ok=True)
+            file_path.write_bytes(os.urandom(int(file_size_kb * 1024)))
+        catalog = File_Catalog.create_catalog(folder, TCP_Server.CHUNK_SIZE)
+        start = time.perf_counter()
+        File_Catalog.refresh_catalog(catalog)
+        batches = list(TCP_Server.batch_file_names(sorted(catalog["files"])))
+        scan_seconds = time.perf_counter() - start
+        largest = max(len(json.dumps({"message_type": "ANNOUNCE_FILES", "added": batch, "removed": []}).encode()) for batch in batches)
+
+        start = time.perf_counter()
+        for name in catalog["files"]:
+            Piece_Manifest.build_manifest(Path(folder) / name, TCP_Server.CHUNK_SIZE)
+        hash_seconds = time.perf_counter() - start
+
+    print(f"Files: {files} of {file_size_kb} KiB in 100 folders")
+    print(f"Scan and batch announces: {scan_seconds:>8.3f} s ({len(batches)} datagrams, largest {largest} bytes)")
+    print(f"Hash every file up front: {hash_seconds:>8.3f} s")
+
+
+def benchmark_pieces(small_file_mb=1.0, large_file_mb=64.0):
+    """
+    Compare hashing and download time across piece sizes for a small and a large file.
+    Pieces are sent in blocks of at most BLOCK_SIZE, so only the number of hashes and piece requests changes.
+    """
+    for file_size_mb in [small_file_mb, large_file_mb]:
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = create_benchmark_file(folder, int(file_size_mb * 1024 * 1024))
+            seeder_address = start_seeder(folder)
+            print(f"File size: {file_size_mb} MB, block size: {TCP_Client.BLOCK_SIZE // 1024} KiB, window: {TCP_Client.WINDOW_SIZE} blocks")
+            print(f"{'piece KiB':>10} {'pieces':>8} {'manifest KB':>12} {'hash s':>8} {'seconds':>10} {'MB/s':>10}")
+            for piece_size in PIECE_SIZES:
+                TCP_Server.CHUNK_SIZE = piece_size
+                start = time.perf_counter()
+                manifest = Piece_Manifest.get_manifest(file_path, piece_size)  # Hashed before the transfer is timed
+                hash_seconds = time.perf_counter() - start
+                manifest_kb = len(json.dumps(Piece_Manifest.public_manifest(manifest))) / 1000
+                save_path = Path(folder) / f"download_{piece_size}.bin"
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed = timed_download([seeder_address], save_path)
+                assert save_path.read_bytes() == file_path.read_bytes(), "Downloaded file differs from the original"
+                label = f"auto {manifest['chunk_size'] // 1024}" if piece_size is None else str(piece_size // 1024)
+                print(f"{label:>10} {len(manifest['digests']):>8} {manifest_kb:>12.1f} {hash_seconds:>8.3f} {elapsed:>10.3f} {file_size_mb / elapsed:>10.2f}")
+            print()
+    TCP_Server.CHUNK_SIZE = None
+
+
+def free_port(socket_type):
+    """Return a loopback port that is free for the socket type right now."""
+    with socket.socket(socket.AF_INET, socket_type) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_script(script, arguments, folder):
+    """Start one of the peer scripts as a separate process working in folder, discarding its output."""
+    return subprocess.Popen([sys.executable, str(SCRIPT_FOLDER / script), *map(str, arguments)], cwd=folder,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop_processes(processes):
+    """Interrupt the processes so they write their final stats, killing any that do not exit."""
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+    for process in processes:
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def read_stats(stats_path):
+    """Return the metrics a process wrote to stats_path, or None if it wrote none."""
+    try:
+        return json.loads(Path(stats_path).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def distribution(values):
+    """Describe the spread of values as min, median, 90th percentile and max."""
+    if not values:
+        return "no samples"
+    ordered = sorted(values)
+    percentile = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return f"min {ordered[0]:.3f}  p50 {percentile(0.5):.3f}  p90 {percentile(0.9):.3f}  max {ordered[-1]:.3f}"
+
+
+def benchmark_e2e(seeders=2, leechers=4, file_size_mb=16.0, rtt_ms=0.0, loss_percent=0.0, bandwidth_mbps=0.0, stagger_ms=0.0):
+    """
+    Run a tracker, seeders and leechers as separate processes on loopback and time the whole downloads.
+    Leechers get their answers on the command line instead of prompting. With rtt_ms, loss_percent or
+    bandwidth_mbps, every seeder is reached through a proxy with those conditions; leechers trading pieces
+    with each other connect directly. Times come from the stats file each process writes.
+    """
+    seeders, leechers = int(seeders), int(leechers)
+    shaped = rtt_ms or loss_percent or bandwidth_mbps
+    with tempfile.TemporaryDirectory() as folder:
+        server_folder = Path(folder) / "Server"
+        server_folder.mkdir()
+        file_path = create_benchmark_file(server_folder, int(file_size_mb * 1024 * 1024))
+        Piece_Manifest.get_manifest(file_path, None)  # Hashed up front so seeders only load the cached manifest
+        tracker_port = free_port(socket.SOCK_DGRAM)
+        processes = [start_script("UDP_Server.py", [tracker_port], folder)]
+        seeder_ports = []
+        clients = []
+        try:
+            time.sleep(0.5)  # Let the tracker bind its port
+            for _ in range(seeders):
+                port = free_port(socket.SOCK_STREAM)
+                announced_port = port
+                if shaped:
+                    announced_port = start_network_proxy(("127.0.0.1", port), rtt_ms / 1000, loss_percent / 100, bandwidth_mbps * 125000)[1]
+                processes.append(start_script("TCP_Server.py", [port, server_folder, tracker_port, announced_port], folder))
+                seeder_ports.append(port)
+            time.sleep(1)  # Let the seeders announce their files
+            start = time.monotonic()
+            for number in range(leechers):
+                clients.append(start_script("TCP_Client.py", [f"leecher_{number}", BENCHMARK_FILE, "No", tracker_port], folder))
+                time.sleep(stagger_ms / 1000)
+            for client in clients:
+                try:
+                    client.wait(max(0.1, start + E2E_TIMEOUT_SECONDS - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    pass
+            wall_seconds = time.monotonic() - start
+        finally:
+            stop_processes(clients + processes[1:])
+            stop_processes(processes[:1])  # The tracker last, so its CPU time covers the whole run
+
+        original = file_path.read_bytes()
+        client_stats = [read_stats(Path(folder) / f"leecher_{number}{TCP_Client.STATS_SUFFIX}") or {} for number in range(leechers)]
+        completed = [stats for number, stats in enumerate(client_stats)
+                     if "download.completed_seconds" in stats.get("gauges", {})
+                     and (Path(folder) / f"leecher_{number}" / BENCHMARK_FILE).read_bytes() == original]
+        first_piece = [stats["gauges"]["download.first_piece_seconds"] for stats in completed]
+        completion = [stats["gauges"]["download.completed_seconds"] for stats in completed]
+        seeder_stats = [read_stats(Path(folder) / f"seeder_{port}{TCP_Client.STATS_SUFFIX}") or {} for port in seeder_ports]
+        seeder_bytes = sum(stats.get("counters", {}).get("upload.bytes", 0) for stats in seeder_stats)
+        leecher_bytes = sum(stats.get("counters", {}).get("upload.bytes", 0) for stats in client_stats)
+        tracker_stats = read_stats(Path(folder) / UDP_Server.TRACKER_STATS_PATH) or {"cpu_seconds": 0, "counters": {}}
+
+    print(f"{seeders} seeder(s), {leechers} leecher(s), {file_size_mb} MB file, round trip {rtt_ms} ms, "
+          f"loss {loss_percent}%, bandwidth {bandwidth_mbps or 'unlimited'} Mbit/s per seeder link, stagger {stagger_ms} ms")
+    print(f"Completed downloads:          {len(completed)} of {leechers} (files checked against the original)")
+    print(f"Time to first piece (s):      {distribution(first_piece)}")
+    print(f"Completion time (s):          {distribution(completion)}")
+    print(f"Leecher throughput (MB/s):    {distribution([file_size_mb / seconds for seconds in completion])}")
+    print(f"Swarm throughput:             {len(completed) * file_size_mb / wall_seconds:.2f} MB/s over {wall_seconds:.3f} s")
+    print(f"Uploaded by seeders:          {seeder_bytes / 1e6:.1f} MB, by leechers: {leecher_bytes / 1e6:.1f} MB")
+    print(f"Tracker:                      {tracker_stats['cpu_seconds']:.3f} s CPU, "
+          f"{tracker_stats['counters'].get('tracker.datagrams_received', 0)} datagrams received, "
+          f"{tracker_stats['counters'].get('tracker.datagrams_sent', 0)} sent")
+
+
+def benchmark_sessions(files=200, file_size_kb=16.0, rtt_ms=20.0, parallel=8):
+    """
+    Measure the time to download many small files from one seeder behind a delayed link: with a new connection
+    per file, with one pooled session reused by every file, and with parallel transfers on that session.
+    """
+    names = [f"small_{number}.bin" for number in range(int(files))]
+    with tempfile.TemporaryDirectory() as folder:
+        for name in names:
+            (Path(folder) / name).write_bytes(os.urandom(int(file_size_kb * 1024)))
+            Piece_Manifest.get_manifest(Path(folder) / name, TCP_Server.CHUNK_SIZE)  # Hash before timing
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(TCP_Server.MAX_NUMBER_OF_CLIENTS_IN_QUEUE)
+        threading.Thread(target=TCP_Server.serve_files, args=(listener, names, Path(folder)), daemon=True).start()
+        proxy_address = start_network_proxy(listener.getsockname(), rtt_ms / 1000)
+        print(f"{len(names)} files of {file_size_kb} KiB, round trip time: {rtt_ms} ms, parallel transfers: {int(parallel)}")
+        print(f"{'mode':>20} {'seconds':>10} {'files/s':>10} {'ms/file':>10}")
+        for mode, (label, keep_sessions, parallel_streams) in enumerate(SESSION_MODES):
+            TCP_Client.KEEP_SESSIONS = keep_sessions
+            TCP_Client.close_sessions()
+            waiting = queue.Queue()
+            for name in names:
+                waiting.put(name)
+
+            def download_waiting():
+                while True:
+                    try:
+                        name = waiting.get_nowait()
+                    except queue.Empty:
+                        return
+                    TCP_Client.swarm_download([proxy_address], name, Path(folder) / f"download_{mode}" / name)
+
+            workers = [threading.Thread(target=download_waiting) for _ in range(int(parallel) if parallel_streams else 1)]
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+            elapsed = time.perf_counter() - start
+            for name in names:
+                downloaded = Path(folder) / f"download_{mode}" / name
+                assert downloaded.read_bytes() == (Path(folder) / name).read_bytes(), "Downloaded file differs from the original"
+            print(f"{label:>20} {elapsed:>10.3f} {len(names) / elapsed:>10.1f} {1000 * elapsed / len(names):>10.2f}")
+        TCP_Client.KEEP_SESSIONS = True
+
+
+def read_from(reader, offset, length):
+    """Read length bytes at offset from a Piece_Reader, which returns at most the rest of a piece per read."""
+    reader.seek(offset)
+    remaining = length
+    while remaining > 0:
+        data = reader.read(remaining)
+        if not data:
+            break
+        remaining -= len(data)
+
+
+def benchmark_streaming(file_size_mb=16.0, bandwidth_mbps=40.0, rtt_ms=20.0, read_kb=512.0):
+    """
+    Measure how long a player reading the file as it downloads over a bandwidth-limited link waits for the
+    first read_kb of the file, and then for read_kb from the middle after a seek, with and without the
+    playback window of the scheduler.
+    """
+    window = Piece_Scheduler.STREAM_WINDOW
+    read_bytes = int(read_kb * 1024)
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = create_benchmark_file(folder, int(file_size_mb * 1024 * 1024))
+        proxy_address = start_network_proxy(start_seeder(folder), rtt_ms / 1000, bandwidth=bandwidth_mbps * 125000)
+        print(f"File size: {file_size_mb} MB, bandwidth: {bandwidth_mbps} Mbit/s, round trip time: {rtt_ms} ms, reads of {read_kb} KiB")
+        print(f"{'mode':>14} {'first read s':>13} {'seek read s':>12} {'download s':>11}")
+        for label, stream_window in [("rarest first", 0), ("streaming", window)]:
+            Piece_Scheduler.STREAM_WINDOW = stream_window
+            save_path = Path(folder) / f"download_{stream_window}.bin"
+            download = threading.Thread(target=TCP_Client.swarm_download, args=([proxy_address], BENCHMARK_FILE, save_path), kwargs={"streaming": True})
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                download.start()
+                while TCP_Client.sharing.get(BENCHMARK_FILE, {}).get("save_path") != save_path:
+                    time.sleep(0.001)  # Wait for the manifest
+                shared = TCP_Client.sharing[BENCHMARK_FILE]
+                with Media_Stream.Piece_Reader(save_path, shared["manifest"], shared["swarm"]) as reader:
+                    read_from(reader, 0, read_bytes)
+                    first_read = time.perf_counter() - start
+                    seek_start = time.perf_counter()
+                    read_from(reader, reader.size // 2, read_bytes)
+                    seek_read = time.perf_counter() - seek_start
+                download.join()
+            elapsed = time.perf_counter() - start
+            assert save_path.read_bytes() == file_path.read_bytes(), "Downloaded file differs from the original"
+            print(f"{label:>14} {first_read:>13.3f} {seek_read:>12.3f} {elapsed:>11.3f}")
+        Piece_Scheduler.STREAM_WINDOW = window
+
+
+def benchmark_hashing(total_mb=64.0):
+    """Measure hashes per second and MB/s of every hash backend and piece size, on one thread and on the hash pool."""
+    data = memoryview(os.urandom(max(HASH_PIECE_SIZES)))
+    print(f"{total_mb} MB hashed per run, {Piece_Hashing.HASH_WORKERS} hash worker(s), batches of {Piece_Hashing.HASH_BATCH_BYTES // 1024} KiB")
+    print(f"{'algorithm':>10} {'piece KiB':>10} {'hashes/s':>10} {'MB/s':>8} {'pool hashes/s':>14} {'pool MB/s':>10}")
+    for hash_algorithm in Piece_Hashing.HASH_ALGORITHMS:
+        for piece_size in HASH_PIECE_SIZES:
+            piece = data[:piece_size]
+            pieces = max(int(total_mb * 1024 * 1024) // piece_size, 1)
+            start = time.perf_counter()
+            for _ in range(pieces):
+                Piece_Hashing.hash_piece(piece, hash_algorithm)
+            single = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in Piece_Hashing.hash_pieces((piece for _ in range(pieces)), hash_algorithm):
+                pass
+            pooled = time.perf_counter() - start
+            megabytes = pieces * piece_size / 1e6
+            print(f"{hash_algorithm:>10} {piece_size // 1024:>10} {pieces / single:>10.0f} {megabytes / single:>8.1f} "
+                  f"{pieces / pooled:>14.0f} {megabytes / pooled:>10.1f}")
+
+
+def slow_disk_write(write, disk_mbps, write_latency_ms):
+    """Wrap os.pwrite or os.pwritev so every call takes write_latency_ms plus its size at disk_mbps MB/s, like a slow disk."""
+    def slow_write(fd, data, offset):
+        size = sum(len(view) for view in data) if isinstance(data, list) else len(data)
+        time.sleep(write_latency_ms / 1000 + size / (disk_mbps * 1e6))
+        return write(fd, data, offset)
+    return slow_write
+
+
+def benchmark_disk(file_size_mb=32.0, disk_mbps=100.0, write_latency_ms=5.0):
+    """
+    Compare download throughput with pieces written on the receiving thread and by the write-behind writer,
+    on a simulated disk where every write takes write_latency_ms plus its size at disk_mbps MB/s.
+    """
+    real_pwrite, real_pwritev = os.pwrite, getattr(os, "pwritev", None)
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = create_benchmark_file(folder, int(file_size_mb * 1024 * 1024))
+        seeder_address = start_seeder(folder)
+        print(f"File size: {file_size_mb} MB, disk: {disk_mbps} MB/s with {write_latency_ms} ms per write")
+        print(f"{'mode':>14} {'seconds':>10} {'MB/s':>10} {'writes':>8}")
+        try:
+            os.pwrite = slow_disk_write(real_pwrite, disk_mbps, write_latency_ms)
+            if real_pwritev is not None:
+                os.pwritev = slow_disk_write(real_pwritev, disk_mbps, write_latency_ms)
+            for label, write_behind in [("inline", False), ("write-behind", True)]:
+                Piece_Writer.WRITE_BEHIND = write_behind
+                save_path = Path(folder) / f"download_{label}.bin"
+                writes = Transfer_Metrics.counters.get("download.writes", 0)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed = timed_download([seeder_address], save_path)
+                writes = Transfer_Metrics.counters.get("download.writes", 0) - writes
+                assert save_path.read_bytes() == file_path.read_bytes(), "Downloaded file differs from the original"
+                print(f"{label:>14} {elapsed:>10.3f} {file_size_mb / elapsed:>10.2f} {writes:>8}")
+        finally:
+            os.pwrite = real_pwrite
+            if real_pwritev is not None:
+                os.pwritev = real_pwritev
+            Piece_Writer.WRITE_BEHIND = True
+
+
+def leech(address, file_id, seconds, uploaded=0, window=64):
+    """
+    Request the pieces of file_id from a seeder over and over for seconds, keeping window blocks in flight and
+    reporting uploaded bytes shared with others; returns the bytes received. Like a real leecher it stops
+    requesting while choked.
+    """
+    leecher_socket = socket.create_connection(address)
+    leecher_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        Peer_Protocol.send_message(leecher_socket, {"message_type": "CONNECT"})
+        Peer_Protocol.recv_message(leecher_socket)
+        Peer_Protocol.send_message(leecher_socket, {"message_type": "REQUEST_FILE", "requested_file": file_id, "stream_id": 1, "uploaded": uploaded})
+        Peer_Protocol.recv_message(leecher_socket)  # BEGIN
+        manifest = Peer_Protocol.recv_message(leecher_socket)
+        chunk_size, block_size, file_size = manifest["chunk_size"], manifest["block_size"], manifest["file_size"]
+        pieces = -(-file_size // chunk_size)
+        received, outstanding, next_piece, choked = 0, 0, 0, False
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            while not choked and outstanding < window:
+                blocks = -(-min(chunk_size, file_size - next_piece * chunk_size) // block_size)
+                Peer_Protocol.send_message(leecher_socket, {"message_type": "REQUEST", "chunk_index": next_piece, "block_count": blocks, "stream_id": 1})
+                outstanding += blocks
+                next_piece = (next_piece + 1) % pieces
+            if not select.select([leecher_socket], [], [], 0.1)[0]:
+                continue
+            frame_type, payload = Peer_Protocol.recv_frame(leecher_socket)
+            if frame_type == Peer_Protocol.FRAME_CHUNK:
+                received += len(payload[3])
+                outstanding -= 1
+            elif payload.get("message_type") in ["CHOKE", "UNCHOKE"]:
+                choked = payload["message_type"] == "CHOKE"
+                outstanding = 0  # A choking seeder drops the requests in flight
+        return received
+    finally:
+        leecher_socket.close()
+
+
+def benchmark_shaping(rate_mbps=8.0, seconds=5.0):
+    """
+    Measure the upload rates a seeder achieves over loopback under a global, a per-connection and a per-file
+    limit of rate_mbps MB/s, and how choking shares a connection limit between one leecher that reports
+    uploading to others and three that do not, when the seeder sends to one leecher plus the optimistic unchoke.
+    Fails when a rate is off by more than SHAPING_TOLERANCE.
+    """
+    rate = rate_mbps * 1e6
+    other_file = "other.bin"
+    defaults = dict(Upload_Shaping.rate_limits)
+    Upload_Shaping.CHOKE_INTERVAL_SECONDS = 0.5
+    Upload_Shaping.start_upload_shaping()
+    # (label, limits, leechers as (group, file, reported upload), expected MB/s of each group)
+    scenarios = [
+        ("global", {"global": rate}, [("all", BENCHMARK_FILE, 0)] * 3, {"all": rate}),
+        ("connection", {"connection": rate / 2}, [(f"leecher {number}", BENCHMARK_FILE, 0) for number in range(1, 4)],
+         {f"leecher {number}": rate / 2 for number in range(1, 4)}),
+        ("file", {"file": rate, "files": {other_file: rate / 4}}, [(BENCHMARK_FILE, BENCHMARK_FILE, 0)] * 2 + [(other_file, other_file, 0)],
+         {BENCHMARK_FILE: rate, other_file: rate / 4}),
+        ("choking", {"connection": rate / 2, "unchoked_uploads": 1}, [("uploader", BENCHMARK_FILE, 10 ** 9)] + [("others", BENCHMARK_FILE, 0)] * 3,
+         {"uploader": rate / 2, "others": rate / 2}),
+    ]
+    with tempfile.TemporaryDirectory() as folder:
+        create_benchmark_file(folder, 4 * 1024 * 1024)
+        (Path(folder) / other_file).write_bytes(os.urandom(4 * 1024 * 1024))
+        for name in [BENCHMARK_FILE, other_file]:
+            Piece_Manifest.get_manifest(Path(folder) / name, TCP_Server.CHUNK_SIZE)  # Hash before timing
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(TCP_Server.MAX_NUMBER_OF_CLIENTS_IN_QUEUE)
+        threading.Thread(target=TCP_Server.serve_files, args=(listener, [BENCHMARK_FILE, other_file], Path(folder)), daemon=True).start()
+        print(f"Limit: {rate_mbps} MB/s, {seconds} s per scenario")
+        print(f"{'scenario':>12} {'leechers':>14} {'expected MB/s':>14} {'achieved MB/s':>14}")
+        try:
+            for label, limits, leechers, expected in scenarios:
+                Upload_Shaping.rate_limits.update(defaults, files={})
+                Upload_Shaping.set_rate_limits(limits)
+                received = [0] * len(leechers)
+
+                def run(index, file_id, uploaded):
+                    received[index] = leech(listener.getsockname(), file_id, seconds, uploaded)
+
+                workers = [threading.Thread(target=run, args=(index, file_id, uploaded)) for index, (_, file_id, uploaded) in enumerate(leechers)]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for worker in workers:
+                        worker.start()
+                    for worker in workers:
+                        worker.join()
+                    while Upload_Shaping.uploads:
+                        time.sleep(0.01)  # Let the seeder close the connections before the next scenario
+                for group, group_rate in expected.items():
+                    achieved = sum(received[index] for index, leecher in enumerate(leechers) if leecher[0] == group) / seconds
+                    print(f"{label:>12} {group:>14} {group_rate / 1e6:>14.2f} {achieved / 1e6:>14.2f}")
+                    assert abs(achieved - group_rate) <= SHAPING_TOLERANCE * group_rate, f"{label}: {group} got {achieved / 1e6:.2f} MB/s"
+        finally:
+            Upload_Shaping.rate_limits.update(defaults, files={})
+
+
+def benchmark_crowd(leechers=8, file_size_mb=16.0, seconds=3.0, cache_mb=64.0):
+    """
+    Measure the upload throughput and CPU time per MB of a seeder serving one file to a crowd of leechers at
+    once in each serving mode, with the piece cache counters of the cache mode, also with a budget of half the file.
+    """
+    modes = [(mode, mode, cache_mb) for mode in SERVING_MODES] + [("cache 1/2 file", "cache", file_size_mb / 2)]
+    budget, serving_mode = Piece_Cache.PIECE_CACHE_BYTES, Peer_Session.SERVING_MODE
+    with tempfile.TemporaryDirectory() as folder:
+        create_benchmark_file(folder, int(file_size_mb * 1024 * 1024))
+        Piece_Manifest.get_manifest(Path(folder) / BENCHMARK_FILE, TCP_Server.CHUNK_SIZE)  # Hash before timing
+        seeder_address = start_seeder(folder)
+        print(f"{int(leechers)} leechers of a {file_size_mb} MB file for {seconds} s each, cache budget: {cache_mb} MB")
+        print(f"{'mode':>15} {'MB/s':>10} {'CPU ms/MB':>10} {'hits':>8} {'misses':>8} {'evictions':>10}")
+        try:
+            for label, mode, mode_cache_mb in modes:
+                Peer_Session.SERVING_MODE = mode
+                Piece_Cache.PIECE_CACHE_BYTES = int(mode_cache_mb * 1024 * 1024)
+                Piece_Cache.clear_cache()
+                before = {name: Transfer_Metrics.counters.get(name, 0) for name in ["cache.hits", "cache.misses", "cache.evictions"]}
+                received = [0] * int(leechers)
+
+                def run(index):
+                    received[index] = leech(seeder_address, BENCHMARK_FILE, seconds)
+
+                workers = [threading.Thread(target=run, args=(index,)) for index in range(int(leechers))]
+                cpu_start = time.process_time()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for worker in workers:
+                        worker.start()
+                    for worker in workers:
+                        worker.join()
+                    while Upload_Shaping.uploads:
+                        time.sleep(0.01)  # Let the seeder close the connections before the next mode
+                megabytes = sum(received) / 1e6
+                cpu_ms_per_mb = 1000 * (time.process_time() - cpu_start) / megabytes  # Leechers included, they do the same work in every mode
+                hits, misses, evictions = (Transfer_Metrics.counters.get(name, 0) - before[name] for name in before)
+                print(f"{label:>15} {megabytes / seconds:>10.1f} {cpu_ms_per_mb:>10.2f} {hits:>8} {misses:>8} {evictions:>10}")
+        finally:
+            Piece_Cache.PIECE_CACHE_BYTES, Peer_Session.SERVING_MODE = budget, serving_mode
+            Piece_Cache.clear_cache()
+
+
+BENCHMARKS = {
+    "window": benchmark_window,
+    "serving": benchmark_serving,
+    "swarm": benchmark_swarm,
+    "tracker": benchmark_tracker,
+    "announce": benchmark_announce,
+    "journal": benchmark_journal,
+    "memory": benchmark_memory,
+    "catalog": benchmark_catalog,
+    "pieces": benchmark_pieces,
+    "e2e": benchmark_e2e,
+    "sessions": benchmark_sessions,
+    "streaming": benchmark_streaming,
+    "hashing": benchmark_hashing,
+    "disk": benchmark_disk,
+    "shaping": benchmark_shaping,
+    "crowd": benchmark_crowd,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python Benchmark.py [{'|'.join(BENCHMARKS)}] [arguments...]")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*[float(argument) for argument in sys.argv[2:]])
@@ -0,0 +1,79 @@
+import os  # Library for walking the served directory tree
+import queue  # Library for the background hashing queue
+import threading  # Library for guarding the catalog and hashing in the background
+from pathlib import Path  # Library to work with file system paths
+from Piece_Manifest import MANIFEST_SUFFIX, get_manifest
+
+# The catalog lists every file a seeder serves from a directory tree, keyed by its path relative to
+# the root with "/" separators. Scanning only stats files, so a tree of tens of thousands of files is
+# announced right away; piece hashes are computed afterwards by a background thread, smallest files
+# first, while a file a leecher asks for is hashed on demand by the worker serving it.
+IGNORED_SUFFIXES = (MANIFEST_SUFFIX, ".pieces", ".tmp")  # Sidecar files written next to served files
+CATALOG_RESCAN_SECONDS = 10  # Interval between scans for added, changed and removed files
+
+
+def create_catalog(root, chunk_size):
+    """Create an empty catalog of the files under root."""
+    return {
+        "root": Path(root),
+        "chunk_size": chunk_size,  # Piece size the manifests are built with (None picks it from each file's size)
+        "files": {},  # name -> (size, mtime_ns)
+        "lock": threading.Lock(),  # Serialises scans
+        "hash_queue": queue.PriorityQueue(),  # (size, name) of files whose manifest may be missing or stale
+    }
+
+
+def scan_files(root):
+    """Walk root and return {name: (size, mtime_ns)} for every file that can be served."""
+    found = {}
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            entries = os.scandir(folder)
+        except OSError:
+            continue  # Removed or unreadable while walking
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    elif entry.is_file() and not entry.name.endswith(IGNORED_SUFFIXES):
+                        stat = entry.stat()
+                        found[Path(entry.path).relative_to(root).as_posix()] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+    return found
+
+
+def refresh_catalog(catalog):
+    """
+    Rescan the tree and update the catalog in place; returns the (added, removed) file names.
+    New and changed files are queued for hashing.
+    """
+    with catalog["lock"]:
+        found = scan_files(catalog["root"])
+        files = catalog["files"]
+        added = [name for name in found if name not in files]
+        removed = [name for name in files if name not in found]
+        changed = [name for name, stat in found.items() if name in files and files[name] != stat]
+        for name in removed:
+            del files[name]
+        files.update(found)
+    for name in added + changed:
+        catalog["hash_queue"].put((found[name][0], name))
+    return added, removed
+
+
+def hash_files(catalog):
+    """Build the manifests of queued files one at a time, run on a background thread."""
+    while True:
+        _, name = catalog["hash_queue"].get()
+        if name not in catalog["files"]:
+            continue  # Removed since it was queued
+        try:
+            get_manifest(catalog["root"] / name, catalog["chunk_size"])
+        except OSError as error:
+            print(f"Could not hash {name}: {error}")
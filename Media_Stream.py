@@ -0,0 +1,161 @@
+import io  # Library for the raw stream interface of the reader
+import re  # Library for parsing Range headers
+import time  # Library for timing reads that wait for a piece
+import mimetypes  # Library for the Content-Type of streamed files
+import threading  # Library for running the HTTP server in the background
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler  # Library for the loopback HTTP endpoint
+from urllib.parse import unquote  # Library for decoding file IDs in request paths
+from Piece_Scheduler import set_cursor
+from Transfer_Metrics import count, observe
+
+# A file that is still downloading can be played while the rest of it arrives. Reading or seeking moves the
+# playback cursor of its swarm, the scheduler requests the pieces just ahead of the cursor first, and a read
+# only blocks when its piece has not been verified yet. A loopback HTTP server exposes the same stream to
+# media players, which seek with Range requests.
+STREAM_READ_SIZE = 65536  # Bytes read and sent at a time to an HTTP client
+STREAM_WAIT_SECONDS = 30  # How long a request waits for the download of its file to start
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")  # Single byte range of a Range header
+
+
+class Piece_Reader(io.RawIOBase):
+    """Readable and seekable view of a file being downloaded; reads block only until their piece arrives."""
+
+    def __init__(self, path, manifest, swarm):
+        super().__init__()
+        self.file = open(path, "rb", buffering=0)
+        self.chunk_size = manifest["chunk_size"]
+        self.size = manifest["file_size"]
+        self.swarm = swarm
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Move the read position; the cursor follows on the next read, so a seek alone fetches nothing."""
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        if base + offset < 0:
+            raise ValueError("Negative seek position")
+        self.position = base + offset
+        return self.position
+
+    def wait_for_piece(self, piece):
+        """Move the playback cursor to a piece and wait until the piece is verified on disk."""
+        lock = self.swarm["lock"]
+        with lock:
+            set_cursor(self.swarm, piece)
+            if self.swarm["have"][piece]:
+                return
+            wait_start = time.perf_counter()
+            while not self.swarm["have"][piece]:
+                if self.swarm["stopped"]:
+                    raise OSError(f"Download stopped before piece {piece} arrived")
+                lock.wait()
+        observe("stream.wait_ms", (time.perf_counter() - wait_start) * 1000)
+
+    def readinto(self, buffer):
+        """Read from the current position up to the end of its piece, waiting for the piece if needed."""
+        if self.position >= self.size:
+            return 0
+        piece = self.position // self.chunk_size
+        self.wait_for_piece(piece)
+        length = min(len(buffer), (piece + 1) * self.chunk_size - self.position)
+        self.file.seek(self.position)
+        with memoryview(buffer) as view:
+            read = self.file.readinto(view[:length])
+        self.position += read
+        count("stream.bytes", read)
+        return read
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def parse_range(range_header, size):
+    """Return the (first, last) byte of a Range header, (0, size - 1) without one, or None if it cannot be served."""
+    if range_header is None:
+        return 0, size - 1
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        first = int(match.group(1))
+        last = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        first, last = max(size - int(match.group(2)), 0), size - 1  # Suffix range: the last N bytes
+    return (first, last) if first <= last else None
+
+
+class Stream_Handler(BaseHTTPRequestHandler):
+    """Answers GET and HEAD requests for /<file ID> from the file as it downloads, honouring byte ranges."""
+
+    def do_HEAD(self):
+        self.send_stream(False)
+
+    def do_GET(self):
+        self.send_stream(True)
+
+    def send_stream(self, send_body):
+        file_id = unquote(self.path.lstrip("/"))
+        deadline = time.monotonic() + STREAM_WAIT_SECONDS
+        download = self.server.find_download(file_id)
+        while download is None and time.monotonic() < deadline:
+            time.sleep(0.1)  # The download may not have started yet
+            download = self.server.find_download(file_id)
+        if download is None:
+            self.send_error(404, "File Not Found")
+            return
+        manifest, path, swarm = download
+        size = manifest["file_size"]
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is None:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        first, last = byte_range
+        self.send_response(206 if "Range" in self.headers else 200)
+        self.send_header("Content-Type", mimetypes.guess_type(file_id)[0] or "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(last - first + 1))
+        if "Range" in self.headers:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.end_headers()
+        if not send_body:
+            return
+        count("stream.requests")
+        try:
+            with Piece_Reader(path, manifest, swarm) as reader:
+                reader.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    data = reader.read(min(STREAM_READ_SIZE, remaining))
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    remaining -= len(data)
+        except OSError as error:
+            print(f"Stream of {file_id} stopped: {error}")  # The player went away or the download ended early
+
+    def log_message(self, format, *args):
+        pass  # Players send many range requests; keep the download output readable
+
+
+def start_stream_server(find_download, port=0):
+    """
+    Serve downloads over HTTP on a loopback port in the background; returns the port actually bound.
+    find_download maps a file ID to (manifest, file path, swarm), or None while there is no such download.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Stream_Handler)
+    server.daemon_threads = True
+    server.find_download = find_download
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
@@ -0,0 +1,128 @@
+import json  # Library for handling JSON encoding/decoding
+import socket  # Library for peeking at frame headers
+import struct  # Library for packing fixed-size binary headers
+from Piece_Hashing import DEFAULT_HASH_ALGORITHM, hash_piece
+
+# Every TCP message between peers is a frame: a fixed header followed by a payload.
+# Control messages carry a JSON payload, chunk frames carry a binary header and raw bytes,
+# so file data is never hex-encoded or parsed as JSON. Pieces are verified whole against the
+# manifest but travel as blocks of a size the leecher and seeder agree on when the transfer starts.
+# One connection is a session that can carry several file transfers at once: every control message
+# has a "stream_id" and every chunk frame starts with the stream it belongs to.
+FRAME_HEADER = struct.Struct("!BI")  # Frame type (1 byte) and payload length (4 bytes)
+CHUNK_HEADER = struct.Struct("!IIII")  # Stream id, piece index, offset of the block in the piece and block length
+FRAME_MESSAGE = 1  # Payload is a JSON control message
+FRAME_CHUNK = 2  # Payload is a chunk header followed by the raw block bytes
+MAX_FRAME_SIZE = 64 * 1024 * 1024  # Reject frames larger than this to protect memory
+BLOCK_SIZE = 16 * 1024  # Block size leechers ask for
+MIN_BLOCK_SIZE = 1024  # Smallest block size a seeder agrees to
+MAX_BLOCK_SIZE = 128 * 1024  # Largest block size a seeder agrees to
+
+
+def compute_chunk_checksum(chunk, hash_algorithm=DEFAULT_HASH_ALGORITHM):
+    """Generate the digest for a single chunk with the hash algorithm of its manifest."""
+    return hash_piece(chunk, hash_algorithm)
+
+
+def negotiate_block_size(requested, piece_size):
+    """Return the block size a seeder agrees to for a requested size and the file's piece size."""
+    return max(MIN_BLOCK_SIZE, min(int(requested), MAX_BLOCK_SIZE, piece_size))
+
+
+def recv_exact(sock, size):
+    """Receive exactly size bytes from the socket into a new buffer."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("Connection closed by peer")
+        received += count
+    return buffer
+
+
+def recv_exact_into(sock, *views):
+    """Fill the writable memoryviews in order with bytes from the socket, with one call per read where recvmsg_into exists."""
+    views = [view for view in views if len(view)]
+    while views:
+        if len(views) > 1 and hasattr(sock, "recvmsg_into"):
+            count = sock.recvmsg_into(views)[0]
+        else:
+            count = sock.recv_into(views[0])
+        if count == 0:
+            raise ConnectionError("Connection closed by peer")
+        while views and count >= len(views[0]):
+            count -= len(views.pop(0))
+        if count:
+            views[0] = views[0][count:]
+
+
+def send_message(sock, msg):
+    """Send a JSON control message as a single frame."""
+    payload = json.dumps(msg).encode()
+    sock.sendall(FRAME_HEADER.pack(FRAME_MESSAGE, len(payload)) + payload)
+
+
+def encode_chunk_header(stream_id, chunk_index, offset, block_length):
+    """Build the frame and chunk headers that precede block_length raw bytes of a piece on the wire."""
+    frame_header = FRAME_HEADER.pack(FRAME_CHUNK, CHUNK_HEADER.size + block_length)
+    return frame_header + CHUNK_HEADER.pack(stream_id, chunk_index, offset, block_length)
+
+
+def encode_chunk(stream_id, chunk_index, offset, block_data):
+    """Build the complete wire frame for one block of a piece."""
+    return b"".join((encode_chunk_header(stream_id, chunk_index, offset, len(block_data)), block_data))
+
+
+def send_chunk(sock, stream_id, chunk_index, offset, block_data):
+    """Send one block of a piece as a binary frame (header and raw bytes)."""
+    sock.sendall(encode_chunk(stream_id, chunk_index, offset, block_data))
+
+
+def recv_frame(sock, block_buffer=None):
+    """
+    Receive one frame and return (frame_type, payload).
+    Message frames decode to a dict, chunk frames to (stream_id, chunk_index, offset, data).
+    block_buffer(stream_id, chunk_index, offset, block_length) may return a writable memoryview of block_length
+    bytes, such as the slice of the piece being assembled, and the block is received straight into it; it returns
+    None to have the block received into a new buffer. Raises ValueError for a malformed frame.
+    """
+    if block_buffer is not None:
+        # Peek at both headers to find where the block goes, then take headers and block with one call.
+        # Anything else, such as a message or headers that have not fully arrived, is read the usual way.
+        headers = sock.recv(FRAME_HEADER.size + CHUNK_HEADER.size, socket.MSG_PEEK)
+        if len(headers) == FRAME_HEADER.size + CHUNK_HEADER.size and headers[0] == FRAME_CHUNK:
+            frame_type, length = FRAME_HEADER.unpack_from(headers)
+            stream_id, chunk_index, offset, block_length = CHUNK_HEADER.unpack_from(headers, FRAME_HEADER.size)
+            data = None
+            if length == CHUNK_HEADER.size + block_length <= MAX_FRAME_SIZE:
+                data = block_buffer(stream_id, chunk_index, offset, block_length)
+            if data is not None:
+                recv_exact_into(sock, memoryview(bytearray(len(headers))), data)
+                return frame_type, (stream_id, chunk_index, offset, data)
+    frame_type, length = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds the maximum frame size")
+    if frame_type == FRAME_CHUNK and length < CHUNK_HEADER.size:
+        raise ValueError(f"Chunk frame of {length} bytes is shorter than its header")
+    payload = recv_exact(sock, length)
+    if frame_type == FRAME_CHUNK:
+        stream_id, chunk_index, offset, block_length = CHUNK_HEADER.unpack_from(payload)
+        if block_length != length - CHUNK_HEADER.size:
+            raise ValueError(f"Chunk frame of {length} bytes carries a block of {block_length} bytes")
+        return frame_type, (stream_id, chunk_index, offset, memoryview(payload)[CHUNK_HEADER.size:])
+    if frame_type == FRAME_MESSAGE:
+        message = json.loads(payload)
+        if not isinstance(message, dict):
+            raise ValueError("Control message is not a JSON object")
+        return frame_type, message
+    raise ValueError(f"Unknown frame type {frame_type}")
+
+
+def recv_message(sock):
+    """Receive one frame that must be a JSON control message."""
+    frame_type, payload = recv_frame(sock)
+    if frame_type != FRAME_MESSAGE:
+        raise ValueError("Expected a control message but received chunk data")
+    return payload
@@ -0,0 +1,340 @@
+import socket  # Library for network communication (TCP/UDP)
+import time  # Library for time-related functions
+import datetime  # Library for handling date and time
+import os  # Library for sending file data with sendfile
+import mmap  # Library for mapping served files into memory
+import select  # Library for waiting until a socket can accept more data
+import collections  # Library for the queue of requests not served yet
+import threading  # Library for the upload slots
+from concurrent.futures import ThreadPoolExecutor, wait  # Bounded pool of upload workers and file lookups
+from Peer_Protocol import BLOCK_SIZE, send_message, recv_message, send_chunk, encode_chunk_header, negotiate_block_size
+from Piece_Manifest import public_manifest
+from Piece_Scheduler import pack_bitfield
+from Piece_Cache import get_piece
+from Upload_Shaping import record_peer_report, shape_upload
+from Transfer_Metrics import count
+
+# The uploading side of a peer session, shared by seeders (TCP_Server) and by leechers sharing the pieces they
+# already have (TCP_Client). Each process accepts leechers with serve_leechers and answers the CONNECT handshake
+# itself, then hands the connection to serve_session with a function that finds the files it serves.
+CONNECTION_TIMEOUT_SECONDS = 10  # A frame that starts arriving from a leecher must be complete within this
+HAVE_INTERVAL_SECONDS = 0.5  # How often a peer that is still downloading tells its leechers about new pieces
+IDLE_SESSION_SECONDS = 2  # Sessions with no file open for this long are closed, freeing their upload slot and worker
+UPLOAD_QUEUE_SECONDS = 8  # Leechers arriving while every upload slot is taken wait this long for one (leechers wait 10 s for ACK)
+MAX_QUEUED_LEECHERS = 32  # Leechers waiting for an upload slot at once, the ones beyond are sent ERROR 503
+HASHING_KEEPALIVE_SECONDS = 2  # While a requested file is hashed for the first time, the leecher is told this often to keep waiting
+# How chunk bytes reach the socket: "sendfile" (kernel copies from the page cache),
+# "mmap" (memoryview slices of a mapped file), "read" (file.read per chunk)
+# or "cache" (whole pieces kept in the in-memory Piece_Cache shared by every connection)
+SERVING_MODE = "sendfile" if hasattr(os, "sendfile") else "mmap"
+MSG_MORE = getattr(socket, "MSG_MORE", 0)  # Hold the header back until the chunk bytes follow (Linux only)
+file_lookups = ThreadPoolExecutor(thread_name_prefix="file_lookup")  # Runs find_file while sessions send keepalives
+
+def send_begin_download(TCP_connection_socket, stream_id=0):
+    """Send an acknowledgment message.""" 
+    now = datetime.datetime.now().strftime('%H:%M')
+    msg = {
+        "message_type": "BEGIN",  # Type of message (Acknowledgment)
+        "time_stamp": now,  # Type of the message that is being acknowledged
+        "stream_id": stream_id  # Stream of the session the file is sent on
+    }
+    send_message(TCP_connection_socket, msg)  # Send the acknowledgment over TCP
+
+def send_error_busy(TCP_connection_socket):
+    """Send an error message when every upload slot is taken."""
+    msg = {
+        "message_type": "ERROR",  # Type of message (Error)
+        "error_code": 503,  # Error code for no free upload slot
+        "error_message": "Too Many Uploads"  # Error message
+    }
+    send_message(TCP_connection_socket, msg)  # Send the error message over TCP
+
+def send_error_404(TCP_connection_socket, stream_id=0):
+    """Send an error message for file not found.""" 
+    msg = {
+        "message_type": "ERROR",  # Type of message (Error)
+        "error_code": 404,  # Error code for file not found
+        "error_message": "File Not Found",  # Error message
+        "stream_id": stream_id  # Stream of the session the file was requested on
+    }
+    send_message(TCP_connection_socket, msg)  # Send the error message over TCP
+
+def sendfile_range(TCP_connection_socket, file, offset, count):
+    """Let the kernel copy count bytes of file at offset straight to the socket."""
+    while count > 0:
+        try:
+            sent = os.sendfile(TCP_connection_socket.fileno(), file.fileno(), offset, count)
+        except BlockingIOError:  # Sockets with a timeout are non-blocking underneath
+            _, writable, _ = select.select([], [TCP_connection_socket], [], TCP_connection_socket.gettimeout())
+            if not writable:
+                raise socket.timeout("Timed out sending file data")
+            continue
+        if sent == 0:
+            raise ConnectionError("Connection closed by peer")
+        offset += sent
+        count -= sent
+
+def send_file_block(TCP_connection_socket, file, file_view, stream_id, chunk_index, chunk_size, offset, block_length):
+    """
+    Send block_length bytes at offset in one piece of file using SERVING_MODE and return the length.
+    The sendfile and mmap paths send straight from the page cache without Python copies.
+    """
+    file_offset = chunk_index * chunk_size + offset
+    if SERVING_MODE == "read":
+        file.seek(file_offset)  # Seek to the correct position in the file
+        block_data = file.read(block_length)  # Read the block data
+        send_chunk(TCP_connection_socket, stream_id, chunk_index, offset, block_data)
+        return len(block_data)
+    with file_view[file_offset:file_offset + block_length] as block_view:
+        header = encode_chunk_header(stream_id, chunk_index, offset, len(block_view))
+        TCP_connection_socket.sendall(header, MSG_MORE)
+        if SERVING_MODE == "sendfile":
+            sendfile_range(TCP_connection_socket, file, file_offset, len(block_view))
+        else:
+            TCP_connection_socket.sendall(block_view)
+        return len(block_view)
+
+def send_cached_block(TCP_connection_socket, piece, stream_id, chunk_index, offset, block_length):
+    """Send block_length bytes at offset of a piece held in memory and return the length."""
+    with memoryview(piece)[offset:offset + block_length] as block_view:
+        TCP_connection_socket.sendall(encode_chunk_header(stream_id, chunk_index, offset, len(block_view)), MSG_MORE)
+        TCP_connection_socket.sendall(block_view)
+        return len(block_view)
+
+def send_piece_blocks(TCP_connection_socket, stream_id, stream, request, upload):
+    """Send the blocks of one piece a REQUEST or RETRANSMIT asks for on a stream, one frame per block."""
+    manifest, block_size = stream["manifest"], stream["block_size"]
+    chunk_index = request["chunk_index"]
+    chunk_size = manifest["chunk_size"]
+    piece_length = min(chunk_size, manifest["file_size"] - chunk_index * chunk_size)
+    first_block = request.get("block_index", 0)
+    last_offset = min((first_block + request.get("block_count", 1)) * block_size, piece_length)
+    request_bytes = 0
+    piece = None
+    if SERVING_MODE == "cache":  # Read once for every connection that asks for this piece
+        piece_start = chunk_index * chunk_size
+        piece = get_piece((manifest["root_hash"], chunk_index), lambda: stream["mapped"][piece_start:piece_start + piece_length], piece_length)
+    for offset in range(first_block * block_size, last_offset, block_size):
+        if piece is not None:
+            sent_bytes = send_cached_block(TCP_connection_socket, piece, stream_id, chunk_index, offset, min(block_size, piece_length - offset))
+        else:
+            sent_bytes = send_file_block(TCP_connection_socket, stream["file"], stream["file_view"], stream_id, chunk_index, chunk_size, offset, min(block_size, piece_length - offset))
+        upload["bytes_sent"] += sent_bytes
+        request_bytes += sent_bytes
+        shape_upload(upload, stream["file_id"], sent_bytes)  # Global, per-connection and per-file rate limits
+    count("upload.bytes", request_bytes)  # Counted once per request to keep the block loop lean
+    count("upload.blocks", len(range(first_block * block_size, last_offset, block_size)))
+
+def send_haves(TCP_connection_socket, stream_id, swarm, announced):
+    """Announce the pieces verified since the first `announced` ones in one HAVE message; returns the new count."""
+    with swarm["lock"]:
+        pieces = swarm["completed"][announced:]
+    if pieces:
+        send_message(TCP_connection_socket, {"message_type": "HAVE", "chunk_indexes": pieces, "stream_id": stream_id})
+    return announced + len(pieces)
+
+def find_file_with_keepalives(TCP_connection_socket, find_file, file, stream_id):
+    """
+    Return find_file(file), sending a HASHING message on the stream every HASHING_KEEPALIVE_SECONDS until it
+    returns, so a leecher asking for a file that has not been hashed yet does not give up waiting for BEGIN.
+    """
+    lookup = file_lookups.submit(find_file, file)
+    while not wait([lookup], HASHING_KEEPALIVE_SECONDS).done:
+        send_message(TCP_connection_socket, {"message_type": "HASHING", "stream_id": stream_id})
+        count("upload.hashing_keepalives")
+    return lookup.result()
+
+def send_choke(TCP_connection_socket, stream_ids, choked):
+    """Tell the leecher on every given stream that its requests are ignored (CHOKE) or served again (UNCHOKE)."""
+    for stream_id in stream_ids:
+        send_message(TCP_connection_socket, {"message_type": "CHOKE" if choked else "UNCHOKE", "stream_id": stream_id})
+
+def open_stream(TCP_connection_socket, stream_id, source, requested_block_size):
+    """
+    Map a requested file and send BEGIN and its manifest on a new stream; returns the stream state.
+    source is (manifest, file path, swarm). A swarm means the file is still being downloaded here: the
+    manifest then carries our bitfield and the pieces verified later are announced with HAVE messages.
+    """
+    manifest, file_path, swarm = source
+    block_size = negotiate_block_size(requested_block_size, manifest["chunk_size"])
+    msg = {"message_type": "MANIFEST", **public_manifest(manifest), "block_size": block_size, "stream_id": stream_id}
+    announced = 0
+    if swarm is not None:
+        with swarm["lock"]:
+            if swarm["remaining"] == 0:
+                swarm = None  # Complete, every piece can be served
+            else:
+                msg["bitfield"] = pack_bitfield(swarm["have"]).hex()
+                announced = len(swarm["completed"])  # Later pieces reach the leecher as HAVE messages
+    file = open(file_path, "rb")
+    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if manifest["file_size"] else b""
+    stream = {"manifest": manifest, "block_size": block_size, "file": file, "mapped": mapped,
+              "file_view": memoryview(mapped), "swarm": swarm, "announced": announced}
+    send_begin_download(TCP_connection_socket, stream_id)
+    send_message(TCP_connection_socket, msg)  # Send the file size, piece hashes and agreed block size first to the client message 5
+    print(f"Sent manifest of {manifest['file_size']} bytes of {file_path} on stream {stream_id}.")
+    return stream
+
+def close_stream(stream):
+    """Unmap and close the file served on a stream."""
+    stream["file_view"].release()
+    if stream["manifest"]["file_size"]:
+        stream["mapped"].close()
+    stream["file"].close()
+
+def serve_session(TCP_connection_socket, find_file, upload):
+    """
+    Answers the requests of one leecher connection until the leecher disconnects, or leaves the connection
+    idle with no file open for longer than IDLE_SESSION_SECONDS.
+    Every message names its stream, so the leecher can download several files at once and fetch many
+    small files over one connection instead of paying a CONNECT handshake for each.
+    find_file maps a requested file name to (manifest, file path, swarm), or None if it is not served here.
+    The client keeps a window of requests in flight, so blocks are sent as soon as they are
+    requested and acknowledgments arrive cumulatively instead of after every piece.
+    Requests are queued and every message that has arrived is read before the next one is served, so a
+    CANCEL for a piece the leecher got elsewhere drops its queued requests before their blocks are sent.
+    upload is the connection state from create_upload; while the choker has it choked, requests are ignored.
+    """
+    streams = {}  # stream_id -> state of the file served on that stream
+    queued = collections.deque()  # (stream_id, request) of the REQUEST and RETRANSMIT messages not served yet
+    choked = False  # Choke state the leecher was last told about
+    cpu_start = time.thread_time()
+    try:
+        while True:
+            if upload["choked"] != choked:  # The choker changed its mind since the last message
+                choked = upload["choked"]
+                send_choke(TCP_connection_socket, streams, choked)
+                if choked:
+                    queued.clear()  # The leecher gives choked requests to other peers
+            if queued or streams and (choked or any(stream["swarm"] is not None for stream in streams.values())):
+                for stream_id, stream in streams.items():
+                    if stream["swarm"] is not None:
+                        stream["announced"] = send_haves(TCP_connection_socket, stream_id, stream["swarm"], stream["announced"])
+                # Also notices an unchoke
+                readable, _, _ = select.select([TCP_connection_socket], [], [], 0 if queued else HAVE_INTERVAL_SECONDS)
+                if not readable:
+                    if queued:
+                        stream_id, request = queued.popleft()
+                        if stream_id in streams:  # Not closed since the request was queued
+                            if request["message_type"] == "RETRANSMIT":
+                                count("upload.retransmits")
+                            # Send the blocks in binary frames without waiting for their acknowledgment message 8
+                            send_piece_blocks(TCP_connection_socket, stream_id, streams[stream_id], request, upload)
+                    continue
+            if not streams:
+                readable, _, _ = select.select([TCP_connection_socket], [], [], IDLE_SESSION_SECONDS)
+                if not readable:
+                    break  # Idle between transfers, another leecher can have the upload slot
+            try:
+                request = recv_message(TCP_connection_socket)  # Receive a file request, chunk request or cumulative ACK message 7
+            except (ConnectionError, socket.timeout):
+                if streams:
+                    raise
+                break  # Closed or idle between transfers
+            message_type = request.get("message_type")
+            stream_id = request.get("stream_id", 0)
+            record_peer_report(upload, request)  # Leechers that give the most are unchoked first
+            if message_type == "REQUEST_FILE":
+                file = request.get("requested_file")
+                source = find_file_with_keepalives(TCP_connection_socket, find_file, file, stream_id) if stream_id not in streams else None
+                if source is None:
+                    print(f"File '{file}' not found. Sending ERROR 404.")
+                    send_error_404(TCP_connection_socket, stream_id)
+                    continue
+                streams[stream_id] = open_stream(TCP_connection_socket, stream_id, source, request.get("block_size", BLOCK_SIZE))
+                streams[stream_id]["file_id"] = file
+                upload["file_id"] = file
+                count("upload.streams")
+                if choked:
+                    send_choke(TCP_connection_socket, [stream_id], choked)
+                continue
+            stream = streams.get(stream_id)
+            if stream is None:
+                break  # Not a stream of this session
+            total_chunks = len(stream["manifest"]["digests"])
+            if message_type == "ACK":
+                if request["received_chunk"] + 1 == total_chunks:  # Every chunk up to the last one has arrived
+                    print(f"All chunks sent successfully. Closing stream {stream_id}.")
+                    close_stream(streams.pop(stream_id))
+                continue
+            if message_type == "CANCEL":  # Delivered by another peer first
+                cancelled = len(queued)
+                queued = collections.deque(entry for entry in queued if entry[0] != stream_id or entry[1]["chunk_index"] != request.get("chunk_index"))
+                count("upload.cancelled_requests", cancelled - len(queued))
+                continue
+            if message_type not in ["REQUEST", "RETRANSMIT"]:
+                break  # If no request or invalid request, break the loop
+            chunk_index = request.get("chunk_index")  # Get the requested chunk index
+            block_index, block_count = request.get("block_index", 0), request.get("block_count", 1)
+            if not all(type(field) is int for field in [chunk_index, block_index, block_count]):
+                break  # Malformed request
+            if not 0 <= chunk_index < total_chunks:
+                break  # Not a piece of this file
+            if block_index < 0 or block_count < 1:
+                break  # Not blocks of this piece
+            if stream["swarm"] is not None and not stream["swarm"]["have"][chunk_index]:
+                send_message(TCP_connection_socket, {"message_type": "REJECT", "chunk_index": chunk_index, "stream_id": stream_id})
+                count("upload.rejected_requests")
+                continue
+            if choked:
+                count("upload.choked_requests")  # Sent before the leecher saw our CHOKE
+                continue
+            queued.append((stream_id, request))
+    finally:
+        for stream in streams.values():
+            close_stream(stream)
+        upload["cpu_seconds"] = time.thread_time() - cpu_start  # CPU spent by this worker on the session
+
+def serve_in_slot(TCP_connection_socket, address, serve_connection, upload_slots):
+    """Serve one leecher on a worker thread, then free its upload slot and close the connection."""
+    try:
+        serve_connection(TCP_connection_socket, address)
+    finally:
+        upload_slots.release()
+        TCP_connection_socket.close()
+
+def reject_busy(TCP_connection_socket, address):
+    """Send ERROR 503 to a leecher that got no upload slot and close its connection."""
+    print(f"No free upload slot for {address}. Sending ERROR 503.")
+    count("upload.busy_rejections")
+    try:
+        send_error_busy(TCP_connection_socket)
+    except OSError:
+        pass  # Gave up waiting already
+    TCP_connection_socket.close()
+
+def wait_for_slot(TCP_connection_socket, address, serve_connection, upload_slots, queue_slots, workers):
+    """Hold a leecher that arrived while every upload slot was taken until one frees up, or UPLOAD_QUEUE_SECONDS pass."""
+    try:
+        got_slot = upload_slots.acquire(timeout=UPLOAD_QUEUE_SECONDS)
+    finally:
+        queue_slots.release()
+    if not got_slot:
+        reject_busy(TCP_connection_socket, address)
+        return
+    count("upload.queued_connections")
+    workers.submit(serve_in_slot, TCP_connection_socket, address, serve_connection, upload_slots)
+
+def serve_leechers(listening_socket, serve_connection, max_uploads):
+    """
+    Accept leechers forever and run serve_connection(socket, address) for up to max_uploads of them at once,
+    each on a worker thread. Leechers beyond that wait up to UPLOAD_QUEUE_SECONDS for a slot (at most
+    MAX_QUEUED_LEECHERS of them) and are sent ERROR 503 if none frees up.
+    """
+    upload_slots = threading.BoundedSemaphore(max_uploads)  # Free upload slots
+    queue_slots = threading.BoundedSemaphore(MAX_QUEUED_LEECHERS)  # Free places to wait for an upload slot
+    with ThreadPoolExecutor(max_workers=max_uploads) as workers:
+        while True:
+            try:
+                TCP_connection_socket, address = listening_socket.accept()
+            except socket.timeout:
+                continue
+            TCP_connection_socket.settimeout(CONNECTION_TIMEOUT_SECONDS)
+            TCP_connection_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Send frames without Nagle delays
+            if not upload_slots.acquire(blocking=False):
+                if queue_slots.acquire(blocking=False):
+                    threading.Thread(target=wait_for_slot, args=(TCP_connection_socket, address, serve_connection, upload_slots, queue_slots, workers), daemon=True).start()
+                else:
+                    reject_busy(TCP_connection_socket, address)
+                continue
+            workers.submit(serve_in_slot, TCP_connection_socket, address, serve_connection, upload_slots)
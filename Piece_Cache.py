@@ -0,0 +1,79 @@
+import collections  # Library for the pieces in least recently used order
+import threading  # Library for sharing the cache between upload threads
+from Transfer_Metrics import count, set_gauge
+
+# Pieces served in the "cache" serving mode are kept in memory and the least recently used are dropped first
+# once PIECE_CACHE_BYTES is exceeded, so a crowd of leechers fetching the same file is served from one read
+# of each piece. Entries are keyed by the root hash of the file and the piece index: a file whose content
+# changes gets a new root hash and its old pieces simply age out, and identical files share their pieces.
+# When several connections miss the same piece at once, one reads it while the others wait for it.
+PIECE_CACHE_BYTES = 64 * 1024 * 1024  # Memory the cached pieces may use
+MAX_CACHED_PIECE_SHARE = 4  # Pieces larger than PIECE_CACHE_BYTES divided by this are served without caching them
+
+cache_lock = threading.Lock()  # Guards every table below
+cached_pieces = collections.OrderedDict()  # (root hash, piece) -> piece bytes, least recently used first
+cache = {"bytes": 0}  # Size of the cached pieces
+loading = {}  # (root hash, piece) -> Event set once the thread reading that piece is done
+
+
+def get_piece(key, read_piece, piece_length):
+    """Return the piece cached under key, calling read_piece() to read it on a miss.
+    Pieces too large to cache are read directly so that connections missing them do not wait on each other."""
+    if not cacheable(piece_length):
+        count("cache.misses")
+        return read_piece()
+    while True:
+        with cache_lock:
+            piece = cached_pieces.get(key)
+            if piece is not None:
+                cached_pieces.move_to_end(key)
+                break
+            loaded = loading.get(key)
+            if loaded is None:
+                loaded = loading[key] = threading.Event()
+                piece = None
+                break
+        loaded.wait()  # Another connection is reading this piece
+    if piece is not None:
+        count("cache.hits")
+        return piece
+    count("cache.misses")
+    try:
+        piece = read_piece()
+        store_piece(key, piece)
+        return piece
+    finally:
+        with cache_lock:
+            del loading[key]
+        loaded.set()
+
+
+def cacheable(piece_length):
+    """Return whether a piece of piece_length bytes is small enough to be cached."""
+    return piece_length <= PIECE_CACHE_BYTES // MAX_CACHED_PIECE_SHARE
+
+
+def store_piece(key, piece):
+    """Cache a piece that was just read, evicting the least recently used pieces beyond PIECE_CACHE_BYTES."""
+    if not cacheable(len(piece)):
+        return
+    evicted = 0
+    with cache_lock:
+        cached_pieces[key] = piece
+        cache["bytes"] += len(piece)
+        while cache["bytes"] > PIECE_CACHE_BYTES:
+            _, old_piece = cached_pieces.popitem(last=False)
+            cache["bytes"] -= len(old_piece)
+            evicted += 1
+        cached_bytes = cache["bytes"]
+    if evicted:
+        count("cache.evictions", evicted)
+    set_gauge("cache.bytes", cached_bytes)
+
+
+def clear_cache():
+    """Drop every cached piece."""
+    with cache_lock:
+        cached_pieces.clear()
+        cache["bytes"] = 0
+    set_gauge("cache.bytes", 0)
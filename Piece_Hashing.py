@@ -0,0 +1,93 @@
+import hashlib  # Library for the cryptographic piece hashes
+import zlib  # Library for the CRC-32 piece hash
+import os  # Library for the number of cores
+import time  # Library for timing hash batches
+import collections  # Library for the batches waiting for their hashes
+from concurrent.futures import ThreadPoolExecutor  # Pool of hashing threads
+from Transfer_Metrics import count, observe
+try:
+    import xxhash  # Optional, the fastest non-cryptographic hash
+except ImportError:
+    xxhash = None
+
+# Pieces are hashed with the algorithm recorded in their file's manifest. SHA-256 and BLAKE2b protect against
+# peers that send forged data; the non-cryptographic hashes only catch corruption and are for trusted LANs.
+# hashlib and zlib release the GIL while they hash large buffers, so a pool of threads hashes pieces on every
+# core while the network threads keep receiving. Pieces go to the pool in batches so that a task of small
+# pieces still does enough work to pay for the hand-off.
+DEFAULT_HASH_ALGORITHM = "sha256"  # Hash of new manifests unless a seeder picks another
+HASH_WORKERS = os.cpu_count() or 1  # Threads hashing pieces
+HASH_BATCH_BYTES = 1024 * 1024  # Pieces are handed to the pool in batches of about this many bytes
+
+
+class Crc32_Hash:
+    """hashlib-style wrapper around zlib.crc32."""
+
+    def __init__(self, data=b""):
+        self.value = zlib.crc32(data)
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self):
+        return self.value.to_bytes(4, "big")
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+
+HASH_ALGORITHMS = {  # Name recorded in manifests -> constructor taking the initial data
+    "sha256": hashlib.sha256,
+    "blake2b": lambda data=b"": hashlib.blake2b(data, digest_size=32),
+    "crc32": Crc32_Hash,
+}
+if xxhash is not None:
+    HASH_ALGORITHMS["xxh3_128"] = xxhash.xxh3_128
+INSECURE_HASH_ALGORITHMS = {"crc32", "xxh3_128"}  # Detect corruption only, a malicious peer can forge them
+
+hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash")  # Shared by downloads and manifest builds
+
+
+def new_hash(hash_algorithm, data=b""):
+    """Return a hash object of the algorithm, fed with data."""
+    return HASH_ALGORITHMS[hash_algorithm](data)
+
+
+def hash_piece(piece, hash_algorithm=DEFAULT_HASH_ALGORITHM):
+    """Return the digest of one piece."""
+    return new_hash(hash_algorithm, piece).digest()
+
+
+def hash_batch(pieces, hash_algorithm):
+    """Return the digests of a batch of pieces, run on the pool."""
+    start = time.perf_counter()
+    digests = [new_hash(hash_algorithm, piece).digest() for piece in pieces]
+    observe("hash.batch_ms", (time.perf_counter() - start) * 1000)
+    count("hash.bytes", sum(len(piece) for piece in pieces))
+    return digests
+
+
+def submit_batch(pieces, hash_algorithm):
+    """Hash a batch of pieces on the pool; returns a future of their digests."""
+    return hash_pool.submit(hash_batch, pieces, hash_algorithm)
+
+
+def hash_pieces(pieces, hash_algorithm):
+    """
+    Yield the digests of an iterable of pieces in order, hashing batches of them on the pool.
+    At most two batches per worker are in flight, so pieces read from a file are not all held in memory.
+    """
+    in_flight = collections.deque()
+    batch, batch_bytes = [], 0
+    for piece in pieces:
+        batch.append(piece)
+        batch_bytes += len(piece)
+        if batch_bytes >= HASH_BATCH_BYTES:
+            in_flight.append(submit_batch(batch, hash_algorithm))
+            batch, batch_bytes = [], 0
+            if len(in_flight) >= 2 * HASH_WORKERS:
+                yield from in_flight.popleft().result()
+    if batch:
+        in_flight.append(submit_batch(batch, hash_algorithm))
+    while in_flight:
+        yield from in_flight.popleft().result()
@@ -0,0 +1,138 @@
+import json  # Library for handling JSON encoding/decoding
+import os  # Library for file sizes, modification times and atomic renames
+import threading  # Library for guarding the in-memory manifest cache
+import time  # Library for timing manifest builds
+from pathlib import Path  # Library to work with file system paths
+from Transfer_Metrics import observe
+from Piece_Hashing import DEFAULT_HASH_ALGORITHM, HASH_ALGORITHMS, INSECURE_HASH_ALGORITHMS, new_hash, hash_pieces
+
+# A manifest describes one file the way a .torrent metainfo does: its size, the chunk size it is
+# split into, the hash of every piece and a root hash over all piece hashes, both with the hash algorithm
+# it records (see Piece_Hashing). It is computed once,
+# cached next to the file as "<file>.manifest" and rebuilt when the file's size or mtime changes.
+# Unless a chunk size is given, pieces grow with the file so large files do not need hundreds of
+# thousands of hashes; they are still transferred in small blocks (see Peer_Protocol.BLOCK_SIZE).
+MANIFEST_SUFFIX = ".manifest"  # Suffix of the cached manifest file
+HASH_ALGORITHM = DEFAULT_HASH_ALGORITHM  # Hash used for the pieces and the root hash of new manifests
+ACCEPT_INSECURE_HASHES = False  # Leechers accept manifests hashed with a non-cryptographic algorithm (trusted LANs only)
+MIN_PIECE_SIZE = 256 * 1024  # Smallest piece size chosen from the file size
+MAX_PIECE_SIZE = 4 * 1024 * 1024  # Largest piece size chosen from the file size
+TARGET_PIECES = 1024  # Files are split into about this many pieces while the piece size is between the bounds
+
+manifest_cache = {}  # str(file path) -> manifest already loaded in this process
+manifest_cache_lock = threading.Lock()  # Protects manifest_cache and manifest_build_locks
+manifest_build_locks = {}  # str(file path) -> lock held while its manifest is being built
+
+
+def manifest_path(file_path):
+    """Return where the manifest of file_path is cached."""
+    file_path = Path(file_path)
+    return file_path.with_name(file_path.name + MANIFEST_SUFFIX)
+
+
+def choose_piece_size(file_size):
+    """Return the smallest power of two piece size that splits file_size into at most TARGET_PIECES pieces, within the bounds."""
+    piece_size = MIN_PIECE_SIZE
+    while piece_size < MAX_PIECE_SIZE and piece_size * TARGET_PIECES < file_size:
+        piece_size *= 2
+    return piece_size
+
+
+def compute_root_hash(piece_hashes, hash_algorithm):
+    """Hash the concatenated piece hashes into one digest identifying the whole file."""
+    root = new_hash(hash_algorithm)
+    for piece_hash in piece_hashes:
+        root.update(bytes.fromhex(piece_hash))
+    return root.hexdigest()
+
+
+def build_manifest(file_path, chunk_size):
+    """Hash file_path piece by piece and return its manifest; chunk_size None picks it from the file size."""
+    start = time.perf_counter()
+    stat = os.stat(file_path)
+    chunk_size = chunk_size or choose_piece_size(stat.st_size)
+    with open(file_path, "rb") as file:
+        pieces = iter(lambda: file.read(chunk_size), b"")
+        piece_hashes = [digest.hex() for digest in hash_pieces(pieces, HASH_ALGORITHM)]  # Hashed on every core
+    observe("manifest.hash_ms", (time.perf_counter() - start) * 1000)
+    return {
+        "file_id": Path(file_path).name,
+        "file_size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "chunk_size": chunk_size,
+        "hash_algorithm": HASH_ALGORITHM,
+        "piece_hashes": piece_hashes,
+        "root_hash": compute_root_hash(piece_hashes, HASH_ALGORITHM),
+    }
+
+
+def manifest_is_current(manifest, file_path, chunk_size):
+    """Return True if manifest still describes file_path split into chunk_size pieces."""
+    stat = os.stat(file_path)
+    chunk_size = chunk_size or choose_piece_size(stat.st_size)
+    return (manifest.get("file_size") == stat.st_size and manifest.get("mtime_ns") == stat.st_mtime_ns
+            and manifest.get("chunk_size") == chunk_size and manifest.get("hash_algorithm") == HASH_ALGORITHM)
+
+
+def load_manifest(file_path, chunk_size):
+    """Return the cached manifest of file_path from disk, rebuilding and saving it if it is stale."""
+    cached_path = manifest_path(file_path)
+    try:
+        manifest = json.loads(cached_path.read_text())
+        if manifest_is_current(manifest, file_path, chunk_size):
+            return manifest
+    except (OSError, ValueError):
+        pass  # Missing or unreadable manifest, build a new one
+    manifest = build_manifest(file_path, chunk_size)
+    temporary_path = cached_path.with_name(cached_path.name + ".tmp")
+    try:
+        temporary_path.write_text(json.dumps(manifest))
+        os.replace(temporary_path, cached_path)  # Readers never see a half written manifest
+    except OSError as error:
+        print(f"Could not cache manifest for {file_path}: {error}")
+    return manifest
+
+
+def get_manifest(file_path, chunk_size):
+    """
+    Return the manifest of file_path, served from memory after the first call.
+    The piece hashes are also decoded to bytes under "digests" for comparison with received data.
+    Threads asking for the same file while it is being hashed wait for that one build.
+    """
+    key = str(file_path)
+    with manifest_cache_lock:
+        manifest = manifest_cache.get(key)
+        build_lock = manifest_build_locks.setdefault(key, threading.Lock())
+    if manifest is not None and manifest_is_current(manifest, file_path, chunk_size):
+        return manifest
+    with build_lock:
+        with manifest_cache_lock:
+            manifest = manifest_cache.get(key)
+        if manifest is not None and manifest_is_current(manifest, file_path, chunk_size):
+            return manifest  # Built by another thread while this one waited
+        manifest = load_manifest(file_path, chunk_size)
+        manifest["digests"] = [bytes.fromhex(piece_hash) for piece_hash in manifest["piece_hashes"]]
+        with manifest_cache_lock:
+            manifest_cache[key] = manifest
+    return manifest
+
+
+def public_manifest(manifest):
+    """Return the manifest fields sent to leechers (no local modification time or decoded digests)."""
+    return {key: manifest[key] for key in ["file_id", "file_size", "chunk_size", "hash_algorithm", "piece_hashes", "root_hash"]}
+
+
+def verify_manifest(manifest):
+    """Check that a received manifest is self-consistent; returns the piece digests as bytes or None."""
+    try:
+        expected_pieces = -(-manifest["file_size"] // manifest["chunk_size"])  # Ceiling division
+        hash_algorithm = manifest["hash_algorithm"]
+        if hash_algorithm not in HASH_ALGORITHMS or len(manifest["piece_hashes"]) != expected_pieces:
+            return None
+        if hash_algorithm in INSECURE_HASH_ALGORITHMS and not ACCEPT_INSECURE_HASHES:
+            return None
+        if compute_root_hash(manifest["piece_hashes"], hash_algorithm) != manifest["root_hash"]:
+            return None
+        return [bytes.fromhex(piece_hash) for piece_hash in manifest["piece_hashes"]]
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
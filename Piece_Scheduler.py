@@ -0,0 +1,230 @@
+import threading  # Library for sharing the swarm state between peer workers
+import time  # Library for timing outstanding requests
+
+# The swarm state is a plain dict shared by every peer worker of one download and guarded by
+# swarm["lock"]. Missing pieces that nobody has requested yet are kept in buckets keyed by how
+# many connected peers have them, so the rarest piece is found without scanning the whole file.
+MAX_BAD_PIECES = 3  # Peers that send this many pieces failing verification are banned from the download
+STREAM_WINDOW = 8  # Pieces from the playback cursor on that are requested before the rarest ones
+ENDGAME_PIECES = 4  # Pieces outstanding at other peers are only requested again once this few are missing
+
+
+def create_swarm(total_chunks, have=None):
+    """
+    Create the shared state for downloading a file of total_chunks pieces.
+    have marks pieces already on disk from an earlier, interrupted download.
+    """
+    have = bytearray(total_chunks) if have is None else bytearray(have)
+    return {
+        "total_chunks": total_chunks,
+        "have": have,  # 1 for every verified piece
+        "remaining": total_chunks - sum(have),  # Number of pieces still missing
+        "contiguous": 0,  # Number of pieces downloaded without gaps from the start of the file
+        "completed": [],  # Pieces verified during this download, in order, for HAVE messages to leechers
+        "availability": [0] * total_chunks,  # Number of connected peers that have each piece
+        "buckets": {0: {piece for piece in range(total_chunks) if not have[piece]}},  # availability -> unrequested missing pieces
+        "requested": {},  # piece -> {peer_id: time the request was sent}
+        "peers": {},  # peer_id -> {"bitfield": bytearray or None for a full seeder, "failed": pieces it sent corrupt, "cancelled": pieces to cancel, "received": time of its last block}
+        "bad_pieces": {},  # peer_id -> number of pieces from it that failed verification
+        "banned": set(),  # Peers that are not used again in this download
+        "cursor": None,  # Piece a reader is playing from, fetched first with the pieces after it (None = not streaming)
+        "stopped": False,  # Set once the download has ended, so readers stop waiting for pieces that will not come
+        "lock": threading.Condition(),  # Guards the swarm and wakes idle workers
+    }
+
+
+def _move_piece(swarm, piece, delta):
+    """Change the availability of a piece and keep it in the right bucket if it is unrequested."""
+    availability = swarm["availability"][piece]
+    bucket = swarm["buckets"].get(availability)
+    if bucket is not None and piece in bucket:
+        bucket.discard(piece)
+        if not bucket:
+            del swarm["buckets"][availability]
+        swarm["buckets"].setdefault(availability + delta, set()).add(piece)
+    swarm["availability"][piece] = availability + delta
+
+
+def _release_piece(swarm, piece):
+    """Put a missing piece back into its availability bucket so it can be requested again."""
+    if not swarm["have"][piece]:
+        swarm["buckets"].setdefault(swarm["availability"][piece], set()).add(piece)
+
+
+def pack_bitfield(have):
+    """Pack one byte per piece into one bit per piece, first piece in the most significant bit."""
+    packed = bytearray((len(have) + 7) // 8)
+    for piece, present in enumerate(have):
+        if present:
+            packed[piece >> 3] |= 0x80 >> (piece & 7)
+    return bytes(packed)
+
+
+def unpack_bitfield(bitfield, total_chunks):
+    """Expand a packed bitfield into one byte (0 or 1) per piece."""
+    return bytearray((bitfield[piece >> 3] >> (7 - (piece & 7))) & 1 for piece in range(total_chunks))
+
+
+def peer_has(swarm, peer_id, piece):
+    """
+    Return True if the peer advertised the piece (full seeders have every piece).
+    A piece the peer sent corrupt is only asked from it again when no other connected peer has it.
+    """
+    peer = swarm["peers"][peer_id]
+    if piece in peer["failed"] and swarm["availability"][piece] > 1:
+        return False
+    return peer["bitfield"] is None or bool(peer["bitfield"][piece])
+
+
+def add_peer(swarm, peer_id, bitfield=None):
+    """Register a peer and count its pieces; bitfield None means the peer has the whole file."""
+    swarm["peers"][peer_id] = {"bitfield": bitfield, "failed": set(), "cancelled": [], "received": time.monotonic()}
+    for piece in range(swarm["total_chunks"]):
+        if bitfield is None or bitfield[piece]:
+            _move_piece(swarm, piece, 1)
+
+
+def add_peer_pieces(swarm, peer_id, pieces):
+    """Count the pieces a peer that is still downloading announced in a HAVE message."""
+    bitfield = swarm["peers"][peer_id]["bitfield"]
+    for piece in pieces:
+        if bitfield is not None and 0 <= piece < swarm["total_chunks"] and not bitfield[piece]:
+            bitfield[piece] = 1
+            _move_piece(swarm, piece, 1)
+    swarm["lock"].notify_all()
+
+
+def remove_peer(swarm, peer_id):
+    """Forget a peer, returning its outstanding requests to the pool."""
+    release_requests(swarm, peer_id)
+    bitfield = swarm["peers"].pop(peer_id)["bitfield"]
+    for piece in range(swarm["total_chunks"]):
+        if bitfield is None or bitfield[piece]:
+            _move_piece(swarm, piece, -1)
+    swarm["lock"].notify_all()
+
+
+def set_cursor(swarm, piece):
+    """Move the playback cursor to a piece, after a read or a seek."""
+    if swarm["cursor"] != piece:
+        swarm["cursor"] = piece
+        swarm["lock"].notify_all()  # Idle workers may have pieces of the new window to request
+
+
+def pick_pieces(swarm, peer_id, count, skip=()):
+    """
+    Choose up to count pieces to request from the peer, rarest first, except the pieces in skip: the ones
+    its worker is still receiving, which may be back in the pool after another worker reclaimed them.
+    While a reader streams the file, the unrequested pieces of the STREAM_WINDOW from its cursor come first, in order.
+    Once every missing piece is already requested and at most ENDGAME_PIECES are missing (endgame), pieces
+    outstanding at other peers are requested again so a slow peer cannot hold up the tail of the download.
+    """
+    picked = []
+    now = time.monotonic()
+    cursor = swarm["cursor"]
+    if cursor is not None:
+        for piece in range(cursor, min(cursor + STREAM_WINDOW, swarm["total_chunks"])):
+            if len(picked) >= count:
+                break
+            availability = swarm["availability"][piece]
+            bucket = swarm["buckets"].get(availability)
+            if bucket is not None and piece in bucket and piece not in skip and peer_has(swarm, peer_id, piece):
+                bucket.discard(piece)
+                if not bucket:
+                    del swarm["buckets"][availability]
+                swarm["requested"][piece] = {peer_id: now}
+                picked.append(piece)
+    for availability in sorted(swarm["buckets"]):
+        if len(picked) >= count:
+            break
+        bucket = swarm["buckets"][availability]
+        candidates = []
+        for piece in bucket:  # Stop scanning as soon as enough pieces are found
+            if piece not in skip and peer_has(swarm, peer_id, piece):
+                candidates.append(piece)
+                if len(picked) + len(candidates) >= count:
+                    break
+        for piece in candidates:
+            bucket.discard(piece)
+            swarm["requested"][piece] = {peer_id: now}
+        if not bucket:
+            del swarm["buckets"][availability]
+        picked.extend(candidates)
+    if not picked and not swarm["buckets"] and swarm["remaining"] <= ENDGAME_PIECES:  # Endgame: every missing piece is outstanding somewhere
+        for piece, requesters in swarm["requested"].items():
+            if len(picked) >= count:
+                break
+            if peer_id not in requesters and piece not in skip and peer_has(swarm, peer_id, piece):
+                requesters[peer_id] = now
+                picked.append(piece)
+    return picked
+
+
+def complete_piece(swarm, piece):
+    """
+    Mark a verified piece as downloaded; returns False if another peer delivered it first.
+    Every peer it is still requested from gets it in its "cancelled" list, so its worker sends CANCEL.
+    """
+    if swarm["have"][piece]:
+        return False
+    swarm["have"][piece] = 1
+    swarm["remaining"] -= 1
+    swarm["completed"].append(piece)
+    for peer_id in swarm["requested"].pop(piece, {}):
+        peer = swarm["peers"].get(peer_id)
+        if peer is not None:
+            peer["cancelled"].append(piece)
+    swarm["lock"].notify_all()
+    return True
+
+
+def fail_piece(swarm, peer_id, piece):
+    """
+    Put a piece that failed verification back in the pool, preferably for another peer, and count it
+    against the peer that sent it; returns True once the peer has sent MAX_BAD_PIECES bad pieces and is banned.
+    """
+    swarm["peers"][peer_id]["failed"].add(piece)
+    release_requests(swarm, peer_id, [piece])
+    swarm["bad_pieces"][peer_id] = swarm["bad_pieces"].get(peer_id, 0) + 1
+    if swarm["bad_pieces"][peer_id] < MAX_BAD_PIECES:
+        return False
+    swarm["banned"].add(peer_id)
+    return True
+
+
+def release_requests(swarm, peer_id, pieces=None):
+    """Return the peer's outstanding requests (or just the given pieces) to the pool."""
+    for piece in list(swarm["requested"]) if pieces is None else pieces:
+        requesters = swarm["requested"].get(piece)
+        if requesters is None or requesters.pop(peer_id, None) is None:
+            continue
+        if not requesters:
+            del swarm["requested"][piece]
+            _release_piece(swarm, piece)
+    swarm["lock"].notify_all()
+
+
+def reclaim_stalled(swarm, stall_timeout_seconds):
+    """
+    Return the requests of peers that have sent nothing for longer than stall_timeout_seconds since the
+    request was sent (a slow peer still sending blocks keeps its pieces); returns stalled peers.
+    """
+    now = time.monotonic()
+    stalled = set()
+    for piece, requesters in list(swarm["requested"].items()):
+        for peer_id, sent_time in list(requesters.items()):
+            peer = swarm["peers"].get(peer_id)
+            if now - max(sent_time, peer["received"] if peer is not None else sent_time) > stall_timeout_seconds:
+                stalled.add(peer_id)
+                release_requests(swarm, peer_id, [piece])
+    return stalled
+
+
+def contiguous_pieces(swarm):
+    """Return the number of pieces downloaded without gaps from the start of the file."""
+    have = swarm["have"]
+    contiguous = swarm["contiguous"]
+    while contiguous < swarm["total_chunks"] and have[contiguous]:
+        contiguous += 1
+    swarm["contiguous"] = contiguous
+    return contiguous
@@ -0,0 +1,172 @@
+import os  # Library for positional and vectored writes and fsync
+import threading  # Library for the background writer
+import time  # Library for timing how long receivers wait for the disk
+from Piece_Scheduler import complete_piece
+from Transfer_Metrics import count, mark_time, observe
+
+# Verified pieces are written by one background writer per download so a slow disk does not stall the threads
+# receiving from peers. Pieces are assembled in buffers from a pool and go back to it once written, so a
+# download does not allocate a buffer per piece. The writer takes every piece queued since its last write and
+# writes pieces that are adjacent in the file with one pwritev call. Receivers block once WRITE_BEHIND_BYTES
+# are queued, which slows the download to the pace of the disk instead of filling memory. A piece is only
+# marked as downloaded, and so served to other leechers and saved in the resume bitfield, once it is written.
+WRITE_BEHIND = True  # Write verified pieces on a background writer (False writes them on the receiving thread)
+WRITE_BEHIND_BYTES = 32 * 1024 * 1024  # Verified pieces waiting for the disk before receivers block
+MAX_WRITE_BYTES = 8 * 1024 * 1024  # Largest single write of adjacent pieces
+MAX_WRITE_PIECES = 256  # Largest number of pieces in one write, below the IOV_MAX of common platforms
+FREE_BUFFER_BYTES = 32 * 1024 * 1024  # Piece buffers a download keeps for reuse
+# When downloaded data is forced to disk: "write" after every write, "resume" before each resume bitfield is
+# saved, "none" never (a crash of the process loses nothing, a power loss can lose pieces the bitfield claims)
+FSYNC_POLICY = "resume"
+
+
+def create_writer(file, swarm, chunk_size):
+    """Return the write-behind state of a download into file, starting its writer when WRITE_BEHIND is on."""
+    writer = {
+        "file": file,
+        "swarm": swarm,
+        "chunk_size": chunk_size,
+        "queue": [],  # (piece, data, buffer) verified and waiting to be written
+        "queued_bytes": 0,  # Bytes queued or being written
+        "free": [],  # Buffers ready for reuse
+        "condition": threading.Condition(),  # Guards the fields above and wakes the writer and waiting receivers
+        "file_lock": threading.Lock(),  # Serialises seek + write where pwrite is not available
+        "closed": False,
+        "error": None,  # OSError that stopped the writer
+        "thread": None,
+    }
+    if WRITE_BEHIND:
+        writer["thread"] = threading.Thread(target=write_behind, args=(writer,), daemon=True)
+        writer["thread"].start()
+    return writer
+
+
+def acquire_buffer(writer, length):
+    """Return a pooled buffer for a piece of length bytes and a view of its first length bytes."""
+    with writer["condition"]:
+        buffer = writer["free"].pop() if writer["free"] else None
+    if buffer is None:
+        buffer = bytearray(writer["chunk_size"])
+        count("download.buffers_allocated")
+    return buffer, memoryview(buffer)[:length]
+
+
+def release_buffer(writer, buffer):
+    """Give a piece buffer back to the pool once nothing reads it any more."""
+    with writer["condition"]:
+        if len(writer["free"]) * writer["chunk_size"] < FREE_BUFFER_BYTES:
+            writer["free"].append(buffer)
+
+
+def queue_piece(writer, piece, data, buffer):
+    """Hand a verified piece to the writer, waiting while WRITE_BEHIND_BYTES are queued already."""
+    if writer["thread"] is None:
+        write_pieces(writer, [(piece, data, buffer)])
+        return
+    condition = writer["condition"]
+    wait_start = None
+    with condition:
+        while writer["queued_bytes"] >= WRITE_BEHIND_BYTES and writer["error"] is None:
+            wait_start = wait_start or time.perf_counter()
+            condition.wait()
+        if writer["error"] is not None:
+            raise OSError(f"Download cannot be written: {writer['error']}")
+        writer["queue"].append((piece, data, buffer))
+        writer["queued_bytes"] += len(data)
+        condition.notify_all()
+    if wait_start is not None:
+        observe("download.write_wait_ms", (time.perf_counter() - wait_start) * 1000)
+
+
+def write_behind(writer):
+    """Write queued pieces until the writer is closed and its queue is empty, run on a background thread."""
+    condition = writer["condition"]
+    while True:
+        with condition:
+            while not writer["queue"] and not writer["closed"]:
+                condition.wait()
+            if not writer["queue"]:
+                return
+            pieces, writer["queue"] = writer["queue"], []
+        try:
+            write_pieces(writer, pieces)
+        except OSError as error:
+            print(f"Could not write the download: {error}")
+            with condition:
+                writer["error"] = error
+                condition.notify_all()
+            return
+        with condition:
+            writer["queued_bytes"] -= sum(len(data) for _, data, _ in pieces)
+            condition.notify_all()
+
+
+def write_run(writer, offset, views):
+    """Write the views of adjacent pieces from offset on, in one call where the platform has pwritev."""
+    fd = writer["file"].fileno()
+    if hasattr(os, "pwritev"):
+        written = os.pwritev(fd, views, offset)
+        if written == sum(len(view) for view in views):
+            return
+        views, offset = [memoryview(b"".join(views))[written:]], offset + written  # Finish a short write below
+    if hasattr(os, "pwrite"):
+        for view in views:
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view, offset = view[written:], offset + written
+    else:
+        with writer["file_lock"]:
+            writer["file"].seek(offset)
+            for view in views:
+                writer["file"].write(view)
+
+
+def write_pieces(writer, pieces):
+    """
+    Write the pieces that are not on disk yet, adjacent ones together, then mark them downloaded.
+    A piece delivered twice in the endgame is written once.
+    """
+    swarm, chunk_size = writer["swarm"], writer["chunk_size"]
+    fresh = {}  # piece -> data
+    with swarm["lock"]:
+        for piece, data, _ in pieces:
+            if not swarm["have"][piece]:
+                fresh[piece] = data
+    runs = []  # Lists of adjacent pieces, each written with one call
+    for piece in sorted(fresh):
+        run = runs[-1] if runs else None
+        if (run is None or piece != run[-1] + 1 or len(run) >= MAX_WRITE_PIECES
+                or (len(run) + 1) * chunk_size > MAX_WRITE_BYTES):
+            runs.append([piece])
+        else:
+            run.append(piece)
+    for run in runs:
+        write_run(writer, run[0] * chunk_size, [fresh[piece] for piece in run])
+    if runs and FSYNC_POLICY == "write":
+        os.fsync(writer["file"].fileno())
+    completed = 0
+    with swarm["lock"]:
+        for piece in fresh:
+            completed += complete_piece(swarm, piece)  # Only marked once it is on disk
+    count("download.pieces", completed)
+    count("download.duplicate_pieces", len(pieces) - completed)
+    count("download.writes", len(runs))
+    if completed:
+        mark_time("download.first_piece_seconds")
+    for _, _, buffer in pieces:
+        release_buffer(writer, buffer)
+
+
+def close_writer(writer):
+    """Wait until every queued piece is written and stop the writer."""
+    with writer["condition"]:
+        writer["closed"] = True
+        writer["condition"].notify_all()
+    if writer["thread"] is not None:
+        writer["thread"].join()
+
+
+def sync_for_resume(file):
+    """Force the download to disk before its resume bitfield is saved, unless FSYNC_POLICY says otherwise."""
+    if FSYNC_POLICY == "resume":
+        os.fsync(file.fileno())  # The bitfield must never claim pieces that are not on disk yet
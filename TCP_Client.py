@@ -3,99 +3,682 @@ import time  # Library for time-related functions
 import json  # Library to handle JSON encoding and decoding
 import datetime  # Library to work with dates and times
 from pathlib import Path  # Library to work with file system paths
-import hashlib
-import math
+import threading  # Library for downloading from several seeders at once
+import os  # Library for positional writes and atomic renames
+import sys  # Library for answers given on the command line
+import queue  # Library for handing peers matched during a download to it
+import select  # Library for waiting until a peer sends the next frame
+import collections  # Library for the queue of blocks waiting to be requested and the frames of each stream
+from urllib.parse import quote  # Library for the URL a download can be streamed from
+from Peer_Protocol import BLOCK_SIZE, send_message, recv_message, recv_frame, FRAME_CHUNK
+from Piece_Manifest import verify_manifest
+from Piece_Hashing import HASH_BATCH_BYTES, submit_batch
+from Piece_Writer import create_writer, acquire_buffer, release_buffer, queue_piece, close_writer, sync_for_resume
+from Piece_Scheduler import create_swarm, add_peer, add_peer_pieces, remove_peer, pick_pieces, fail_piece, release_requests, reclaim_stalled, contiguous_pieces, set_cursor, pack_bitfield, unpack_bitfield
+from Media_Stream import start_stream_server
+from Upload_Shaping import LIMITS_SUFFIX, create_upload, remove_upload, record_received, start_upload_shaping
+from Peer_Session import serve_session, serve_leechers
+from Tracker_Announce import announce_periodically
+from Transfer_Metrics import STATS_SUFFIX, count, mark_time, observe, read_counter, set_gauge, start_stats_dump, write_stats, report_progress
 # Constants to define server information and settings
 server_name = "localhost"  # The server where we'll send messages (localhost for local testing)
 UDP_SERVER_PORT = 12000  # The UDP port the server listens on
 TCP_SERVER_PORT = 12500  # The TCP port for client-server communication
-P2P_SERVER_PORT = 13000  # The port used for peer-to-peer communication
+P2P_SERVER_PORT = 0  # The port other leechers download from us on (0 lets the system pick a free one)
 WAITING_TIME_SECONDS = 10  # Time to wait for responses (in seconds)
 MAX_NUMBER_OF_CLIENTS_IN_QUEUE = 15  # Max clients allowed in TCP connection queue
-CHUNK_SIZE = 4096
+WINDOW_SIZE = 64  # Number of block requests kept in flight on one connection
+ACK_EVERY = 16  # Send a cumulative acknowledgment after this many verified pieces
+STALL_TIMEOUT_SECONDS = 10  # Pieces of a peer that sends nothing for this long are given to other peers
+MATCH_GATHER_SECONDS = 1  # Time to keep collecting seeder matches before the download starts
+RESUME_FLUSH_SECONDS = 1  # How often the bitfield of verified pieces is saved next to the download
+RESUME_SUFFIX = ".pieces"  # Suffix of the file that records which pieces are already downloaded
+MAX_CONCURRENT_UPLOADS = 4  # Max number of other leechers served at the same time
+KEEP_SESSIONS = True  # Keep connections to peers open after a transfer so the next file skips the handshake
+NOT_SHARING_RETRY_SECONDS = 1  # Wait before asking again a leecher that did not share the file yet
+NOT_SHARING_RETRIES = 5  # Times a leecher that answered ERROR 404 is asked again
+NOT_SHARING = "not sharing"  # Returned by open_peer_transfer when the peer answers ERROR 404
+STREAM_PORT = None  # Loopback HTTP port media players can stream a download from while it runs (None = off, 0 = any free port)
 
 # Creating UDP and TCP sockets
 UDP_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP socket for sending and receiving data
 TCP_client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # TCP socket for reliable connection
 local_ip = socket.gethostbyname(socket.gethostname())  # Getting the local IP address of the machine
 server_address = (server_name, UDP_SERVER_PORT)  # Address of the server to communicate with
-def create_seeder():
-    global UDP_socket
-    UDP_socket = UDP_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    print("\nConnected to Tracker as a seeder")
-      # Reuses socket
-def compute_chunk_checksum(chunk):
-    """Generate SHA-256 checksum for a single chunk."""
-    return hashlib.sha256(chunk).hexdigest()
-
-def request_file(file):
-    """
-    Sends a request for a specific file to the server over TCP.
+announce = {"interval": WAITING_TIME_SECONDS, "peer_type": "L", "upload_port": None}  # Re-announce interval (from the tracker), current role and upload listener port
+sharing = {}  # file_id -> {"manifest", "swarm", "save_path"} of the files other leechers may download from us
+active_uploads = set()  # Addresses of the leechers being served
+active_uploads_lock = threading.Lock()  # Protects active_uploads
+# A connection to a peer is a session shared by every transfer from that peer, each on its own stream.
+# Sessions have no reader thread: whichever stream is waiting for a frame reads the socket and queues the
+# frames of the other streams, so a lone transfer gets its blocks without a thread switch per frame.
+sessions = {}  # (ip, tcp_port) -> open session with that peer
+sessions_lock = threading.Lock()  # Protects sessions and connecting
+connecting = {}  # (ip, tcp_port) -> lock held while a pooled session with that peer is being opened
+
+def open_session(peer):
+    """Connect to a peer and return a session for its streams, or None if the peer refuses the connection."""
+    TCP_peer_socket = connect_to_TCP(peer[0], peer[1])
+    if TCP_peer_socket is None:
+        return None
+    TCP_peer_socket.settimeout(STALL_TIMEOUT_SECONDS)  # A frame that starts arriving must be complete within this
+    lock = threading.Lock()
+    count("download.sessions")
+    return {"peer": peer, "socket": TCP_peer_socket, "lock": lock, "frame_ready": threading.Condition(lock),
+            "send_lock": threading.Lock(), "streams": {}, "next_stream_id": 1, "reading": False, "closed": False}
+
+def close_session(session):
+    """Take a session out of the pool and shut its connection down, waking every stream waiting on it."""
+    with session["lock"]:
+        session["closed"] = True
+        session["frame_ready"].notify_all()
+    with sessions_lock:
+        if sessions.get(session["peer"]) is session:
+            del sessions[session["peer"]]
+    try:
+        session["socket"].shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # Already closed
+
+def open_stream(peer):
+    """
+    Open a stream to a peer on its pooled session, connecting first if there is none; returns the stream or None.
+    Transfers that start together wait for one connection and share it rather than each taking an upload slot.
+    """
+    with sessions_lock:
+        peer_lock = connecting.setdefault(peer, threading.Lock())
+    with peer_lock:
+        with sessions_lock:
+            session = sessions.get(peer)
+        reused = session is not None
+        if not reused:
+            session = open_session(peer)
+            if session is None:
+                return None
+            if KEEP_SESSIONS:
+                with sessions_lock:
+                    sessions[peer] = session
+    with session["lock"]:
+        if session["closed"]:
+            return open_stream(peer)  # Closed since it was taken from the pool
+        stream_id = session["next_stream_id"]
+        session["next_stream_id"] += 1
+        frames = session["streams"][stream_id] = collections.deque()
+    if reused:
+        count("download.reused_sessions")
+    return {"session": session, "stream_id": stream_id, "frames": frames, "reused": reused}
+
+def stream_send(stream, msg):
+    """Send a message on a stream; the send lock keeps frames of concurrent streams from interleaving."""
+    msg["stream_id"] = stream["stream_id"]
+    with stream["session"]["send_lock"]:
+        send_message(stream["session"]["socket"], msg)
+
+def queue_frame(session, frame_type, payload):
+    """Queue a frame on the stream it belongs to; frames of streams already closed are dropped."""
+    if frame_type == FRAME_CHUNK:
+        stream_id, chunk_index, offset, block_data = payload
+        payload = (chunk_index, offset, block_data)
+    else:
+        stream_id = payload.get("stream_id")
+    frames = session["streams"].get(stream_id)
+    if frames is not None:
+        frames.append((frame_type, payload))
+
+def stream_recv(stream, timeout=STALL_TIMEOUT_SECONDS, block_buffer=None):
+    """
+    Return the next (frame_type, payload) of a stream, raising socket.timeout if none arrives in time.
+    block_buffer goes to recv_frame when this stream reads the socket. It must return None for blocks of
+    the other streams, whose threads may be releasing their piece buffers meanwhile.
+    """
+    session = stream["session"]
+    deadline = time.monotonic() + timeout
+    while True:
+        with session["lock"]:
+            while not stream["frames"] and session["reading"] and not session["closed"]:
+                if not session["frame_ready"].wait(max(deadline - time.monotonic(), 0)):
+                    break  # Timed out waiting for the stream reading the socket
+            if stream["frames"]:
+                return stream["frames"].popleft()
+            if session["closed"]:
+                raise ConnectionError("Connection closed by peer")
+            if session["reading"] or time.monotonic() >= deadline:
+                raise socket.timeout(f"No frame in {timeout} seconds")
+            session["reading"] = True  # This stream reads the socket for every stream of the session
+        frame = None
+        try:
+            readable, _, _ = select.select([session["socket"]], [], [], max(deadline - time.monotonic(), 0))
+            if readable:
+                frame = recv_frame(session["socket"], block_buffer)
+        except (OSError, ValueError):
+            close_session(session)  # A frame cut short leaves the connection unusable
+            raise
+        finally:
+            with session["lock"]:
+                session["reading"] = False
+                if frame is not None:
+                    queue_frame(session, *frame)
+                session["frame_ready"].notify_all()
+
+def close_stream(stream, reusable=True):
+    """
+    Forget a stream. Its session stays open for the next transfer unless KEEP_SESSIONS is off, or the
+    stream was abandoned (reusable=False) with requests the peer may still be answering.
+    """
+    session = stream["session"]
+    with session["lock"]:
+        del session["streams"][stream["stream_id"]]
+        idle = not session["streams"]
+    if not reusable or (idle and not KEEP_SESSIONS):
+        close_session(session)
+
+def close_sessions():
+    """Close every pooled session."""
+    with sessions_lock:
+        pooled = list(sessions.values())
+        sessions.clear()
+    for session in pooled:
+        close_session(session)
+
+def request_file(stream, file):
+    """
+    Sends a request for a specific file to the server on a stream.
     The server will respond with the file data or an error message.
     """
     msg = {
         "message_type": "REQUEST_FILE",  # Type of message: Requesting a file
         "peer_id": local_ip,  # The IP address of the current client
-        "requested_file": file  # Name or ID of the requested file
+        "requested_file": file,  # Name or ID of the requested file
+        "block_size": BLOCK_SIZE,  # Block size we would like pieces to be sent in
+        "uploaded": read_counter("upload.bytes"),  # Seeders unchoke leechers that share first
+        "upload_port": announce["upload_port"]  # A peer that downloads from us too ranks us by what it gets there
     }
-    TCP_client_socket.send(json.dumps(msg).encode())  # Send the request as a JSON-encoded message
-    modified_sentence = TCP_client_socket.recv(1024)  # Receive a response from the server
-    return json.loads(modified_sentence.decode())  # Return the server's response after decoding it
+    stream_send(stream, msg)  # Send the request as a framed JSON message
+    return recv_stream_message(stream)  # Return the server's response after decoding it
 
-def reconfigure():
+def recv_stream_message(stream):
     """
-    Downloads the file by requesting each chunk one by one from the server.
-    The file is saved on the disk as it's being downloaded.
+    Return the next control message of a stream, raising ValueError if a chunk frame comes instead.
+    HASHING keepalives, sent while the peer hashes a file for the first time, restart the wait.
     """
-    global SAVE_PATH, total_chunks
-    file_size = int(TCP_client_socket.recv(1024).decode())  
-    total_chunks = math.ceil(file_size / CHUNK_SIZE)
-    TCP_client_socket.sendall(str(total_chunks).encode())  # Acknowledge file size 
-    
-      # Make the SAVE_PATH and total_chunks variables accessible here
-    with open(SAVE_PATH, "wb") as file:  # Open the file for writing in binary mode
-        chunk_index = 0
-        while (chunk_index <= total_chunks):  # Loop through each chunk of the file
-            request_chunk(chunk_index)  # Request the chunk from the server
-            chunk_packet = TCP_client_socket.recv(10240).decode()# Receive the chunk data
-            
-            
-            chunk_packet = json.loads(chunk_packet)
-            chunk_data = bytes.fromhex(chunk_packet["data"])
-            if compute_chunk_checksum(chunk_data) != chunk_packet["checksum"]:
-                print("There an issue")
-                retransmit = {
-                    "chunk_index": chunk_index,
-                    "message_type": "RETRANSMIT",  # Convert binary to hex for JSON transmission
-                }
-                TCP_connection_socket.send(json.dumps(retransmit.encode()))
+    while True:
+        frame_type, message = stream_recv(stream, WAITING_TIME_SECONDS)
+        if frame_type == FRAME_CHUNK:
+            raise ValueError("Expected a message frame")
+        if message.get("message_type") != "HASHING":
+            return message
+
+def open_peer_transfer(peer, file_id):
+    """
+    Opens a stream to a seeder, reusing the connection of an earlier transfer if it is still open, and
+    requests file_id on it.
+    Returns (stream, manifest), NOT_SHARING if the peer does not have the file (a leecher that started with
+    us shares it once it knows the manifest), or None if the peer is unreachable or sends a manifest whose
+    piece hashes do not match its root hash.
+    """
+    for attempt in range(2):
+        try:
+            stream = open_stream(peer)
+        except (OSError, ValueError) as error:
+            print(f"Could not connect to peer {peer}: {error}")
+            return None
+        if stream is None:
+            return None
+        try:
+            response = request_file(stream, file_id)
+            if response["message_type"] != "BEGIN":
+                print(f"Peer {peer} could not provide {file_id}: {response.get('error_message')}")
+                close_stream(stream)
+                return NOT_SHARING if response.get("error_code") == 404 else None
+            manifest = recv_stream_message(stream)  # File size, chunk size, piece hashes and the agreed block size
+            manifest["digests"] = verify_manifest(manifest)
+            if manifest["digests"] is None or not isinstance(manifest.get("block_size"), int) or manifest["block_size"] <= 0:
+                print(f"Peer {peer} sent an invalid manifest for {file_id}")
+                close_stream(stream, reusable=False)
+                return None
+            return stream, manifest
+        except (OSError, ValueError) as error:
+            close_stream(stream, reusable=False)
+            if isinstance(error, ConnectionError) and stream["reused"] and attempt == 0:
+                continue  # The peer closed the pooled connection as we reused it, connect again
+            print(f"Could not open a transfer with peer {peer}: {error}")
+            return None
+
+def finish_peer_transfer(stream, total_chunks):
+    """Tell the seeder every chunk has arrived, which closes the stream on its side; duplicates still in flight are dropped."""
+    try:
+        ack_receive_chunk(stream, total_chunks - 1)
+    except OSError:
+        close_stream(stream, reusable=False)
+        return
+    close_stream(stream)
+
+def resume_path(save_path):
+    """Return the path of the bitfield file kept next to a download."""
+    return Path(str(save_path) + RESUME_SUFFIX)
+
+def load_resume_state(save_path, manifest):
+    """
+    Returns the pieces (one byte per piece) already verified in an earlier download of the same file.
+    The bitfield file starts with the manifest root hash so a different version of the file starts over.
+    """
+    try:
+        saved = resume_path(save_path).read_bytes()
+        root_hash, bitfield = saved.split(b"\n", 1)
+        if root_hash.decode() == manifest["root_hash"] and os.path.getsize(save_path) == manifest["file_size"]:
+            return unpack_bitfield(bitfield, len(manifest["digests"]))
+    except (OSError, ValueError, IndexError):
+        pass  # No usable earlier download
+    return None
+
+def save_resume_state(save_path, manifest, file, have):
+    """Flush the downloaded data to disk, then record which pieces it contains."""
+    sync_for_resume(file)
+    temporary_path = Path(str(resume_path(save_path)) + ".tmp")
+    temporary_path.write_bytes(manifest["root_hash"].encode() + b"\n" + pack_bitfield(have))
+    os.replace(temporary_path, resume_path(save_path))
+
+def open_download_file(save_path, file_size):
+    """Open the download target for positional writes, creating and preallocating it if needed."""
+    try:
+        file = open(save_path, "r+b", buffering=0)  # Keep the pieces of an interrupted download
+    except FileNotFoundError:
+        Path(save_path).parent.mkdir(parents=True, exist_ok=True)  # Files in a seeder's subfolders keep their folders
+        file = open(save_path, "w+b", buffering=0)
+    if os.fstat(file.fileno()).st_size != file_size:
+        file.truncate(file_size)
+        if file_size and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(file.fileno(), 0, file_size)  # Reserve the disk space up front
+    return file
+
+def piece_length(manifest, piece):
+    """Return the length of a piece; only the last one can be shorter than the chunk size."""
+    return min(manifest["chunk_size"], manifest["file_size"] - piece * manifest["chunk_size"])
+
+def request_blocks(stream, unrequested, pending, budget):
+    """
+    Request up to budget blocks from the runs of blocks waiting in unrequested, one REQUEST per run.
+    Each run is [piece, first block, end block]; returns the number of blocks requested.
+    """
+    requested = 0
+    while unrequested and requested < budget:
+        run = unrequested[0]
+        piece, first_block, end_block = run
+        count = min(end_block - first_block, budget - requested)
+        request_chunk(stream, piece, first_block, count)
+        pending[piece]["outstanding"] += count
+        requested += count
+        if first_block + count == end_block:
+            unrequested.popleft()
+        else:
+            run[1] += count
+    return requested
+
+def store_verified_pieces(swarm, manifest, peer, writer, batch, digests):
+    """
+    Queue the pieces of a hashed batch that match the manifest for writing and requeue the others for any peer.
+    batch holds (piece, data, buffer, time it was requested); returns (pieces that passed, whether the peer is now banned).
+    """
+    lock = swarm["lock"]
+    passed = 0
+    banned = False
+    for (chunk_index, data, buffer, requested), digest in zip(batch, digests):
+        if digest != manifest["digests"][chunk_index]:  # Requeued for any peer while this one keeps streaming its other pieces
+            release_buffer(writer, buffer)
+            count("download.corrupt_pieces")
+            with lock:
+                banned = fail_piece(swarm, peer, chunk_index) or banned
+            print(f"Chunk {chunk_index} from {peer} is corrupt, requesting it again")
+            continue
+        observe("download.piece_latency_ms", (time.monotonic() - requested) * 1000)
+        count("download.bytes", len(data))
+        record_received(peer, len(data))  # Our leechers that gave us the most are unchoked first
+        if not swarm["have"][chunk_index]:  # Duplicates from the endgame are dropped
+            queue_piece(writer, chunk_index, data, buffer)  # Written at its offset and marked downloaded in the background
+        else:
+            release_buffer(writer, buffer)
+            count("download.duplicate_pieces")
+        passed += 1
+    report_progress(f"Download of {manifest['file_id']}", swarm["total_chunks"] - swarm["remaining"], swarm["total_chunks"])
+    return passed, banned
+
+def download_from_peer(swarm, manifest, peer, stream, writer, block_size):
+    """
+    Downloads the pieces the scheduler assigns to one peer in blocks of block_size, keeping up to WINDOW_SIZE
+    block requests in flight. Blocks are received straight into pooled piece buffers and every piece is verified against the manifest
+    hashes before it is written. Complete pieces are hashed on the hash pool in batches while this thread keeps
+    receiving, and written by the download's writer. When the peer stalls or disconnects its outstanding pieces go back to the
+    scheduler for the other peers, and so do the pieces requested when it chokes us, until it unchokes us again.
+    Pieces another peer delivered first in the endgame are cancelled, so the peer stops sending their blocks.
+    """
+    lock = swarm["lock"]
+    hash_algorithm = manifest["hash_algorithm"]
+    chunk_size = manifest["chunk_size"]
+    blocks_per_piece = -(-chunk_size // block_size)  # Ceiling division
+    pending = {}  # piece -> {"data": view of the pooled "buffer" the piece is assembled in, "missing": bytes not received, "outstanding": blocks requested, "requested": time}
+    unrequested = collections.deque()  # Runs of blocks of pending pieces not requested yet
+    batch, batch_bytes = [], 0  # Complete pieces (piece, data, buffer, requested time) not handed to the hash pool yet
+    verifying = collections.deque()  # (future of the digests, batch) being hashed, oldest first
+    outstanding = 0  # Blocks requested from this peer and not received yet
+    unacked = 0  # Verified pieces not covered by an acknowledgment yet
+    banned = False
+    choked = False  # The peer ignores our requests until it unchokes us
+    with lock:
+        peer_state = swarm["peers"][peer]
+        partial = peer_state["bitfield"] is not None  # Still downloading, announces new pieces with HAVE
+
+    def block_buffer(stream_id, chunk_index, offset, block_length):
+        """Return the slice of a pending piece a block of this stream is received into, or None."""
+        entry = pending.get(chunk_index) if stream_id == stream["stream_id"] else None
+        if entry is None or offset + block_length > len(entry["data"]):
+            return None
+        return entry["data"][offset:offset + block_length]
+
+    try:
+        while True:
+            while verifying and verifying[0][0].done() and not banned:
+                future, hashed = verifying.popleft()
+                passed, banned = store_verified_pieces(swarm, manifest, peer, writer, hashed, future.result())
+                unacked += passed
+            if banned:
+                print(f"Peer {peer} sent too many corrupt pieces, banning it")
+                count("download.banned_peers")
+                break
+            if unacked >= ACK_EVERY:
+                with lock:
+                    contiguous = contiguous_pieces(swarm)
+                if contiguous:
+                    ack_receive_chunk(stream, contiguous - 1)  # Acknowledge every piece up to the first gap
+                unacked = 0
+            if swarm["peers"][peer]["cancelled"]:  # Delivered first by another peer in the endgame
+                with lock:
+                    cancelled = swarm["peers"][peer]["cancelled"]
+                    swarm["peers"][peer]["cancelled"] = []
+                for piece in cancelled:
+                    entry = pending.pop(piece, None)
+                    if entry is None:
+                        continue  # Already received from this peer
+                    release_buffer(writer, entry["buffer"])
+                    if entry["outstanding"]:
+                        cancel_chunk(stream, piece)  # Blocks already on their way are ignored when they arrive
+                        outstanding -= entry["outstanding"]
+                    count("download.cancelled_pieces")
+                unrequested = collections.deque(run for run in unrequested if run[0] in pending)
+            wanted = WINDOW_SIZE - outstanding - sum(end_block - first_block for _, first_block, end_block in unrequested)
+            with lock:
+                if swarm["remaining"] == 0:
+                    break
+                pieces = pick_pieces(swarm, peer, -(-wanted // blocks_per_piece), pending) if wanted > 0 and not choked else []
+                idle = not pieces and not outstanding and not unrequested
+                if idle and not batch and not verifying:
+                    reclaim_stalled(swarm, STALL_TIMEOUT_SECONDS)  # Take over pieces other peers sit on
+                    if not partial and not choked:
+                        lock.wait(0.5)  # Nothing to do until pieces are released or the download completes
+                        continue
+            if idle and (batch or verifying):
+                if batch:
+                    verifying.append((submit_batch([data for _, data, _, _ in batch], hash_algorithm), batch))
+                    batch, batch_bytes = [], 0
+                verifying[0][0].result()  # Nothing to receive until these pieces are stored
                 continue
-            perc = 100*chunk_index/total_chunks
-            print(f"Download Progress : {perc:.2f}")
-            ack_receive_chunk(chunk_index)  # Send acknowledgment that the chunk was received
-            chunk_index += 1
-            file.write(chunk_data)  # Write the received chunk to the file
-    print(f"\nFile downloaded successfully: {SAVE_PATH}\n")  # Notify that the file has been successfully downloaded
-    #TCP_client_socket.close()
+            for piece in pieces:
+                length = piece_length(manifest, piece)
+                buffer, data = acquire_buffer(writer, length)
+                pending[piece] = {"data": data, "buffer": buffer, "missing": length, "outstanding": 0, "requested": time.monotonic()}
+                unrequested.append([piece, 0, -(-length // block_size)])
+            outstanding += request_blocks(stream, unrequested, pending, WINDOW_SIZE - outstanding)  # Fill the window
+
+            try:
+                frame_type, chunk_packet = stream_recv(stream, 0.5 if idle else STALL_TIMEOUT_SECONDS, block_buffer)  # Receive the block frame
+            except socket.timeout:
+                if idle:
+                    continue  # Wait for the peer to get new pieces
+                raise
+            if frame_type != FRAME_CHUNK:
+                message_type = chunk_packet.get("message_type")
+                if message_type == "HAVE":
+                    with lock:
+                        add_peer_pieces(swarm, peer, chunk_packet["chunk_indexes"])
+                    continue
+                if message_type == "REJECT":  # The peer does not have the piece after all
+                    rejected = pending.pop(chunk_packet["chunk_index"], None)
+                    if rejected is not None:
+                        release_buffer(writer, rejected["buffer"])
+                        outstanding -= rejected["outstanding"]
+                        unrequested = collections.deque(run for run in unrequested if run[0] != chunk_packet["chunk_index"])
+                        with lock:
+                            release_requests(swarm, peer, [chunk_packet["chunk_index"]])
+                    continue
+                if message_type == "CHOKE":  # Requests in flight are dropped by the peer, other peers take them over
+                    choked = True
+                    count("download.chokes")
+                    for entry in pending.values():
+                        release_buffer(writer, entry["buffer"])
+                    with lock:
+                        release_requests(swarm, peer, list(pending))
+                    pending.clear()
+                    unrequested.clear()
+                    outstanding = 0
+                    continue
+                if message_type == "UNCHOKE":
+                    choked = False
+                    continue
+                print(f"Unexpected message from peer {peer}: {chunk_packet}")
+                break
+            chunk_index, offset, block_data = chunk_packet
+            entry = pending.get(chunk_index)
+            if entry is None or offset + len(block_data) > len(entry["data"]):
+                continue  # Not a block we asked this peer for
+            if block_data.obj is not entry["buffer"]:  # Queued by the stream reading the socket, not received in place
+                entry["data"][offset:offset + len(block_data)] = block_data
+            entry["missing"] -= len(block_data)
+            entry["outstanding"] -= 1
+            outstanding -= 1
+            peer_state["received"] = time.monotonic()  # Still sending, other workers do not reclaim its pieces
+            if entry["missing"] > 0:
+                continue
+            del pending[chunk_index]
+            batch.append((chunk_index, entry["data"], entry["buffer"], entry["requested"]))
+            batch_bytes += len(entry["data"])
+            if batch_bytes >= HASH_BATCH_BYTES or not outstanding:  # Full, or nothing more is on its way
+                verifying.append((submit_batch([data for _, data, _, _ in batch], hash_algorithm), batch))
+                batch, batch_bytes = [], 0
+    except socket.timeout:
+        print(f"Peer {peer} stalled, reassigning its pieces")
+        count("download.stalled_peers")
+    except (OSError, ValueError) as error:
+        print(f"Lost connection to peer {peer}: {error}")
+    if batch:
+        verifying.append((submit_batch([data for _, data, _, _ in batch], hash_algorithm), batch))
+    try:
+        for future, hashed in verifying:  # Keep the pieces that arrived before the peer went away
+            store_verified_pieces(swarm, manifest, peer, writer, hashed, future.result())
+    except OSError as error:
+        print(f"Could not store the last pieces from peer {peer}: {error}")
+    for entry in pending.values():
+        release_buffer(writer, entry["buffer"])
+    with lock:
+        remove_peer(swarm, peer)  # Give any outstanding pieces back to the other peers
+        complete = swarm["remaining"] == 0
+    if complete:
+        finish_peer_transfer(stream, swarm["total_chunks"])
+    else:
+        close_stream(stream, reusable=False)
+
+def peer_bitfield(peer_manifest, total_chunks):
+    """Return the pieces of a peer that is still downloading, or None for a peer with the whole file."""
+    if "bitfield" not in peer_manifest:
+        return None
+    return unpack_bitfield(bytes.fromhex(peer_manifest["bitfield"]), total_chunks)
+
+def join_download(swarm, manifest, peer, file_id, writer):
+    """
+    Open a transfer with a peer matched after the download started, or one that did not share the file
+    yet, and download from it too. A peer that is not sharing the file is asked again NOT_SHARING_RETRIES times.
+    """
+    for attempt in range(NOT_SHARING_RETRIES + 1):
+        opened = open_peer_transfer(peer, file_id)
+        if opened is not NOT_SHARING:
+            break
+        time.sleep(NOT_SHARING_RETRY_SECONDS)
+        if swarm["stopped"] or swarm["remaining"] == 0:
+            return
+    if opened is None or opened is NOT_SHARING:
+        return
+    stream, peer_manifest = opened
+    if peer_manifest["root_hash"] != manifest["root_hash"] or peer_manifest["chunk_size"] != manifest["chunk_size"]:
+        print(f"Peer {peer} has a different version of {file_id}, ignoring it")
+        close_stream(stream, reusable=False)
+        return
+    with swarm["lock"]:
+        banned = peer in swarm["banned"]
+        if not banned:
+            add_peer(swarm, peer, peer_bitfield(peer_manifest, swarm["total_chunks"]))
+    if banned:
+        close_stream(stream, reusable=False)
+        return
+    print(f"Peer {peer} joined the download of {file_id}")
+    download_from_peer(swarm, manifest, peer, stream, writer, peer_manifest["block_size"])
 
-def ack_receive_chunk(chunk_index):
+def swarm_download(peers, file_id, save_path, new_peers=None, streaming=False):
     """
-    Sends an acknowledgment back to the server to confirm that a chunk has been received.
+    Downloads file_id from every reachable peer in parallel into save_path.
+    A shared piece scheduler hands out pieces rarest first and moves them away from stalled peers.
+    When streaming, the start of the file is fetched first and readers move that window as they play and seek.
+    Pieces already saved by an interrupted download of the same file are not requested again.
+    Verified pieces are shared with other leechers through the upload listener while the download runs,
+    and peers put on the new_peers queue meanwhile join the download.
+    Returns True when every piece was downloaded and verified.
+    """
+    transfers = {}
+    not_sharing = []  # Leechers that started with us, asked again once the download runs
+    for peer in peers:
+        opened = open_peer_transfer(peer, file_id)
+        if opened is NOT_SHARING:
+            not_sharing.append(peer)
+        elif opened is not None:
+            transfers[peer] = opened
+            print(f"Connected to Peer {peer} with the {file_id}")  # Messages 1 and 2 inside
+    if not transfers:
+        print(f"No peer could provide {file_id}")
+        return False
+    manifest = next(iter(transfers.values()))[1]
+    file_size = manifest["file_size"]
+    total_chunks = len(manifest["digests"])
+    have = load_resume_state(save_path, manifest)
+    swarm = create_swarm(total_chunks, have)
+    if streaming:
+        with swarm["lock"]:
+            set_cursor(swarm, 0)  # Playback can start after the first pieces
+    if have is not None:
+        print(f"Resuming {file_id}: {total_chunks - swarm['remaining']} of {total_chunks} pieces already downloaded")
+    for peer, (stream, peer_manifest) in list(transfers.items()):
+        if peer_manifest["root_hash"] != manifest["root_hash"] or peer_manifest["chunk_size"] != manifest["chunk_size"]:
+            print(f"Peer {peer} has a different version of {file_id}, ignoring it")
+            close_stream(stream, reusable=False)
+            del transfers[peer]
+            continue
+        add_peer(swarm, peer, peer_bitfield(peer_manifest, total_chunks))
+
+    print(f"Download of {file_id} begins from {len(transfers)} peer(s)\n")
+    with open_download_file(save_path, file_size) as file:
+        sharing[file_id] = {"manifest": manifest, "swarm": swarm, "save_path": save_path}  # Serve verified pieces from now on
+        writer = create_writer(file, swarm, manifest["chunk_size"])  # Writes verified pieces behind the receiving threads
+        workers = [threading.Thread(target=download_from_peer, args=(swarm, manifest, peer, stream, writer, peer_manifest["block_size"]), daemon=True)
+                   for peer, (stream, peer_manifest) in transfers.items()]
+        for peer in not_sharing:
+            transfers[peer] = None
+            workers.append(threading.Thread(target=join_download, args=(swarm, manifest, peer, file_id, writer), daemon=True))
+        for worker in workers:
+            worker.start()
+        saved = None  # Bitfield last written to disk
+        try:
+            while any(worker.is_alive() for worker in workers):
+                next(worker for worker in workers if worker.is_alive()).join(RESUME_FLUSH_SECONDS)
+                while new_peers is not None and not new_peers.empty():
+                    peer = new_peers.get()
+                    if peer not in transfers:
+                        transfers[peer] = None
+                        worker = threading.Thread(target=join_download, args=(swarm, manifest, peer, file_id, writer), daemon=True)
+                        worker.start()
+                        workers.append(worker)
+                with swarm["lock"]:
+                    have = bytes(swarm["have"])
+                    set_gauge("download.peers", len(swarm["peers"]))
+                if have != saved:
+                    save_resume_state(save_path, manifest, file, have)  # Periodically record progress
+                    saved = have
+        finally:
+            close_writer(writer)  # Every queued piece is on disk before the final bitfield is saved
+            with swarm["lock"]:
+                have = bytes(swarm["have"])
+                swarm["stopped"] = True
+                swarm["lock"].notify_all()  # Readers waiting for missing pieces give up
+            save_resume_state(save_path, manifest, file, have)
+        if swarm["remaining"] == 0:
+            resume_path(save_path).unlink()  # Nothing left to resume
+
+    if swarm["remaining"]:
+        print(f"\nDownload of {file_id} incomplete: {swarm['remaining']} of {total_chunks} pieces missing\n")
+        return False
+    mark_time("download.completed_seconds")
+    print(f"\nFile downloaded successfully: {save_path}\n")  # Notify that the file has been successfully downloaded
+    return True
+
+def find_shared_file(file_id):
+    """Return (manifest, file path, swarm) of a file we share, or None."""
+    shared = sharing.get(file_id)
+    if shared is None:
+        return None
+    return shared["manifest"], shared["save_path"], shared["swarm"]
+
+def serve_leecher(TCP_connection_socket, address):
+    """Run the CONNECT handshake with another leecher and serve the files it asks for that we share."""
+    with active_uploads_lock:
+        active_uploads.add(address)
+        set_gauge("upload.active_connections", len(active_uploads))
+    count("upload.connections")
+    upload = create_upload(address)
+    try:
+        if recv_message(TCP_connection_socket).get("message_type") == "CONNECT":
+            send_message(TCP_connection_socket, {"message_type": "ACK", "type_of_peer": announce["peer_type"]})
+            serve_session(TCP_connection_socket, find_shared_file, upload)
+            print(f"Uploaded {upload['bytes_sent']} bytes to {address}")
+    except (OSError, ValueError) as error:
+        print(f"Upload to {address} stopped: {error}")
+    finally:
+        with active_uploads_lock:
+            active_uploads.discard(address)
+            set_gauge("upload.active_connections", len(active_uploads))
+        remove_upload(upload)
+
+def start_upload_listener():
+    """Listen for other leechers on P2P_SERVER_PORT in the background; returns the port actually bound."""
+    TCP_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    TCP_server_socket.bind(("", P2P_SERVER_PORT))
+    TCP_server_socket.listen(MAX_NUMBER_OF_CLIENTS_IN_QUEUE)
+    threading.Thread(target=serve_leechers, args=(TCP_server_socket, serve_leecher, MAX_CONCURRENT_UPLOADS), daemon=True).start()
+    return TCP_server_socket.getsockname()[1]
+
+def ack_receive_chunk(stream, chunk_index):
+    """
+    Sends a cumulative acknowledgment confirming every chunk up to chunk_index has been received.
     """
     msg = {
         "message_type": "ACK",  # Type of message: Acknowledgment
         "peer_id": local_ip,  # The IP address of the client
-        "received_chunk": chunk_index  # The index of the chunk that was received
+        "received_chunk": chunk_index,  # The index of the chunk that was received
+        "uploaded": read_counter("upload.bytes")  # Bytes we have uploaded to other leechers so far
     }
-    TCP_client_socket.send((json.dumps(msg)+ '\n').encode())  # Send the acknowledgment as a JSON-encoded message
+    stream_send(stream, msg)  # Send the acknowledgment as a framed JSON message
 
-def progression():
+def progression(TCP_client_socket):
     """
     Sends the progress of the download to the server.
     """
     now = datetime.datetime.now().strftime('%H:%M')  # Get the current time
     msg = {"message_type": "PROGRESSION", "time_stamp": now}  # Create a progress message with the timestamp
-    TCP_client_socket.send(json.dumps(msg).encode())  # Send the progress message to the server
+    send_message(TCP_client_socket, msg)  # Send the progress message to the server
 
 def send_avaiable(peer_type):
     """Send an acknowledgment message."""
@@ -105,24 +688,33 @@ def send_avaiable(peer_type):
         "time_stamp": now,  # Type of the message that is being acknowledged
         "type_of_peer" : peer_type
     }
-    print("Sending ping to Tracker")
     UDP_socket.sendto(json.dumps(msg).encode(), server_address)
 
-def request_chunk(chunk_index):
+def request_chunk(stream, chunk_index, block_index=0, block_count=1):
     """
-    Sends a request for a specific chunk of the file to the server.
+    Sends a request for block_count blocks of a piece, starting at block_index, to the server.
     """
     now = datetime.datetime.now().strftime('%H:%M')  # Get the current time
     msg = {"message_type": "REQUEST", 
            "time_stamp": now, 
-           "chunk_index": chunk_index}  # Request message with chunk index
-    TCP_client_socket.send(json.dumps(msg).encode())  # Send the chunk request to the server
+           "chunk_index": chunk_index,  # Request message with chunk index
+           "block_index": block_index,
+           "block_count": block_count}
+    stream_send(stream, msg)  # Send the chunk request to the server
 
-def connect_to_TCP(seeder):
+def cancel_chunk(stream, chunk_index):
     """
-    Establishes a TCP connection to another peer (seeder).
+    Tells the server to drop the requests for a piece another peer delivered first.
     """
-    TCP_client_socket.connect((seeder, TCP_SERVER_PORT))  # Connect to the seeder peer
+    msg = {"message_type": "CANCEL", "chunk_index": chunk_index}
+    stream_send(stream, msg)  # Send the cancellation to the server
+
+def connect_to_TCP(seeder, tcp_port=TCP_SERVER_PORT):
+    """
+    Establishes a new TCP connection to another peer (seeder) and returns it, or None if it is refused.
+    """
+    TCP_client_socket = socket.create_connection((seeder, tcp_port), WAITING_TIME_SECONDS)  # Connect to the seeder peer
+    TCP_client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Send small request frames immediately
     now = datetime.datetime.now().strftime('%H:%M')
     msg = {
         "message_type": "CONNECT",  # Type of message: Connect
@@ -130,11 +722,12 @@ def connect_to_TCP(seeder):
         "time_stamp": now,  # Current timestamp
         "type_of_peer": "L"  # Peer type: L (Leecher)
     }
-    TCP_client_socket.send(json.dumps(msg).encode())  # Send the connection request to the peer
-    response = TCP_client_socket.recv(1024).decode()  # Expecting ACK or further message 2
-    if "ACK" in response:
-        return response  # Return the active connection
+    send_message(TCP_client_socket, msg)  # Send the connection request to the peer
+    response = recv_message(TCP_client_socket)  # Expecting ACK or further message 2
+    if response["message_type"] == "ACK":
+        return TCP_client_socket  # Return the active connection
     else:
+        print(f"Peer refused the connection: {response.get('error_message')}")
         TCP_client_socket.close()
         return None
 
@@ -146,9 +739,10 @@ def create_folder(client_name):
     folder.mkdir(exist_ok=True)  # Create the folder if it doesn't exist
     return folder  # Return the folder path as a string
 
-def connect_to_tracker(client_name, file_id,peer_id):
+def connect_to_tracker(client_name, file_id, peer_id, tcp_port):
     """
     Sends a message to the tracker server to find peers for file sharing.
+    tcp_port is where other leechers can download the pieces we have.
     """
     now = datetime.datetime.now().strftime('%H:%M')  # Get the current time
     msg = {
@@ -157,77 +751,125 @@ def connect_to_tracker(client_name, file_id,peer_id):
         "type_of_peer": peer_id,  # Peer type: L (Leecher)
         "time_stamp": now,  # Current timestamp
         "file_id": file_id,  # ID of the file to be downloaded
-        "client_name": client_name  # Name of the client
+        "client_name": client_name,  # Name of the client
+        "tcp_port": tcp_port  # Port of our upload listener
     }
     UDP_socket.sendto(json.dumps(msg).encode(), server_address)  # Send the discovery message to the tracker server
 
-def main():
+def match_address(match):
+    """
+    Return the (ip, tcp_port) to download from for a MATCH_FOUND message, or None for a peer that does not upload.
+    Content servers without a tcp_port listen on the default TCP_SERVER_PORT.
+    """
+    tcp_port = match.get("tcp_port") or (TCP_SERVER_PORT if match["id"] == "CS" else None)
+    return None if tcp_port is None else (match["ip"], tcp_port)
+
+def handle_tracker_message(message, peer_type):
+    """Answer PING and ANNOUNCE_OK; returns the address of a matched peer for MATCH_FOUND, otherwise None."""
+    if message["message_type"] == "PING":
+        send_avaiable(peer_type)  # The tracker has not heard from us for a while
+    elif message["message_type"] == "ANNOUNCE_OK":
+        announce["interval"] = message["interval"]
+    elif message["message_type"] == "MATCH_FOUND":
+        return match_address(message)
+    return None
+
+def gather_seeders(first_match, peer_type):
+    """
+    Collects the peers the tracker matches within MATCH_GATHER_SECONDS of the first MATCH_FOUND.
+    Returns a list of (ip, tcp_port) pairs.
+    """
+    seeders = [match_address(first_match)]
+    deadline = time.monotonic() + MATCH_GATHER_SECONDS
+    while (remaining := deadline - time.monotonic()) > 0:
+        UDP_socket.settimeout(remaining)
+        try:
+            message_from_UDP_server, _ = UDP_socket.recvfrom(2048)
+        except socket.timeout:
+            break
+        seeder = handle_tracker_message(json.loads(message_from_UDP_server.decode()), peer_type)
+        if seeder is not None and seeder not in seeders:
+            seeders.append(seeder)
+    UDP_socket.settimeout(WAITING_TIME_SECONDS)
+    return seeders
+
+def forward_matches(new_peers, downloading, peer_type):
+    """Keep answering the tracker while a download runs and hand newly matched peers to it."""
+    UDP_socket.settimeout(RESUME_FLUSH_SECONDS)
+    while downloading.is_set():
+        try:
+            message_from_UDP_server, _ = UDP_socket.recvfrom(2048)
+        except socket.timeout:
+            continue
+        peer = handle_tracker_message(json.loads(message_from_UDP_server.decode()), peer_type)
+        if peer is not None:
+            new_peers.put(peer)
+    UDP_socket.settimeout(WAITING_TIME_SECONDS)
+
+def ask(prompt, answers):
+    """Return the next answer given on the command line, or prompt the user for it."""
+    return answers.pop(0) if answers else input(prompt)
+
+def main(answers=None):
     """
     The main function to run the client program, handling the peer-to-peer file sharing process.
+    answers replaces the prompts in order (client name, file ID, whether to seed) to run without a user.
     """
     global SAVE_PATH
     UDP_socket.settimeout(WAITING_TIME_SECONDS)
+    answers = list(answers or [])
 
-    client_name = input("Please enter your client name: \n")  # Prompt user for the client name
-    file_id = input("Please enter the file ID to download: \n")  # Prompt user for the file ID to download
+    client_name = ask("Please enter your client name: \n", answers)  # Prompt user for the client name
+    file_id = ask("Please enter the file ID to download: \n", answers)  # Prompt user for the file ID to download
     
     SAVE_PATH = create_folder(client_name) / file_id
     peer_type = "L"
+    upload_port = start_upload_listener()  # Other leechers download the pieces we already have from here
+    announce["upload_port"] = upload_port
+    stats_path = f"{client_name}{STATS_SUFFIX}"
+    start_stats_dump(stats_path)  # Download and upload counters for this client
+    start_upload_shaping(f"{client_name}{LIMITS_SUFFIX}")  # Upload limits can be changed in this file while we run
+    if STREAM_PORT is not None:
+        stream_port = start_stream_server(find_shared_file, STREAM_PORT)
+        print(f"Play {file_id} while it downloads from http://127.0.0.1:{stream_port}/{quote(file_id)}")
 
     try:
-        connect_to_tracker(client_name, file_id,peer_type)
+        connect_to_tracker(client_name, file_id, peer_type, upload_port)
         print("Connection to Tracker established.")
+        # Re-announce on our own schedule, also while a download keeps this thread busy
+        threading.Thread(target=announce_periodically, args=(announce, lambda: send_avaiable(announce["peer_type"])), daemon=True).start()
         while True:  # Keep trying to find a peer
             try:
                 message_from_UDP_server, UDP_server_address = UDP_socket.recvfrom(2048)  # Wait for a response from the server
                 partner_peer_information = json.loads(message_from_UDP_server.decode())  # Parse the response
-                message_type = partner_peer_information["message_type"]
-                
-                if message_type == "PING":
-                    send_avaiable(peer_type)
-                    continue
-                elif message_type == "MATCH_FOUND":
-                    if partner_peer_information["id"] == "CS":
-                        # If the peer is a seeder (CS), connect to it and start the file download process
-                        response = json.loads(connect_to_TCP(partner_peer_information["ip"]))
-                        print(f"Connected to Peer with the {file_id}")# Messages 1 and 2 inside
-                        if response["message_type"] == "ACK":
-                            response = request_file(file_id)
-                        
-                        if response["message_type"] == "BEGIN":
-                            print(f"Download of {file_id} begins\n")
-                            reconfigure()  # Start downloading the file in chunks
-                            print("Disconnected from peer.\n")
-                            decision = input("Do you wish to be a seeder (Yes) or (No):\n")
-                            if decision[0].upper() == "Y":
-                                peer_type = "S"
-                                
-                                UDP_socket.close()
-                                
-                                create_seeder()
-                                
-                                connect_to_tracker(client_name, file_id,peer_type)
-                            else:
-                                print("Thank you for downloading on our server")
-
-                elif partner_peer_information["id"] == "S":
-                    # If the peer is a server (S), establish a P2P connection
-                    TCP_client_socket.connect((partner_peer_information["ip"], P2P_SERVER_PORT))
-                    TCP_client_socket.send("Hi fellow peer, I want a file.".encode())
-                    TCP_client_socket.recv(1024).decode()
-
-                elif partner_peer_information["id"] == "L":
-                    # If the peer is another leecher (L), act as a server and share the file
-                    TCP_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    TCP_server_socket.bind(("", P2P_SERVER_PORT))
-                    TCP_server_socket.listen(MAX_NUMBER_OF_CLIENTS_IN_QUEUE)
-
-                    while True:
-                        TCP_connection_socket, _ = TCP_server_socket.accept()  # Accept incoming connection
-                        TCP_connection_socket.recv(1024).decode()
-                        TCP_connection_socket.send("Here is the file that you asked for".encode())  # Send file data
-                        TCP_connection_socket.close()  # Close the connection after sending
-                        TCP_server_socket.close()  # Close the server socket
+                peer = handle_tracker_message(partner_peer_information, peer_type)
+                if peer is None or peer_type != "L":
+                    continue  # Seeders wait for leechers to connect to the upload listener
+
+                # Wait briefly for other matches and download from all of them; later matches join while it runs
+                seeders = gather_seeders(partner_peer_information, peer_type)
+                new_peers = queue.Queue()
+                downloading = threading.Event()
+                downloading.set()
+                matches = threading.Thread(target=forward_matches, args=(new_peers, downloading, peer_type), daemon=True)
+                matches.start()
+                try:
+                    downloaded = swarm_download(seeders, file_id, SAVE_PATH, new_peers, STREAM_PORT is not None)
+                finally:
+                    downloading.clear()
+                    matches.join()
+                    close_sessions()  # No transfer is left to reuse them, free the upload slots they hold on our peers
+                if downloaded:
+                    print("Disconnected from peer.\n")
+                    decision = ask("Do you wish to be a seeder (Yes) or (No):\n", answers)
+                    if decision[:1].upper() == "Y":
+                        peer_type = "S"
+                        announce["peer_type"] = peer_type
+                        connect_to_tracker(client_name, file_id, peer_type, upload_port)  # Keep serving from the upload listener
+                    else:
+                        sharing.pop(file_id, None)
+                        print("Thank you for downloading on our server")
+                        break
 
             except socket.timeout:
                 continue  # If timeout occurs, keep trying
@@ -236,6 +878,13 @@ def main():
         print("\nProgram interrupted. Closing connections and cleaning up.")
         UDP_socket.close()  # Close the UDP socket when the program is interrupted
         TCP_client_socket.close()  # Close the TCP client socket
+    finally:
+        write_stats(stats_path)  # Final counters of the whole run
 
 if __name__ == "__main__":
-    main()  # Run the main function when the script is executed
+    if len(sys.argv) > 4:
+        server_address = (server_name, int(sys.argv[4]))  # Use another tracker port
+    if len(sys.argv) > 5:
+        STREAM_PORT = int(sys.argv[5])  # Stream the download to media players on this port
+    # Run without prompts with: python TCP_Client.py <client name> <file ID> <Yes|No> [tracker port] [stream port]
+    main(sys.argv[1:4])  # Run the main function when the script is executed
@@ -1,32 +1,48 @@
 import socket  # Library for network communication (TCP/UDP)
 import time  # Library for time-related functions
 import json  # Library for handling JSON encoding/decoding
-import os  # Library for interacting with the operating system, like file manipulation
 import datetime  # Library for handling date and time
-from pathlib import Path  # For handling file paths
-import hashlib
+import sys  # Library for reading the TCP port from the command line
+import threading  # Library for serving several leechers at once
+from Peer_Protocol import send_message, recv_message
+from Peer_Session import serve_session, serve_leechers
+import Piece_Manifest
+from Piece_Hashing import HASH_ALGORITHMS
+from Piece_Manifest import get_manifest
+from File_Catalog import CATALOG_RESCAN_SECONDS, create_catalog, refresh_catalog, hash_files
+from Tracker_Announce import announce_periodically
+from Upload_Shaping import LIMITS_SUFFIX, create_upload, remove_upload, start_upload_shaping
+from Transfer_Metrics import STATS_SUFFIX, count, set_gauge, start_stats_dump, write_stats
 # Define server configuration variables
 server_name = "localhost"  # Server IP address or hostname
 MAX_NUMBER_OF_CLIENTS_IN_QUEUE = 15  # Max number of clients allowed to wait in the queue
 UDP_SERVER_PORT = 12000  # Port for the UDP server
 TCP_SERVER_PORT = 12500  # Port for the TCP server
 WAITING_TIME_SECONDS = 5  # Timeout for waiting for connections in seconds
+MAX_CONCURRENT_UPLOADS = 8  # Max number of leechers served at the same time
+MAX_ANNOUNCE_BYTES = 1200  # File lists are split so every announce datagram fits in one unfragmented packet
+ANNOUNCE_BATCH_GAP_SECONDS = 0.001  # Pause between announce datagrams so the tracker's receive buffer keeps up
+SERVER_FOLDER = "Server"  # Directory tree whose files are served
+ANNOUNCED_TCP_PORT = None  # Port announced to the tracker when leechers reach us through a proxy (None = TCP_SERVER_PORT)
 server_address = (server_name, UDP_SERVER_PORT)  # UDP server address tuple
 
 # Initialize TCP and UDP sockets
 TCP_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # TCP socket for file transfer
 UDP_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP socket for discovery
 
-CHUNK_SIZE = 4096  # Size of file chunks to be sent over TCP
+CHUNK_SIZE = None  # Piece size of served files (None picks one from each file's size), see Peer_Session for how they are sent
 local_ip = "localhost"  # Local IP, modify if needed
 
 # Enable address reuse for the TCP socket
 TCP_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-def compute_chunk_checksum(chunk):
-    """Generate SHA-256 checksum for a single chunk."""
-    return hashlib.sha256(chunk).hexdigest()
 
-def send_file_transfer(file):
+active_uploads = {}  # Per-connection upload state keyed by the leecher address
+active_uploads_lock = threading.Lock()  # Protects active_uploads
+announce_lock = threading.Lock()  # Keeps file list announces from different threads from interleaving
+announce = {"interval": WAITING_TIME_SECONDS}  # Re-announce interval, replaced by the one the tracker sends
+catalog = create_catalog(SERVER_FOLDER, CHUNK_SIZE)  # Files served from SERVER_FOLDER, filled in by main()
+
+def send_file_transfer(TCP_connection_socket, file):
     """Send a file transfer initiation message."""
     now = datetime.datetime.now().strftime('%H:%M')  # Get current time
     msg = {
@@ -34,127 +50,142 @@ def send_file_transfer(file):
         "file_id": file,  # File ID to be transferred
         "time_stamp": now  # Current timestamp
     }
-    TCP_connection_socket.send(json.dumps(msg).encode())  # Send the message as JSON over TCP
+    send_message(TCP_connection_socket, msg)  # Send the message as a framed JSON message over TCP
+
+def batch_file_names(names):
+    """Split file names into lists that each fit in one announce datagram."""
+    budget = MAX_ANNOUNCE_BYTES - 200  # Room for the rest of the message
+    batch, batch_bytes = [], 0
+    for name in names:
+        name_bytes = len(json.dumps(name).encode()) + 2  # Quotes are included, plus ", "
+        if batch and batch_bytes + name_bytes > budget:
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(name)
+        batch_bytes += name_bytes
+    if batch:
+        yield batch
 
 def connect_to_tracker(files):
-    """Send a peer discovery message to the tracker server."""
-    now = datetime.datetime.now().strftime('%H:%M')  # Get current time
-    msg = {
-        "message_type": "DISCOVER_PEER",  # Type of message (peer discovery)
-        "type_of_peer": "CS",  # Peer type (CS = Seeder)
-        "peer_id": local_ip,  # Local IP of the server
-        "file_id": files,  # List of files available for transfer
-        "time_stamp": now  # Current timestamp
-    }
-    UDP_socket.sendto(json.dumps(msg).encode(), server_address)  # Send the message as JSON over UDP
-
-def send_ack(message_type):
+    """
+    Send a peer discovery message to the tracker server.
+    Only the first batch of files goes in DISCOVER_PEER, the rest follow as ANNOUNCE_FILES datagrams.
+    """
+    with announce_lock:
+        batches = list(batch_file_names(sorted(files))) or [[]]
+        now = datetime.datetime.now().strftime('%H:%M')  # Get current time
+        msg = {
+            "message_type": "DISCOVER_PEER",  # Type of message (peer discovery)
+            "type_of_peer": "CS",  # Peer type (CS = Seeder)
+            "peer_id": local_ip,  # Local IP of the server
+            "file_id": batches[0],  # First batch of the files available for transfer
+            "tcp_port": ANNOUNCED_TCP_PORT or TCP_SERVER_PORT,  # Port leechers connect to
+            "time_stamp": now  # Current timestamp
+        }
+        UDP_socket.sendto(json.dumps(msg).encode(), server_address)  # Send the message as JSON over UDP
+        for batch in batches[1:]:
+            send_file_changes(batch, [])
+
+def send_file_changes(added, removed):
+    """Tell the tracker which files were added to or removed from the catalog."""
+    for key, names in [("added", added), ("removed", removed)]:
+        for batch in batch_file_names(names):
+            time.sleep(ANNOUNCE_BATCH_GAP_SECONDS)
+            msg = {"message_type": "ANNOUNCE_FILES", "added": [], "removed": [], key: batch}
+            UDP_socket.sendto(json.dumps(msg).encode(), server_address)
+
+def send_ack(TCP_connection_socket, message_type):
     """Send an acknowledgment message."""
     msg = {
         "message_type": "ACK",  # Type of message (Acknowledgment)
         "requested_message_type": message_type  # Type of the message that is being acknowledged
     }
-    TCP_connection_socket.send(json.dumps(msg).encode())  # Send the acknowledgment over TCP
-
-def send_begin_download():
-    """Send an acknowledgment message.""" 
-    now = datetime.datetime.now().strftime('%H:%M')
-    msg = {
-        "message_type": "BEGIN",  # Type of message (Acknowledgment)
-        "time_stamp": now  # Type of the message that is being acknowledged
-    }
-    TCP_connection_socket.send(json.dumps(msg).encode())  # Send the acknowledgment over TCP
+    send_message(TCP_connection_socket, msg)  # Send the acknowledgment over TCP
 
 def send_avaiable():
     """Send an acknowledgment message.""" 
     now = datetime.datetime.now().strftime('%H:%M') 
-    msg = {
-        "message_type": "AVAILABLE",  # Type of message (Acknowledgment)
-        "time_stamp": now,  # Type of the message that is being acknowledged
-        "type_of_peer": "CS"
-    }
-    UDP_socket.sendto(json.dumps(msg).encode(), server_address)
-
-def send_error_404():
-    """Send an error message for file not found.""" 
-    msg = {
-        "message_type": "ERROR",  # Type of message (Error)
-        "error_code": 404,  # Error code for file not found
-        "error_message": "File Not Found"  # Error message
-    }
-    TCP_connection_socket.send(json.dumps(msg).encode())  # Send the error message over TCP
-
-def download(file_path):
-    """Handles file chunk requests and sends the file to the client in chunks.""" 
-    print(f"Preparing to download the file: {file_path}")
-    file_size = os.path.getsize(file_path)  # Get the size of the file
-    TCP_connection_socket.sendall(str(file_size).encode())  # Send file size first to the client message 5
-    print(f"Sent file size of {file_size} bytes to client.")
-    total_chunks = TCP_connection_socket.recv(1024)  # Wait for acknowledgment from client and recieve the total chunks
-    print("Waiting for acknowledgment from client...")
-
-    # Open the file and send it in chunks
-    with open(file_path, "rb") as file:
-        split = []
-        while True:
-            if len(split) > 1 and split[1] != '':
-                request_id = json.loads(split[1])
-            else:
-                request_id = json.loads(TCP_connection_socket.recv(1024).decode())  # Receive chunk index request from client message 7
-            if not request_id:
-                break  # If no request or invalid request, break the loop
-            if request_id == "ACK":
-                continue
-            chunk_index = request_id["chunk_index"]  # Get the requested chunk index
-            file.seek(chunk_index * CHUNK_SIZE)  # Seek to the correct position in the file
-            chunk_data = file.read(CHUNK_SIZE)  # Read the chunk data
-            # Compute checksum for the chunk
-            chunk_checksum = compute_chunk_checksum(chunk_data)
-
-            # Send chunk + checksum to alllow it to send confirmation
-            chunk_packet = {
-                "chunk_index": chunk_index,
-                "data": chunk_data.hex(),  # Convert binary to hex for JSON transmission
-                "checksum": chunk_checksum
-            }            
-            print(f"Sending chunk {chunk_index} to client.")
-            
-            TCP_connection_socket.send(json.dumps(chunk_packet).encode())  # Send the chunk data to the client message 8
-            ack = TCP_connection_socket.recv(1024).decode()
-            split = ack.split('\n')
-            ack = json.loads(split[0])
-            
-            ack = ack["message_type"]  # Wait for acknowledgment from client message 9
-            
-            
-            while ack != "ACK":  # If acknowledgment is not received, retransmit the chunk
-                print("Data corrupt resending")
-                TCP_connection_socket.sendall(json.dumps(chunk_packet.encode()))  # Resend the chunk
-                ack = TCP_connection_socket.recv(1024).decode()  # Wait for acknowledgment
-                print(f"Resending chunk {chunk_index} to client.")
-
-            print(f"Chunk {chunk_index} successfully acknowledged.")
-            if chunk_index + 1 == total_chunks:  # This is the last chunk
-                print("All chunks sent successfully. Closing connection.")
-                TCP_connection_socket.close()
-                break
-
-    print("File transfer complete.")  # Print when the file transfer is complete
+    with announce_lock:  # Never between a catalog change and its announce, or the count would not match
+        msg = {
+            "message_type": "AVAILABLE",  # Type of message (Acknowledgment)
+            "time_stamp": now,  # Type of the message that is being acknowledged
+            "type_of_peer": "CS",
+            "total_files": len(catalog["files"])  # Lets the tracker notice announces it missed
+        }
+        UDP_socket.sendto(json.dumps(msg).encode(), server_address)
+
+def watch_catalog():
+    """Rescan the served tree every CATALOG_RESCAN_SECONDS and announce what changed."""
+    while True:
+        time.sleep(CATALOG_RESCAN_SECONDS)
+        with announce_lock:
+            added, removed = refresh_catalog(catalog)
+            send_file_changes(added, removed)
+        if added or removed:
+            print(f"Catalog changed: {len(added)} file(s) added, {len(removed)} removed.")
+
+def find_served_file(files, path, file):
+    """Return (manifest, file path, None) for a file this seeder serves, or None."""
+    if file not in files or not (path / file).exists():
+        return None
+    try:
+        return get_manifest(path / file, CHUNK_SIZE), path / file, None  # Piece hashes computed once and cached next to the file
+    except OSError:
+        return None  # Removed while it was being hashed
+
+def handle_leecher(TCP_connection_socket, files, path, upload):
+    """Run the CONNECT handshake with a leecher and serve the files it requests until it disconnects."""
+    message_from_TCP_server = recv_message(TCP_connection_socket)
+    if message_from_TCP_server.get("message_type") == "CONNECT":
+        msg = {"message_type": "ACK", "type_of_peer": "L"}
+        send_message(TCP_connection_socket, msg)
+        print("Acknowledged client request.")
+        serve_session(TCP_connection_socket, lambda file: find_served_file(files, path, file), upload)
+        print("Session with client complete.")
+
+def serve_connection(TCP_connection_socket, address, files, path):
+    """Serve one leecher on an upload worker, keeping its state in active_uploads."""
+    upload = create_upload(address)
+    with active_uploads_lock:
+        active_uploads[address] = upload
+        set_gauge("upload.active_connections", len(active_uploads))
+    count("upload.connections")
+    try:
+        handle_leecher(TCP_connection_socket, files, path, upload)
+    except (ConnectionError, ValueError, socket.timeout) as error:
+        print(f"Connection with client {address} lost: {error}")
+    finally:
+        with active_uploads_lock:
+            del active_uploads[address]
+            set_gauge("upload.active_connections", len(active_uploads))
+        remove_upload(upload)
+
+def serve_files(listening_socket, files, path):
+    """Accept leechers forever and serve the files under path to up to MAX_CONCURRENT_UPLOADS of them concurrently."""
+    serve_leechers(listening_socket, lambda TCP_connection_socket, address: serve_connection(TCP_connection_socket, address, files, path), MAX_CONCURRENT_UPLOADS)
 
 def main():
-    global TCP_connection_socket
     """Main server function that listens for incoming client requests.""" 
     TCP_socket.bind(("127.0.0.1", TCP_SERVER_PORT))  # Bind explicitly to localhost
     TCP_socket.listen(MAX_NUMBER_OF_CLIENTS_IN_QUEUE)
-    TCP_socket.settimeout(WAITING_TIME_SECONDS)
     UDP_socket.settimeout(WAITING_TIME_SECONDS)
     
-    files = ["Tester.pdf","Billie_Eilish_-_lovely_(with_Khalid).mp3"]  # List of files available for transfer
-    path = Path("Server")  # Path to the server directory containing files
+    refresh_catalog(catalog)  # Only stats the files, their pieces are hashed in the background
+    files = catalog["files"]  # Updated in place by every rescan
+    path = catalog["root"]
+    print(f"Serving {len(files)} file(s) from {path}.")
+    threading.Thread(target=hash_files, args=(catalog,), daemon=True).start()
+    stats_path = f"seeder_{TCP_SERVER_PORT}{STATS_SUFFIX}"
+    start_stats_dump(stats_path)  # Upload counters and rates for this seeder
+    start_upload_shaping(f"seeder_{TCP_SERVER_PORT}{LIMITS_SUFFIX}")  # Rate limits can be changed in this file while we run
+    # Leechers are accepted and served in the background while this thread talks to the tracker
+    threading.Thread(target=serve_files, args=(TCP_socket, files, path), daemon=True).start()
 
     try:
         connect_to_tracker(files)
         print("Connection to Tracker established.")
+        threading.Thread(target=announce_periodically, args=(announce, send_avaiable), daemon=True).start()
+        threading.Thread(target=watch_catalog, daemon=True).start()
         while True:
             try:
                 message_from_UDP_server, _ = UDP_socket.recvfrom(1024)
@@ -162,38 +193,35 @@ def main():
                 message_type = Tracker_information.get("message_type")
 
                 if message_type == "PING":
-                    print("Received PING from tracker. Sending availability status.")
-                    send_avaiable()
-                    continue
+                    send_avaiable()  # The tracker has not heard from us for a while
+                elif message_type == "ANNOUNCE_OK":
+                    announce["interval"] = Tracker_information["interval"]
+                elif message_type == "RESYNC":
+                    connect_to_tracker(files)  # The tracker lost some of our announces, send the whole list again
                 elif message_type == "MATCH_FOUND":
-                    print("MATCH FOUND. Establishing connection with client...")
-                    TCP_connection_socket, _ = TCP_socket.accept()
-                    TCP_connection_socket.settimeout(10)
-                    
-                    message_from_TCP_server = TCP_connection_socket.recv(1024).decode()
-                    if message_from_TCP_server:
-                        msg = {"message_type": "ACK", "type_of_peer": "L"}
-                        TCP_connection_socket.send(json.dumps(msg).encode())
-                        print("Acknowledged client request.")
-                        leecher_info = json.loads(TCP_connection_socket.recv(1024).decode())
-                        if leecher_info.get("message_type") == "REQUEST_FILE":
-                            msg = {"message_type": "BEGIN"}
-                            TCP_connection_socket.send(json.dumps(msg).encode())                            
-                            file = leecher_info.get("requested_file")
-                            if file in files:
-                                download(path / file)
-                            else:
-                                print(f"File '{file}' not found. Sending ERROR 404.")
-                                send_error_404()
-                    TCP_connection_socket.close()
-                send_avaiable()
+                    print(f"MATCH FOUND. Leechers being served: {len(active_uploads)}")
             except socket.timeout:
                 continue
     except KeyboardInterrupt:
         print("Keyboard interrupt received. Closing sockets and exiting.")
+        write_stats(stats_path)  # Final counters of the whole run
         UDP_socket.close()
         exit()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        TCP_SERVER_PORT = int(sys.argv[1])  # Run several seeders on one host with: python TCP_Server.py <port>
+    if len(sys.argv) > 2:
+        catalog = create_catalog(sys.argv[2], CHUNK_SIZE)  # Serve another tree with: python TCP_Server.py <port> <folder>
+    if len(sys.argv) > 3:
+        UDP_SERVER_PORT = int(sys.argv[3])  # Use another tracker with: python TCP_Server.py <port> <folder> <tracker port>
+        server_address = (server_name, UDP_SERVER_PORT)
+    if len(sys.argv) > 4:
+        ANNOUNCED_TCP_PORT = int(sys.argv[4])  # Leechers connect to this port instead, e.g. a network simulator in front of us
+    if len(sys.argv) > 5:
+        if sys.argv[5] not in HASH_ALGORITHMS:
+            print(f"Unknown hash algorithm {sys.argv[5]}, choose one of: {', '.join(HASH_ALGORITHMS)}")
+            sys.exit(1)
+        Piece_Manifest.HASH_ALGORITHM = sys.argv[5]  # Hash pieces with e.g. blake2b, or crc32 on a trusted LAN
     print("Server starting...")
     main()
@@ -0,0 +1,16 @@
+import random  # Library for jittering announce times
+import time  # Library for waiting between announces
+
+# Seeders and leechers re-announce themselves to the tracker on their own schedule instead of waiting to be
+# pinged, at the interval the tracker sends back, so a tracker with many peers does not have to ping them all.
+ANNOUNCE_JITTER = 0.25  # Announce times vary by up to this fraction of the interval so peers do not announce in step
+
+
+def announce_periodically(announce, send_available):
+    """Call send_available() every announce["interval"] seconds, jittered, forever; run on a background thread."""
+    while True:
+        time.sleep(announce["interval"] * random.uniform(1 - ANNOUNCE_JITTER, 1 + ANNOUNCE_JITTER))
+        try:
+            send_available()
+        except OSError:
+            pass  # The socket is being replaced or closed
@@ -0,0 +1,192 @@
+import json  # Library for handling JSON encoding/decoding
+import os  # Library for atomic renames
+import time  # Library for the time a snapshot was written
+from pathlib import Path  # Library to work with file system paths
+
+# The tracker keeps its peers and matches in memory and mirrors every change to disk so a restart
+# does not make the whole swarm rediscover. The state on disk is a snapshot plus an append-only
+# journal of the changes made since that snapshot. The snapshot stores each table as parallel
+# columns, which parse much faster than one list per row; the journal holds one record per line:
+#   ["S", key, peer_type, tcp_port, files]    seeder announced the files it offers
+#   ["F", key, added, removed]                seeder added and removed files from its list
+#   ["L", key, peer_type, tcp_port, file_id]  leecher announced the file it wants
+#   ["M", leecher_key, partners, made_time]   leecher was matched with seeders or uploading leechers
+#   ["R", match_key, deadline]                match queued for removal at deadline
+#   ["D", kind, key]                          seeder ("S"), leecher ("L") or match ("M") removed
+# Peer keys are the packed integers made by UDP_Server.create_custom_key and match keys pack two of them.
+# Matches are grouped by leecher and deleted with their peers, so the snapshot stores them as the positions
+# of each leecher and its partners in the peer columns, and the time it was written as the time they were made.
+# Snapshot and journal carry a generation number and a journal is only replayed on top of the
+# snapshot of the same generation, so a crash while compacting never applies a change twice.
+SNAPSHOT_SUFFIX = ".snapshot"  # Suffix of the snapshot file
+JOURNAL_SUFFIX = ".journal"  # Suffix of the journal file
+STATE_VERSION = 3  # Layout of the records; state written with another layout is ignored
+MATCH_KEY_BITS = 48  # A match key is the seeder key shifted left by this many bits, plus the leecher key
+COMPACT_AFTER_RECORDS = 20000  # Journal records always allowed before the state is compacted into a new snapshot
+COMPACT_FRACTION = 0.1  # Beyond that, a journal with more records than this fraction of the live ones is compacted
+
+
+def state_paths(state_path):
+    """Return the snapshot and journal paths for the tracker state stored under state_path."""
+    state_path = Path(state_path)
+    return state_path.with_name(state_path.name + SNAPSHOT_SUFFIX), state_path.with_name(state_path.name + JOURNAL_SUFFIX)
+
+
+def create_state():
+    """Create the empty state records are replayed into."""
+    return {
+        "seeders": {},  # key -> (peer_type, tcp_port, files)
+        "leechers": {},  # key -> (peer_type, tcp_port, file_id)
+        "matches": {},  # leecher key -> {seeder (or uploading leecher) key -> match_made_time}
+        "removals": {},  # match_key -> deadline
+    }
+
+
+def split_match_key(match_key):
+    """Return the seeder and leecher keys packed in a match key."""
+    return match_key >> MATCH_KEY_BITS, match_key & ((1 << MATCH_KEY_BITS) - 1)
+
+
+def remove_match(matches, match_key):
+    """Delete a match from a leecher -> {seeder -> time} table; returns True if it was there."""
+    seeder, leecher = split_match_key(match_key)
+    partners = matches.get(leecher)
+    if partners is None or partners.pop(seeder, None) is None:
+        return False
+    if not partners:
+        del matches[leecher]
+    return True
+
+
+def apply_record(state, record):
+    """Apply one snapshot or journal record to the state."""
+    kind = record[0]
+    if kind == "S":
+        state["seeders"][record[1]] = (record[2], record[3], record[4])
+    elif kind == "F":
+        row = state["seeders"].get(record[1])
+        if row is not None:
+            files = dict.fromkeys(row[2])
+            for file in record[3]:
+                files.pop(file, None)
+            files.update(dict.fromkeys(record[2]))
+            state["seeders"][record[1]] = (row[0], row[1], list(files))
+    elif kind == "L":
+        state["leechers"][record[1]] = (record[2], record[3], record[4])
+    elif kind == "M":
+        state["matches"].setdefault(record[1], {}).update(dict.fromkeys(record[2], record[3]))
+    elif kind == "R":
+        state["removals"][record[1]] = record[2]
+    elif kind == "D":
+        if record[1] == "S":
+            state["seeders"].pop(record[2], None)
+        elif record[1] == "L":
+            state["leechers"].pop(record[2], None)
+        else:
+            remove_match(state["matches"], record[2])
+            state["removals"].pop(record[2], None)
+
+
+def read_journal(journal_path, generation):
+    """
+    Return the records of the journal belonging to generation and the length of its intact part.
+    Every record ends with a newline, so a record torn by a crash is recognised and dropped.
+    """
+    try:
+        data = Path(journal_path).read_bytes()
+    except OSError:
+        return [], 0
+    header_end = data.find(b"\n") + 1
+    intact_end = data.rfind(b"\n") + 1
+    try:
+        header = json.loads(data[:header_end]) if header_end else {}
+        if header.get("version") != STATE_VERSION or header.get("generation") != generation:
+            return [], 0  # The journal belongs to an older snapshot
+        body = data[header_end:intact_end]
+        records = json.loads(b"[" + body[:-1].replace(b"\n", b",") + b"]") if body else []  # One parse for the whole journal
+    except (ValueError, AttributeError):
+        return [], 0
+    return records, intact_end
+
+
+def load_state(state_path):
+    """Replay the snapshot and its journal; returns (generation, state, journal)."""
+    snapshot_path, journal_path = state_paths(state_path)
+    state = create_state()
+    generation = 0
+    try:
+        snapshot = json.loads(snapshot_path.read_bytes())
+        if snapshot.get("version") != STATE_VERSION:
+            raise ValueError(f"layout version {snapshot.get('version')} is not {STATE_VERSION}")
+        generation = snapshot["generation"]
+        for table in ["seeders", "leechers"]:
+            columns = snapshot[table]
+            state[table] = dict(zip(columns["keys"], zip(columns["peer_types"], columns["tcp_ports"], columns["files"])))
+        peer_keys = snapshot["seeders"]["keys"] + snapshot["leechers"]["keys"]
+        made = snapshot["time"]
+        state["matches"] = {peer_keys[leecher]: dict.fromkeys([peer_keys[partner] for partner in partners], made)
+                            for leecher, partners in zip(snapshot["matches"]["leechers"], snapshot["matches"]["partners"])}
+        state["removals"] = dict(zip(snapshot["removals"]["keys"], snapshot["removals"]["deadlines"]))
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        if snapshot_path.exists():
+            print(f"Ignoring unreadable tracker snapshot {snapshot_path}: {error}")
+    records, intact_length = read_journal(journal_path, generation)
+    for record in records:
+        apply_record(state, record)
+    return generation, state, open_journal(journal_path, generation, intact_length, len(records))
+
+
+def write_snapshot(state_path, generation, state):
+    """Atomically replace the snapshot with state and start an empty journal for generation."""
+    snapshot_path, journal_path = state_paths(state_path)
+    snapshot = {"version": STATE_VERSION, "generation": generation, "time": time.time()}
+    for table in ["seeders", "leechers"]:
+        rows = state[table]
+        snapshot[table] = {"keys": list(rows), "peer_types": [row[0] for row in rows.values()],
+                           "tcp_ports": [row[1] for row in rows.values()], "files": [row[2] for row in rows.values()]}
+    positions = {key: position for position, key in enumerate(snapshot["seeders"]["keys"] + snapshot["leechers"]["keys"])}
+    leechers, partners = [], []
+    for leecher, matched in state["matches"].items():
+        if leecher in positions:
+            leechers.append(positions[leecher])
+            partners.append([positions[partner] for partner in matched if partner in positions])
+    snapshot["matches"] = {"leechers": leechers, "partners": partners}
+    snapshot["removals"] = {"keys": list(state["removals"]), "deadlines": list(state["removals"].values())}
+    temporary_path = snapshot_path.with_name(snapshot_path.name + ".tmp")
+    with open(temporary_path, "w") as file:
+        file.write(json.dumps(snapshot, separators=(",", ":")))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, snapshot_path)  # Readers never see a half written snapshot
+    return open_journal(journal_path, generation)
+
+
+def open_journal(journal_path, generation, intact_length=0, records=0):
+    """
+    Open the journal of generation for appending; returns the journal record.
+    An intact journal is kept (minus any torn record at its end), otherwise a new one is started.
+    """
+    if intact_length:
+        file = open(journal_path, "r+")
+        file.truncate(intact_length)
+        file.seek(intact_length)
+    else:
+        file = open(journal_path, "w")
+        file.write(json.dumps({"version": STATE_VERSION, "generation": generation}) + "\n")
+    return {"file": file, "generation": generation, "records": records}
+
+
+def append_record(journal, record):
+    """Append one record to the journal; it reaches the disk on the next flush."""
+    journal["file"].write(json.dumps(record, separators=(",", ":")) + "\n")
+    journal["records"] += 1
+
+
+def flush_journal(journal):
+    """Hand the buffered journal records to the operating system."""
+    journal["file"].flush()
+
+
+def close_journal(journal):
+    """Flush and close the journal."""
+    journal["file"].close()
@@ -0,0 +1,133 @@
+import json  # Library for writing the stats file
+import math  # Library for the histogram bucket of a value
+import os  # Library for atomic renames
+import threading  # Library for guarding the metrics and dumping them in the background
+import time  # Library for rates, uptime and rate-limited progress
+from pathlib import Path  # Library to work with file system paths
+
+# Counters, gauges and histograms shared by every thread of one process (seeder, leecher or tracker).
+# Hot loops update them in batches (per request or per piece, never per byte) and a background thread
+# writes a snapshot to a JSON file every STATS_INTERVAL_SECONDS, so a transfer can be watched without
+# printing in its loop. Histograms keep power-of-two buckets, enough for percentiles within a factor of two.
+STATS_INTERVAL_SECONDS = 2  # How often the stats file is rewritten
+PROGRESS_INTERVAL_SECONDS = 1  # Progress lines are printed at most this often per transfer
+STATS_SUFFIX = "_stats.json"  # Suffix of the stats file each process writes
+
+metrics_lock = threading.Lock()  # Guards every table below
+counters = {}  # name -> running total
+gauges = {}  # name -> current value
+histograms = {}  # name -> {"count", "sum", "max", "buckets": {exponent: count}} with values below 2**exponent
+previous_counters = {}  # Counters at the last snapshot, for rates
+previous_snapshot_time = [time.monotonic()]  # Time of the last snapshot
+start_time = time.monotonic()  # Process start, for uptime
+progress_times = {}  # label -> time the last progress line was printed
+
+
+def count(name, amount=1):
+    """Add amount to a counter."""
+    with metrics_lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def read_counter(name):
+    """Return the running total of a counter."""
+    with metrics_lock:
+        return counters.get(name, 0)
+
+
+def set_total(name, total):
+    """Set a counter whose running total is kept elsewhere, so its rate is still reported."""
+    with metrics_lock:
+        counters[name] = total
+
+
+def set_gauge(name, value):
+    """Set a gauge to its current value."""
+    with metrics_lock:
+        gauges[name] = value
+
+
+def mark_time(name):
+    """Set a gauge to the seconds since the process started, the first time it is marked only."""
+    with metrics_lock:
+        gauges.setdefault(name, time.monotonic() - start_time)
+
+
+def observe(name, value):
+    """Record one value (a latency in milliseconds, a size in bytes...) in a histogram."""
+    bucket = math.frexp(value)[1] if value > 0 else 0
+    with metrics_lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": {}}
+        histogram["count"] += 1
+        histogram["sum"] += value
+        histogram["max"] = max(histogram["max"], value)
+        histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + 1
+
+
+def summarize_histogram(histogram):
+    """Return the count, mean, max and upper bounds of the 50th, 90th and 99th percentiles of a histogram."""
+    summary = {"count": histogram["count"], "mean": histogram["sum"] / histogram["count"], "max": histogram["max"]}
+    buckets = sorted(histogram["buckets"].items())
+    for percentile in [50, 90, 99]:
+        target = histogram["count"] * percentile / 100
+        seen = 0
+        for bucket, bucket_count in buckets:
+            seen += bucket_count
+            if seen >= target:
+                summary[f"p{percentile}"] = min(2.0 ** bucket, histogram["max"])
+                break
+    return summary
+
+
+def snapshot():
+    """Return every metric, with the rate per second of each counter since the previous snapshot."""
+    now = time.monotonic()
+    with metrics_lock:
+        elapsed = max(now - previous_snapshot_time[0], 1e-9)
+        rates = {name: (total - previous_counters.get(name, 0)) / elapsed for name, total in counters.items()}
+        previous_counters.clear()
+        previous_counters.update(counters)
+        previous_snapshot_time[0] = now
+        return {
+            "time": time.time(),
+            "uptime_seconds": now - start_time,
+            "cpu_seconds": time.process_time(),
+            "counters": dict(counters),
+            "rates": rates,
+            "gauges": dict(gauges),
+            "histograms": {name: summarize_histogram(histogram) for name, histogram in histograms.items()},
+        }
+
+
+def write_stats(stats_path):
+    """Atomically replace stats_path with a snapshot of the metrics."""
+    stats_path = Path(stats_path)
+    temporary_path = stats_path.with_name(stats_path.name + ".tmp")
+    temporary_path.write_text(json.dumps(snapshot(), indent=1))
+    os.replace(temporary_path, stats_path)  # Readers never see a half written file
+
+
+def dump_stats_periodically(stats_path):
+    """Rewrite the stats file every STATS_INTERVAL_SECONDS, run on a background thread."""
+    while True:
+        time.sleep(STATS_INTERVAL_SECONDS)
+        try:
+            write_stats(stats_path)
+        except OSError as error:
+            print(f"Could not write stats to {stats_path}: {error}")
+
+
+def start_stats_dump(stats_path):
+    """Start writing the metrics to stats_path in the background."""
+    threading.Thread(target=dump_stats_periodically, args=(stats_path,), daemon=True).start()
+
+
+def report_progress(label, done, total):
+    """Print the progress of a transfer, at most once per PROGRESS_INTERVAL_SECONDS and always when it completes."""
+    now = time.monotonic()
+    if done < total and now - progress_times.get(label, 0) < PROGRESS_INTERVAL_SECONDS:
+        return
+    progress_times[label] = now
+    print(f"{label} Progress : {100 * done / max(total, 1):.2f}")
@@ -1,12 +1,28 @@
 import socket
+import sys
 import time
 import json
 import datetime
+import random
+import asyncio
+import heapq
+import gc
+import Tracker_State
+from Transfer_Metrics import STATS_SUFFIX, observe, set_gauge, set_total, write_stats
 
 MAX_OFFLINE_INTERVAL_SECONDS = 10  # Time after which offline clients are removed
 UNMATCH_BUFFER_SECONDS = 10  # Time before a match is removed if inactive
 UDP_SERVER_PORT = 12000  # Port for UDP tracker server
 SERVER_REFRESH_RATE_SECONDS = 4  # Interval to refresh server state
+ANNOUNCE_INTERVAL_SECONDS = 4  # Interval peers are told to re-announce themselves at
+PROBE_AFTER_SECONDS = ANNOUNCE_INTERVAL_SECONDS * 1.5  # A peer silent for this long gets a single PING
+MAX_PROBES_PER_SECOND = 200  # Upper bound on liveness PINGs sent by the tracker
+MAX_MATCHED_SEEDERS = 10  # Max seeders sent to one leecher per refresh, chosen at random
+MAX_MATCHED_LEECHERS = 10  # Max other uploading leechers of the same file sent to a new leecher, chosen at random
+TRACKER_STATE_PATH = "tracker_state"  # Snapshot and journal of the tracker state are stored next to this path
+TRACKER_STATS_PATH = "tracker" + STATS_SUFFIX  # Datagram rates, peer counts and match latency, rewritten on every refresh
+JOURNAL_FLUSH_SECONDS = 1  # Interval at which journal records are written out
+RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024  # Socket buffer for bursts of announces (the OS may cap it lower)
 
 def send_message(TCP_connection_socket, msg_type, msg_content):
     """Generic function to send messages over TCP."""
@@ -41,14 +57,13 @@ def send_available(UDP_socket, server_address, file_name, tcp_port, folder):
     }
     UDP_socket.sendto(json.dumps(msg).encode(), server_address)
 
-def send_ping(UDP_socket, peers):
-    """Send a PING message via UDP to all active peers."""
-    msg = json.dumps({"message_type": "PING"})
-    
-    for peer_key, peer_data in peers.items():
-        peer_address = (peer_data["ip"], peer_data["port"])
-        UDP_socket.sendto(msg.encode(), peer_address)
-        print(f"Sent PING to {peer_address}")
+PING_MESSAGE = json.dumps({"message_type": "PING"}).encode()
+ANNOUNCE_OK_MESSAGE = json.dumps({"message_type": "ANNOUNCE_OK", "interval": ANNOUNCE_INTERVAL_SECONDS}).encode()
+RESYNC_MESSAGE = json.dumps({"message_type": "RESYNC"}).encode()  # Asks a seeder to announce all of its files again
+
+def send_ping(UDP_socket, ip_port):
+    """Send a PING message via UDP to a peer that has gone quiet."""
+    UDP_socket.sendto(PING_MESSAGE, get_ip_and_port(ip_port))
 
 
 def send_file_transfer(TCP_connection_socket, file_path):
@@ -61,120 +76,478 @@ def send_file_transfer(TCP_connection_socket, file_path):
     else:
         send_message(TCP_connection_socket, "ERROR", "File Not Found")
 
-def remove_offline_clients(log, max_offline_interval_seconds):
-    """Remove offline clients that exceeded allowed offline duration."""
-    clients_to_delete = [ip_port for ip_port in log if time.time() - log[ip_port]["last_seen"] > max_offline_interval_seconds]
-    for ip_port in clients_to_delete:
-        del log[ip_port]  # Use del to safely remove item
-
-def remove_match(matches, matches_to_remove, key_to_remove, unmatch_buffer_seconds, i):
-    """Remove a match if its duration exceeds the unmatch buffer time."""
-    if time.time() - matches[key_to_remove]["match_made_time"] > unmatch_buffer_seconds:
-        del matches[key_to_remove]
-        matches_to_remove.pop(i)
-        print("Match removed")
-
-def remove_queued_matches(matches, matches_to_remove, unmatch_buffer_seconds):
-    """Remove expired queued matches."""
-    if matches_to_remove:
-        for i, match in enumerate(matches_to_remove):
-            seeder_ip_port = create_custom_key(match["ip"], match["port"])
-            leecher_ip_port = create_custom_key(match["other_ip"], match["other_port"])
-            key_to_remove = f"{seeder_ip_port}_{leecher_ip_port}"
-            remove_match(matches, matches_to_remove, key_to_remove, unmatch_buffer_seconds, i)
-
 def get_ip_and_port(ip_port_key):
     """Extract IP and port from custom key format."""
-    ip, port = ip_port_key.split("_")
-    return ip, int(port)
+    return socket.inet_ntoa((ip_port_key >> 16).to_bytes(4, "big")), ip_port_key & 0xFFFF
 
 def create_custom_key(ip, port):
-    """Create a unique key using IP and port for tracking clients."""
-    return f"{ip}_{port}"
+    """Create a unique key for tracking clients by packing the IPv4 address and port into one integer."""
+    return int.from_bytes(socket.inet_aton(ip), "big") << 16 | port
+
+def create_match_key(seeder_ip_port, leecher_ip_port):
+    """Create the key of a seeder/leecher match by packing both peer keys into one integer."""
+    return seeder_ip_port << Tracker_State.MATCH_KEY_BITS | leecher_ip_port
+
+def is_matched(matches, seeder_ip_port, leecher_ip_port):
+    """Return True if a seeder (or another leecher that uploads) was already matched with a leecher."""
+    return seeder_ip_port in matches.get(leecher_ip_port, ())
+
+def count_matches(matches):
+    """Return the number of matches in a leecher -> {seeder -> time} table."""
+    return sum(map(len, matches.values()))
+
+def intern_file_ids(file_id):
+    """Share one string per file name between all peers and indexes; seeders' lists become tuples."""
+    if isinstance(file_id, str):
+        return sys.intern(file_id)
+    return tuple(sys.intern(file) for file in file_id)
+
+class Peer_Record:
+    """
+    One tracked peer. Its address is the key it is stored under, so the record only holds what the
+    peer announced; __slots__ keeps it a fraction of the size of a dict.
+    """
+    __slots__ = ("id", "file_id", "tcp_port", "last_seen", "payload")
+
+    def __init__(self, peer_type, file_id, tcp_port, last_seen):
+        self.id = sys.intern(peer_type)
+        self.file_id = intern_file_ids(file_id)
+        self.tcp_port = tcp_port  # Port seeders accept leechers on
+        self.last_seen = last_seen
+        self.payload = None  # MATCH_FOUND message describing this peer, built on its first match
 
 def write_log(log, data, address):
     """Write peer connection details to log."""
     custom_key = create_custom_key(address[0], address[1])
-    Seeder_files = data["file_id"]
-    log[custom_key] = {
-        "id": data["type_of_peer"],
-        "ip": address[0],
-        "port": address[1],
-        "file_id": data["file_id"],
-        "last_seen": time.time()
-    }
+    log[custom_key] = Peer_Record(data["type_of_peer"], data["file_id"], data.get("tcp_port"), time.time())
 
 
 def check_file(files, file):
     return file in files
 
-def main():
-    UDP_server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    UDP_server_socket.bind(('', UDP_SERVER_PORT))
-    UDP_server_socket.settimeout(SERVER_REFRESH_RATE_SECONDS)
-    print("Tracker is online.")
+def index_peer(file_index, ip_port, files):
+    """Add a peer to a file_id -> peers index for each of its files."""
+    for file in files:
+        file_index.setdefault(file, set()).add(ip_port)
 
-    log_seeders = {}
-    log_leechers = {}
-    matches = {}
-    matches_to_remove = []
-    
+def unindex_peer(file_index, ip_port, files):
+    """Remove a peer from a file_id -> peers index."""
+    for file in files:
+        peers = file_index.get(file)
+        if peers is not None:
+            peers.discard(ip_port)
+            if not peers:
+                del file_index[file]
+
+def register_seeder(log_seeders, file_index, data, address):
+    """Log a seeder announcement and keep the file index in step with the files it offers."""
+    custom_key = create_custom_key(address[0], address[1])
+    if isinstance(data["file_id"], str):
+        data["file_id"] = [data["file_id"]]  # Peers that finished a download announce a single file
+    if custom_key in log_seeders:
+        unindex_peer(file_index, custom_key, log_seeders[custom_key].file_id)  # It may offer different files now
+    write_log(log_seeders, data, address)
+    index_peer(file_index, custom_key, log_seeders[custom_key].file_id)
+
+def match_payload(ip_port, peer_data, file_id):
+    """
+    Return the MATCH_FOUND message describing a peer and the file it was matched on.
+    Everything but the file is encoded once per announce; seeders' whole file lists are never sent.
+    """
+    if peer_data.payload is None:
+        ip, port = get_ip_and_port(ip_port)
+        peer_data.payload = json.dumps({
+            "message_type": "MATCH_FOUND",
+            "id": peer_data.id,
+            "ip": ip,
+            "port": port,
+            "tcp_port": peer_data.tcp_port,
+        }).encode()[:-1]  # Left open so the matched file can be appended
+    return b"".join((peer_data.payload, b', "file_id": ', json.dumps(file_id).encode(), b"}"))
+
+def find_seeders(file_index, matches, leecher_ip_port, file_id, limit):
+    """Return up to limit random seeders of file_id that are not matched with the leecher yet."""
+    candidates = [seeder_ip_port for seeder_ip_port in file_index.get(file_id, ())
+                  if not is_matched(matches, seeder_ip_port, leecher_ip_port)]
+    if len(candidates) > limit:
+        candidates = random.sample(candidates, limit)
+    return candidates
+
+def find_leechers(leecher_index, log_leechers, matches, leecher_ip_port, file_id, limit):
+    """Return up to limit random other leechers of file_id that accept uploads and are not matched with the leecher yet."""
+    candidates = [other_ip_port for other_ip_port in leecher_index.get(file_id, ())
+                  if other_ip_port != leecher_ip_port and log_leechers[other_ip_port].tcp_port
+                  and not is_matched(matches, other_ip_port, leecher_ip_port)
+                  and not is_matched(matches, leecher_ip_port, other_ip_port)]
+    if len(candidates) > limit:
+        candidates = random.sample(candidates, limit)
+    return candidates
+
+def send_match(UDP_server_socket, matches, seeder_ip_port, seeder_data, leecher_ip_port, leecher_data):
+    """Record a match and tell both the seeder and the leecher about each other."""
+    matches.setdefault(leecher_ip_port, {})[seeder_ip_port] = time.time()  # Time the match was made
+    UDP_server_socket.sendto(match_payload(seeder_ip_port, seeder_data, leecher_data.file_id), get_ip_and_port(leecher_ip_port))
+    UDP_server_socket.sendto(match_payload(leecher_ip_port, leecher_data, leecher_data.file_id), get_ip_and_port(seeder_ip_port))
+
+def match_leecher(UDP_server_socket, log_seeders, file_index, matches, leecher_ip_port, leecher_data):
+    """Match one leecher with up to MAX_MATCHED_SEEDERS seeders of its file, looking only at seeders indexed under that file."""
+    for seeder_ip_port in find_seeders(file_index, matches, leecher_ip_port, leecher_data.file_id, MAX_MATCHED_SEEDERS):
+        send_match(UDP_server_socket, matches, seeder_ip_port, log_seeders[seeder_ip_port], leecher_ip_port, leecher_data)
+
+def match_peers(UDP_server_socket, log_seeders, log_leechers, file_index, matches):
+    """Match every leecher with seeders of its file and tell both sides."""
+    for leecher_ip_port, leecher_data in log_leechers.items():
+        match_leecher(UDP_server_socket, log_seeders, file_index, matches, leecher_ip_port, leecher_data)
+
+class Tracker_Protocol(asyncio.DatagramProtocol):
+    """
+    Handles every tracker datagram as soon as it arrives.
+    Peers and queued match removals expire from a heap of deadlines, so housekeeping only touches
+    entries that are due instead of sweeping every log on each refresh.
+    Peers re-announce every ANNOUNCE_INTERVAL_SECONDS on their own; only peers that go quiet are
+    PINGed, at most MAX_PROBES_PER_SECOND, before they are removed.
+    With a state_path every change is journaled and the state is restored when the tracker restarts.
+    """
+
+    def __init__(self, state_path=None, stats_path=None):
+        self.log_seeders = {}
+        self.log_leechers = {}
+        self.file_index = {}  # file_id -> set of seeder keys offering it
+        self.leecher_index = {}  # file_id -> set of leecher keys waiting for it
+        self.matches = {}  # leecher key -> {seeder (or uploading leecher) key -> time the match was made}, dropped with the leecher
+        self.match_removals = {}  # match_key -> deadline of matches queued for removal
+        self.timers = []  # Heap of (deadline, kind, key) with kind "S" (seeder), "L" (leecher) or "M" (match)
+        self.scheduled = set()  # (kind, key) pairs that already have an entry in the heap
+        self.timer_handle = None  # Loop callback for the earliest deadline
+        self.timer_deadline = None
+        self.probe_tokens = MAX_PROBES_PER_SECOND  # Token bucket limiting liveness PINGs
+        self.probe_refill_time = time.time()
+        self.datagrams_received = 0
+        self.datagrams_sent = 0
+        self.state_path = state_path
+        self.stats_path = stats_path  # Where refresh() writes the tracker metrics, None to skip them
+        self.journal = None  # Open journal while persistence is enabled
+        self.generation = 0  # Generation of the snapshot the journal belongs to
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        if self.state_path is not None:
+            self.restore_state()
+            self.loop.call_later(JOURNAL_FLUSH_SECONDS, self.flush_state)
+        self.loop.call_later(SERVER_REFRESH_RATE_SECONDS, self.refresh)
+
+    def datagram_received(self, message, message_source_address):
+        try:
+            data = json.loads(message.decode())
+        except ValueError:
+            return  # Ignore datagrams that are not JSON
+        self.datagrams_received += 1
+        custom_key = create_custom_key(message_source_address[0], message_source_address[1])
+        message_type = data.get("message_type")
+
+        if message_type == "DISCOVER_PEER":
+            self.sendto(ANNOUNCE_OK_MESSAGE, message_source_address)  # Tell the peer how often to re-announce
+            if data["type_of_peer"] in ["S", "CS"]:
+                register_seeder(self.log_seeders, self.file_index, data, message_source_address)
+                seeder_data = self.log_seeders[custom_key]
+                self.record(["S", custom_key, seeder_data.id, seeder_data.tcp_port, seeder_data.file_id])
+                self.add_timer(seeder_data.last_seen + PROBE_AFTER_SECONDS, "S", custom_key)
+                self.match_seeder(custom_key)
+            elif data["type_of_peer"] == "L":
+                received_time = time.perf_counter()
+                if custom_key in self.log_leechers:
+                    previous_file = self.log_leechers[custom_key].file_id
+                    unindex_peer(self.leecher_index, custom_key, [previous_file])
+                    if previous_file != data["file_id"]:
+                        self.remove_peer_matches(custom_key, [previous_file])  # Matched for a file it no longer wants
+                write_log(self.log_leechers, data, message_source_address)
+                leecher_data = self.log_leechers[custom_key]
+                index_peer(self.leecher_index, custom_key, [leecher_data.file_id])
+                self.record(["L", custom_key, leecher_data.id, leecher_data.tcp_port, leecher_data.file_id])
+                self.add_timer(leecher_data.last_seen + PROBE_AFTER_SECONDS, "L", custom_key)
+                self.match_leecher(custom_key)
+                observe("tracker.match_latency_ms", (time.perf_counter() - received_time) * 1000)  # Announce in, matches out
+
+        elif message_type == "REMOVE_MATCH":
+            seeder_ip_port = create_custom_key(data["ip"], data["port"])
+            match_key = create_match_key(seeder_ip_port, custom_key)
+            made = self.matches.get(custom_key, {}).get(seeder_ip_port)
+            if made is not None and match_key not in self.match_removals:
+                deadline = made + UNMATCH_BUFFER_SECONDS
+                self.match_removals[match_key] = deadline
+                self.record(["R", match_key, deadline])
+                self.add_timer(deadline, "M", match_key)
+
+        elif message_type == "ANNOUNCE_FILES":
+            if custom_key in self.log_seeders:
+                self.update_seeder_files(custom_key, data.get("added", []), data.get("removed", []))
+
+        elif message_type == "AVAILABLE":
+            log = self.log_seeders if data.get("type_of_peer") in ["S", "CS"] else self.log_leechers
+            if custom_key in log:
+                log[custom_key].last_seen = time.time()
+            total_files = data.get("total_files")
+            if total_files is not None and (custom_key not in log or len(log[custom_key].file_id) != total_files):
+                self.sendto(RESYNC_MESSAGE, message_source_address)  # Missed part of its file list or forgot it
+
+    def sendto(self, data, address):
+        """Send a datagram and count it."""
+        self.datagrams_sent += 1
+        self.transport.sendto(data, address)
+
+    def take_probe_token(self, now):
+        """Return True if a liveness PING may be sent now without exceeding MAX_PROBES_PER_SECOND."""
+        self.probe_tokens = min(MAX_PROBES_PER_SECOND, self.probe_tokens + (now - self.probe_refill_time) * MAX_PROBES_PER_SECOND)
+        self.probe_refill_time = now
+        if self.probe_tokens < 1:
+            return False
+        self.probe_tokens -= 1
+        return True
+
+    def send_match(self, seeder_ip_port, leecher_ip_port, seeder_data=None):
+        """Match a seeder (or another leecher that uploads, given as seeder_data) with a leecher and tell both."""
+        if seeder_data is None:
+            seeder_data = self.log_seeders[seeder_ip_port]
+        send_match(self, self.matches, seeder_ip_port, seeder_data, leecher_ip_port, self.log_leechers[leecher_ip_port])
+
+    def record_matches(self, leecher_ip_port, partners):
+        """Journal the matches just made for one leecher in a single record."""
+        self.record(["M", leecher_ip_port, partners, self.matches[leecher_ip_port][partners[0]]])
+
+    def remove_match(self, match_key):
+        """Forget a match and journal its removal."""
+        Tracker_State.remove_match(self.matches, match_key)
+        self.match_removals.pop(match_key, None)
+        self.record(["D", "M", match_key])
+
+    def remove_peer_matches(self, ip_port, files):
+        """Delete the matches of a peer as a leecher, and those it is part of for the leechers of files."""
+        for partner in list(self.matches.get(ip_port, ())):
+            self.remove_match(create_match_key(partner, ip_port))
+        for file in files:
+            for leecher_ip_port in self.leecher_index.get(file, ()):
+                if is_matched(self.matches, ip_port, leecher_ip_port):
+                    self.remove_match(create_match_key(ip_port, leecher_ip_port))
+
+    def match_leecher(self, leecher_ip_port):
+        """
+        Match a newly announced leecher with up to MAX_MATCHED_SEEDERS seeders of its file.
+        A leecher that accepts uploads is also matched with up to MAX_MATCHED_LEECHERS other such
+        leechers of the file, so both sides can trade the pieces they already have.
+        """
+        leecher_data = self.log_leechers[leecher_ip_port]
+        file_id = leecher_data.file_id
+        partners = find_seeders(self.file_index, self.matches, leecher_ip_port, file_id, MAX_MATCHED_SEEDERS)
+        for seeder_ip_port in partners:
+            self.send_match(seeder_ip_port, leecher_ip_port)
+        if leecher_data.tcp_port:
+            other_leechers = find_leechers(self.leecher_index, self.log_leechers, self.matches, leecher_ip_port, file_id, MAX_MATCHED_LEECHERS)
+            for other_ip_port in other_leechers:
+                self.send_match(other_ip_port, leecher_ip_port, self.log_leechers[other_ip_port])
+            partners += other_leechers
+        if partners:
+            self.record_matches(leecher_ip_port, partners)
+
+    def update_seeder_files(self, seeder_ip_port, added, removed):
+        """Apply an ANNOUNCE_FILES diff to a seeder's file list and match the files it added."""
+        seeder_data = self.log_seeders[seeder_ip_port]
+        added = intern_file_ids(added)
+        files = dict.fromkeys(seeder_data.file_id)  # Ordered set of the seeder's files
+        for file in removed:
+            files.pop(file, None)
+        unindex_peer(self.file_index, seeder_ip_port, removed)
+        files.update(dict.fromkeys(added))
+        index_peer(self.file_index, seeder_ip_port, added)
+        seeder_data.file_id = tuple(files)
+        seeder_data.last_seen = time.time()
+        self.record(["F", seeder_ip_port, list(added), removed])
+        self.match_seeder(seeder_ip_port, added)
+
+    def match_seeder(self, seeder_ip_port, files=None):
+        """Match a newly announced seeder with the leechers already waiting for its files (or just the given ones)."""
+        for file in self.log_seeders[seeder_ip_port].file_id if files is None else files:
+            for leecher_ip_port in self.leecher_index.get(file, ()):
+                if not is_matched(self.matches, seeder_ip_port, leecher_ip_port):
+                    self.send_match(seeder_ip_port, leecher_ip_port)
+                    self.record_matches(leecher_ip_port, [seeder_ip_port])
+
+    def add_timer(self, deadline, kind, key):
+        """Schedule an expiry check for a peer or match unless one is already pending."""
+        if (kind, key) in self.scheduled:
+            return
+        self.scheduled.add((kind, key))
+        heapq.heappush(self.timers, (deadline, kind, key))
+        self.schedule_expiry()
+
+    def schedule_expiry(self):
+        """Arrange for expire() to run at the earliest deadline in the heap."""
+        if not self.timers or (self.timer_deadline is not None and self.timer_deadline <= self.timers[0][0]):
+            return
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+        self.timer_deadline = self.timers[0][0]
+        self.timer_handle = self.loop.call_later(max(0, self.timer_deadline - time.time()), self.expire)
+
+    def expire(self):
+        """Remove peers that went silent and matches whose buffer ran out; re-arm peers that are still alive."""
+        self.timer_handle = None
+        self.timer_deadline = None
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, kind, key = heapq.heappop(self.timers)
+            self.scheduled.discard((kind, key))
+            if kind == "M":
+                if key in self.match_removals:
+                    self.remove_match(key)
+                continue
+            log = self.log_seeders if kind == "S" else self.log_leechers
+            peer_data = log.get(key)
+            if peer_data is None:
+                continue
+            silent_seconds = now - peer_data.last_seen
+            if silent_seconds > MAX_OFFLINE_INTERVAL_SECONDS:
+                self.remove_peer(kind, key)
+            elif silent_seconds > PROBE_AFTER_SECONDS:
+                if self.take_probe_token(now):
+                    send_ping(self, key)  # Last chance to answer before removal
+                    self.add_timer(peer_data.last_seen + MAX_OFFLINE_INTERVAL_SECONDS, kind, key)
+                else:
+                    self.add_timer(now + 1 / MAX_PROBES_PER_SECOND, kind, key)  # Over the probe budget, try shortly
+            else:
+                self.add_timer(peer_data.last_seen + PROBE_AFTER_SECONDS, kind, key)  # Announced since, check again later
+        self.schedule_expiry()
+
+    def remove_peer(self, kind, key):
+        """Forget a seeder ("S") or leecher ("L") that went silent, with its matches once it is gone in both roles."""
+        log = self.log_seeders if kind == "S" else self.log_leechers
+        peer_data = log.pop(key)
+        files = peer_data.file_id if kind == "S" else [peer_data.file_id]
+        unindex_peer(self.file_index if kind == "S" else self.leecher_index, key, files)
+        self.record(["D", kind, key])
+        if key not in self.log_seeders and key not in self.log_leechers:
+            self.remove_peer_matches(key, files)
+
+    def record(self, record):
+        """Journal a change to the tracker state when persistence is enabled."""
+        if self.journal is not None:
+            Tracker_State.append_record(self.journal, record)
+
+    def restore_state(self):
+        """
+        Rebuild peers, indexes, matches and timers from the snapshot and journal.
+        Restored peers count as seen now, so live peers have a full probe period to announce again.
+        """
+        gc.disable()  # Replay allocates millions of long-lived objects, collecting them midway only slows it down
+        try:
+            self.generation, state, self.journal = Tracker_State.load_state(self.state_path)
+            now = time.time()
+            timers = []
+            for kind, log, index, records in [("S", self.log_seeders, self.file_index, state["seeders"]),
+                                              ("L", self.log_leechers, self.leecher_index, state["leechers"])]:
+                for key, (peer_type, tcp_port, file_id) in records.items():
+                    peer_data = log[key] = Peer_Record(peer_type, file_id, tcp_port, now)
+                    for file in peer_data.file_id if kind == "S" else [peer_data.file_id]:
+                        index.setdefault(file, set()).add(key)
+                    timers.append((now + PROBE_AFTER_SECONDS, kind, key))
+            self.matches = state["matches"]  # Already grouped by leecher
+            for match_key, deadline in state["removals"].items():
+                if is_matched(self.matches, *Tracker_State.split_match_key(match_key)):
+                    self.match_removals[match_key] = deadline
+                    timers.append((deadline, "M", match_key))
+            self.timers.extend(timers)  # One heapify instead of a push per restored entry
+            heapq.heapify(self.timers)
+            self.scheduled.update((kind, key) for _, kind, key in timers)
+            self.schedule_expiry()
+        finally:
+            gc.freeze()  # Keep the restored state out of later collections too
+            gc.enable()
+        if self.log_seeders or self.log_leechers:
+            print(f"Restored {len(self.log_seeders)} seeders, {len(self.log_leechers)} leechers and {count_matches(self.matches)} matches.")
+
+    def snapshot_state(self):
+        """Return the tracker state in the form Tracker_State writes as a snapshot."""
+        state = Tracker_State.create_state()
+        state["seeders"] = {key: (data.id, data.tcp_port, data.file_id) for key, data in self.log_seeders.items()}
+        state["leechers"] = {key: (data.id, data.tcp_port, data.file_id) for key, data in self.log_leechers.items()}
+        state["matches"] = self.matches  # Written out before the tracker handles another datagram
+        state["removals"] = dict(self.match_removals)
+        return state
+
+    def compact_state(self):
+        """Write the current state as a new snapshot and start an empty journal."""
+        if self.journal is not None:
+            Tracker_State.close_journal(self.journal)
+        self.generation += 1
+        self.journal = Tracker_State.write_snapshot(self.state_path, self.generation, self.snapshot_state())
+
+    def journal_limit(self):
+        """
+        Return the number of journal records beyond which the state is compacted. Replaying a journal
+        costs more per record than loading the snapshot, so keeping it to a fraction of the live
+        records bounds the time a restart takes.
+        """
+        live_records = len(self.log_seeders) + len(self.log_leechers) + count_matches(self.matches)
+        return max(Tracker_State.COMPACT_AFTER_RECORDS, int(Tracker_State.COMPACT_FRACTION * live_records))
+
+    def flush_state(self):
+        """Write out journal records every JOURNAL_FLUSH_SECONDS, compacting a journal that outgrew the state."""
+        if self.journal is None:
+            return  # Persistence was closed
+        if self.journal["records"] > self.journal_limit():
+            self.compact_state()
+        else:
+            Tracker_State.flush_journal(self.journal)
+        self.loop.call_later(JOURNAL_FLUSH_SECONDS, self.flush_state)
+
+    def close_state(self):
+        """Leave a fresh snapshot behind so the next start replays no journal."""
+        if self.journal is not None:
+            self.compact_state()
+            Tracker_State.close_journal(self.journal)
+            self.journal = None
+
+    def write_stats(self):
+        """Write the tracker metrics to the stats file, if there is one."""
+        if self.stats_path is None:
+            return
+        set_total("tracker.datagrams_received", self.datagrams_received)
+        set_total("tracker.datagrams_sent", self.datagrams_sent)
+        set_gauge("tracker.seeders", len(self.log_seeders))
+        set_gauge("tracker.leechers", len(self.log_leechers))
+        set_gauge("tracker.matches", count_matches(self.matches))
+        try:
+            write_stats(self.stats_path)
+        except OSError as error:
+            print(f"Could not write stats to {self.stats_path}: {error}")
+
+    def refresh(self):
+        """Report the number of peers every SERVER_REFRESH_RATE_SECONDS and write the stats file."""
+        print(f"Seeders online: {len(self.log_seeders)} Leechers online: {len(self.log_leechers)} @ [{datetime.datetime.fromtimestamp(time.time()).strftime('%H:%M:%S')}]")
+        self.write_stats()
+        self.loop.call_later(SERVER_REFRESH_RATE_SECONDS, self.refresh)
+
+async def run_tracker():
+    """Serve the tracker protocol on UDP_SERVER_PORT until cancelled."""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(lambda: Tracker_Protocol(TRACKER_STATE_PATH, TRACKER_STATS_PATH), local_addr=("0.0.0.0", UDP_SERVER_PORT))
+    transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES)
+    print("Tracker is online.")
     try:
-        while True:
-            try:
-                message, message_source_address = UDP_server_socket.recvfrom(2048)
-                data = json.loads(message.decode())
-
-                if data["message_type"] == "DISCOVER_PEER":
-                    if data["type_of_peer"] in ["S", "CS"]:
-                        write_log(log_seeders, data, message_source_address)
-                        Seeder_files = data["file_id"]
-                    elif data["type_of_peer"] == "L":
-                        write_log(log_leechers, data, message_source_address)
-                        
-
-                elif data["message_type"] == "REMOVE_MATCH":
-                    data.update({"other_ip": message_source_address[0], "other_port": message_source_address[1]})
-                    matches_to_remove.append(data)
-                elif data["message_type"] == "AVAILABLE":
-                        custom_key = create_custom_key(message_source_address[0], message_source_address[1])
-    
-                        if data["type_of_peer"] in ["S", "CS"]:
-                            if custom_key in log_seeders:
-                                log_seeders[custom_key]["last_seen"] = time.time()
-                                
-
-                            elif data["type_of_peer"] == "L":
-                                if custom_key in log_leechers:
-                                    log_leechers[custom_key]["last_seen"] = time.time()
-                                                       
-
-            except socket.timeout:
-                remove_offline_clients(log_seeders, MAX_OFFLINE_INTERVAL_SECONDS)
-                remove_offline_clients(log_leechers, MAX_OFFLINE_INTERVAL_SECONDS)
-                remove_queued_matches(matches, matches_to_remove, UNMATCH_BUFFER_SECONDS)
-                print(f"Seeders online: {len(log_seeders)} Leechers online: {len(log_leechers)} @ [{datetime.datetime.fromtimestamp(time.time()).strftime('%H:%M:%S')}]")
-
-                
-                # Match leechers with seeders
-                if log_leechers and log_seeders:
-                    for leecher_ip_port, leecher_data in log_leechers.items():
-                        for seeder_ip_port, seeder_data in log_seeders.items():
-                            search_key = f"{seeder_ip_port}_{leecher_ip_port}"
-                            if leecher_data["file_id"] in Seeder_files and search_key not in matches:
-                                print("FOUND A MATCH!")
-                                matches[search_key] = {"match_made_time": time.time()}
-                                seeder_data["message_type"] = "MATCH_FOUND"
-                                leecher_data["message_type"] = "MATCH_FOUND"
-                                UDP_server_socket.sendto(json.dumps(seeder_data).encode(), get_ip_and_port(leecher_ip_port))
-                                UDP_server_socket.sendto(json.dumps(leecher_data).encode(), get_ip_and_port(seeder_ip_port))
-                send_ping(UDP_server_socket, log_seeders)
-                send_ping(UDP_server_socket, log_leechers)
+        await asyncio.Event().wait()  # Everything happens in the protocol callbacks
+    finally:
+        transport.close()
+        protocol.close_state()
+        protocol.write_stats()  # Final counters, including the CPU time of the whole run
 
+def main():
+    try:
+        asyncio.run(run_tracker())
     except KeyboardInterrupt:
         print("KeyboardInterrupt. Closing UDP socket.")
-        UDP_server_socket.close()
         exit()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        UDP_SERVER_PORT = int(sys.argv[1])  # Run a tracker on another port with: python UDP_Server.py <port>
     main()
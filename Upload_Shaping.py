@@ -0,0 +1,204 @@
+import json  # Library for reading the limits file
+import math  # Library for the infinite tokens of a new bucket
+import os  # Library for noticing when the limits file changes
+import random  # Library for the optimistic unchoke
+import threading  # Library for guarding the buckets and running the choker in the background
+import time  # Library for refilling buckets and pacing uploads
+from pathlib import Path  # Library to work with file system paths
+from Transfer_Metrics import count, set_gauge
+
+# Uploads are shaped by token buckets: one shared by every upload of the process, one per leecher connection
+# and one per served file, shared by the connections serving it. A bucket fills at its rate up to BURST_SECONDS
+# of it, and every block sent takes its size from each bucket that applies. A bucket that runs into debt holds
+# the sender back until it has refilled, so the tightest of the three limits sets the pace. The limits are read
+# on every block, so changing rate_limits (or the limits file a process watches) takes effect at once.
+# When more leechers are connected than "unchoked_uploads", the choker only sends to the ones that gave the most,
+# plus one chosen at random every round (the optimistic unchoke) so newcomers get pieces to share. The others
+# are choked: told to stop requesting, and their requests are ignored. A process that downloads as well (a
+# leecher sharing its pieces) ranks each leecher by the bytes it really received from it, matched by the upload
+# port the leecher reports. A pure seeder receives nothing, so it can only rank by the upload totals leechers
+# report about themselves: a leecher that lies about its total is unchoked first, and only the optimistic
+# unchoke keeps the others from starving.
+BURST_SECONDS = 0.05  # A bucket holds this many seconds of its rate, so short bursts go out at full speed
+MIN_BURST_BYTES = 64 * 1024  # ...but never less than a few blocks
+CHOKE_INTERVAL_SECONDS = 5  # How often uploads are rechoked and the limits file is read again
+LIMITS_SUFFIX = "_limits.json"  # Suffix of the JSON file each process reads its rate limits from
+rate_limits = {
+    "global": None,  # Bytes per second of every upload together (None = unlimited)
+    "connection": None,  # Bytes per second of each leecher connection
+    "file": None,  # Bytes per second of each file, over every connection serving it
+    "files": {},  # file_id -> bytes per second of that file, overriding "file"
+    "unchoked_uploads": 4,  # Leechers sent to at once, besides the optimistic unchoke (None = never choke)
+}
+
+uploads = []  # State of every open leecher connection
+uploads_lock = threading.Lock()  # Guards uploads, file_buckets and received_from
+received_from = {}  # (ip, upload port) of a peer -> bytes downloaded from it by this process
+global_bucket = {"tokens": math.inf, "updated": 0.0, "lock": threading.Lock()}  # Shared by every upload
+file_buckets = {}  # file_id -> bucket shared by the connections serving that file
+
+
+def create_bucket():
+    """Return a full token bucket."""
+    return {"tokens": math.inf, "updated": 0.0, "lock": threading.Lock()}
+
+
+def take_tokens(bucket, rate, amount):
+    """Take amount bytes from a bucket filling at rate bytes per second; returns the seconds until it is out of debt."""
+    if rate is None:
+        return 0.0
+    with bucket["lock"]:
+        now = time.monotonic()
+        burst = max(rate * BURST_SECONDS, MIN_BURST_BYTES)
+        bucket["tokens"] = min(burst, bucket["tokens"] + (now - bucket["updated"]) * rate) - amount
+        bucket["updated"] = now
+        return max(0.0, -bucket["tokens"] / rate)
+
+
+def file_bucket(file_id):
+    """Return the bucket of a served file."""
+    with uploads_lock:
+        bucket = file_buckets.get(file_id)
+        if bucket is None:
+            bucket = file_buckets[file_id] = create_bucket()
+        return bucket
+
+
+def shape_upload(upload, file_id, sent_bytes):
+    """Sleep until the global, connection and file buckets of an upload have all paid for sent_bytes."""
+    limits = rate_limits
+    file_rate = limits["files"].get(file_id, limits["file"])
+    wait = max(take_tokens(global_bucket, limits["global"], sent_bytes),
+               take_tokens(upload["bucket"], limits["connection"], sent_bytes))
+    if file_rate is not None:
+        wait = max(wait, take_tokens(file_bucket(file_id), file_rate, sent_bytes))
+    if wait > 0:
+        count("upload.shaping_wait_ms", wait * 1000)
+        time.sleep(wait)
+
+
+def create_upload(address=None):
+    """
+    Return the state of a new leecher connection, registered with the choker until remove_upload.
+    It starts choked when every unchoke slot is taken, and waits for a round to rank it or pick it at random.
+    """
+    upload = {
+        "address": address,
+        "file_id": None,  # Last file the leecher asked for
+        "bytes_sent": 0,
+        "started": time.monotonic(),
+        "bucket": create_bucket(),  # Per-connection limit
+        "choked": False,  # Set by the choker, the serving thread tells the leecher
+        "peer_uploaded": 0,  # Bytes the leecher reports having uploaded to others
+        "peer": None,  # (ip, upload port) of the leecher, once it reports the port it serves others on
+        "reported": False,  # Set by its first message
+    }
+    slots = rate_limits["unchoked_uploads"]
+    with uploads_lock:
+        upload["choked"] = slots is not None and sum(not other["choked"] for other in uploads) > slots
+        uploads.append(upload)
+    return upload
+
+
+def remove_upload(upload):
+    """Unregister the state of a closed leecher connection."""
+    with uploads_lock:
+        uploads.remove(upload)
+
+
+def record_received(peer, received_bytes):
+    """Count bytes downloaded from the peer at (ip, upload port), which ranks its leecher connections to us."""
+    with uploads_lock:
+        received_from[peer] = received_from.get(peer, 0) + received_bytes
+
+
+def upload_rank(upload):
+    """Return how much the leecher of an upload gave: bytes received from it if we download too, else what it reports."""
+    if received_from:
+        return received_from.get(upload["peer"], 0)
+    return upload["peer_uploaded"]
+
+
+def record_peer_report(upload, message):
+    """
+    Note the upload total and upload port a leecher reports in its messages. A choked leecher that gave
+    something is ranked as soon as it first reports, instead of waiting for the next round.
+    """
+    uploaded, port = message.get("uploaded"), message.get("upload_port")
+    if isinstance(uploaded, int):
+        upload["peer_uploaded"] = max(upload["peer_uploaded"], uploaded)
+    if isinstance(port, int) and upload["address"] is not None:
+        upload["peer"] = (upload["address"][0], port)
+    if not upload["reported"]:
+        upload["reported"] = True
+        if upload["choked"] and upload_rank(upload) > 0:
+            rechoke()
+
+
+def rechoke():
+    """Unchoke the uploads whose peers uploaded the most plus one at random, and choke the others."""
+    slots = rate_limits["unchoked_uploads"]
+    with uploads_lock:
+        active = list(uploads)
+        for file_id in set(file_buckets) - {upload["file_id"] for upload in active}:
+            del file_buckets[file_id]  # No connection serves it any more
+    if slots is None or len(active) <= slots + 1:
+        unchoked = active
+    else:
+        random.shuffle(active)  # Ties, such as leechers that have uploaded nothing yet, are broken at random
+        active.sort(key=upload_rank, reverse=True)
+        unchoked = active[:slots] + [random.choice(active[slots:])]  # Optimistic unchoke
+    unchoked_ids = {id(upload) for upload in unchoked}
+    for upload in active:
+        choked = id(upload) not in unchoked_ids
+        if upload["choked"] and not choked:
+            with upload["bucket"]["lock"]:  # No burst saved up while choked, or rotating unchokes would beat the connection limit
+                upload["bucket"]["tokens"], upload["bucket"]["updated"] = 0.0, time.monotonic()
+        upload["choked"] = choked
+    set_gauge("upload.choked_connections", len(active) - len(unchoked))
+
+
+def set_rate_limits(limits):
+    """Change some of rate_limits, e.g. {"global": 10_000_000}; raises ValueError for an unknown key or a bad value."""
+    if not isinstance(limits, dict):
+        raise ValueError("Rate limits must be a JSON object")
+    for key, value in limits.items():
+        if key not in rate_limits:
+            raise ValueError(f"Unknown rate limit {key}")
+        if key == "files" and not isinstance(value, dict):
+            raise ValueError("files must map file IDs to rates")
+        for rate in value.values() if key == "files" else [value]:
+            if rate is not None and (isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0):
+                raise ValueError(f"Invalid {key} limit {rate}")
+    rate_limits.update(limits)
+
+
+def load_rate_limits(limits_path, loaded):
+    """Apply the limits file when it changed since the modification time kept in loaded; a missing file changes nothing."""
+    try:
+        modified = os.stat(limits_path).st_mtime_ns
+    except FileNotFoundError:
+        return
+    if modified == loaded.get("modified"):
+        return
+    loaded["modified"] = modified
+    try:
+        set_rate_limits(json.loads(Path(limits_path).read_text()))
+        print(f"Upload limits from {limits_path}: {rate_limits}")
+    except (OSError, ValueError) as error:
+        print(f"Ignoring {limits_path}: {error}")
+
+
+def shape_periodically(limits_path):
+    """Read the limits file and rechoke every CHOKE_INTERVAL_SECONDS, run on a background thread."""
+    loaded = {}
+    while True:
+        if limits_path is not None:
+            load_rate_limits(limits_path, loaded)
+        rechoke()
+        time.sleep(CHOKE_INTERVAL_SECONDS)
+
+
+def start_upload_shaping(limits_path=None):
+    """Start the choker in the background, following the limits in limits_path while the process runs."""
+    threading.Thread(target=shape_periodically, args=(limits_path,), daemon=True).start()